@@ -0,0 +1,49 @@
+"""
+Contains functionality for adding the columns that the brazil odu.conf fixer's incremental scan
+uses to keep track of each modem's last check to the brazil odu tables.
+
+NOTE: This script only needs to be run once, by an account that's allowed to ALTER the tables.
+      Until it's run, the brazil odu.conf fixer keeps reading and writing the tables without
+      the new columns (and its incremental scans recheck every modem).
+"""
+
+import sys
+import os
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
+
+import traceback
+import urllib3
+from libs import common_utils
+from libs.beam_drift_db import BeamDriftDb, BRAZIL_ODU_TABLES
+
+urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+
+def add_tracking_columns_to_brazil_odu_tables():
+    """
+    Add the tracking columns to every brazil odu table that doesn't have them yet.
+    """
+    failed = []
+    with BeamDriftDb() as beam_drift_db:
+        for table in BRAZIL_ODU_TABLES:
+            if beam_drift_db.add_brazil_tracking_columns(table):
+                print(f" \n{table} has the tracking columns")
+            else:
+                failed.append(table)
+    if failed:
+        print(f" \nERROR: failed to add the tracking columns to {', '.join(failed)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    print(" \n================begin======================")
+    try:
+        add_tracking_columns_to_brazil_odu_tables()
+    except Exception:
+        common_utils.print_heading("SOMETHING WENT WRONG")
+        print()
+        traceback.print_exc()
+        raise
+    finally:
+        print(" \n=================end=======================\n")
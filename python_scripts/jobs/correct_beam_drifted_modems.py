@@ -12,6 +12,7 @@ import urllib3
 from libs import common_utils
 from libs.beam_drift_db import BeamDriftDb
 from libs.jumpbox import Jumpbox
+from libs.beam_drift_pipeline import BeamDriftPipeline, get_modems_left_to_re_pin
 from libs import beam_drift_utils
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -89,153 +90,206 @@ def correct_drifted_modems():
             already_matched_failed_to_pin,
         ) = beam_drift_utils.pin_to_goal_beams(already_matched)
 
-        # Step #4 - Wait for the modems whose beam pinnings we cleared in Step #2 to come online.
-        beam_drift_utils.print_step(
-            4, "waiting for modems to come online now that their beam pinnings are cleared"
-        )
-        online_after_clear, offline_after_clear = beam_drift_utils.wait_till_modems_are_online(
-            cleared, beam_drift_utils.get_wait_secs_for_online_after_clear()
-        )
-
-        # Step #5 - Restart CWMP on drifted modems.
-        beam_drift_utils.print_step(5, "restarting CWMP")
-        jumpbox = Jumpbox()
-        restarted_cwmp, failed_to_restart_cwmp = beam_drift_utils.restart_cwmp(
-            jumpbox, online_after_clear
-        )
-
-        # Step #6 - If any modems were restarted by CWMP, wait for them to come online.
-        beam_drift_utils.print_step(
-            6, "waiting for any modems rebooted by CWMP to come back online"
-        )
-        (
-            online_after_cwmp_restart,
-            offline_after_cwmp_restart,
-        ) = beam_drift_utils.wait_till_modems_are_online(
-            restarted_cwmp, beam_drift_utils.get_wait_secs_for_online_after_cwmp_restart()
-        )
-
-        # Step #7 - Check whether modems are on the correct beam now.
-        beam_drift_utils.print_step(
-            7, "checking whether the CWMP restart got modems on the right beam"
-        )
-        (
-            on_goal_beam_after_cwmp_restart,
-            on_wrong_beam_opp_pol_after_cwmp_restart,
-            on_wrong_beam_same_pol_after_cwmp_restart,
-            failed_to_check_beam_after_cwmp_restart,
-        ) = beam_drift_utils.check_beams_match_on_modem(
-            jumpbox, beam_drift_db, online_after_cwmp_restart, flag_pol_swap_issue_on_failure=False
-        )
-
-        if beam_drift_utils.is_fast_run():
-            # If the "fast run" box was checked, skip Step #8 - Step #13 & Step #15
-            common_utils.print_heading("skipping Step #8 - Step #13")
+        if beam_drift_utils.is_streaming_run():
+            # Step #4 - Step #15 - Move each modem whose beam pinning we cleared in Step #2
+            #                       through the remaining steps as soon as it's ready for
+            #                       them rather than waiting for the whole batch at each step.
+            common_utils.print_heading("running Step #4 - Step #15 on each modem independently")
+            jumpbox = Jumpbox()
+            results = BeamDriftPipeline(jumpbox, beam_drift_db).run(cleared)
+            offline_after_clear = results["offline_after_clear"]
+            failed_to_restart_cwmp = results["failed_to_restart_cwmp"]
+            offline_after_cwmp_restart = results["offline_after_cwmp_restart"]
+            on_goal_beam_after_cwmp_restart = results["on_goal_beam_after_cwmp_restart"]
+            failed_to_check_beam_after_cwmp_restart = results[
+                "failed_to_check_beam_after_cwmp_restart"
+            ]
+            goal_beam_in_lkg_same_pol = results["goal_beam_in_lkg_same_pol"]
+            goal_beam_in_lkg_opp_pol = results["goal_beam_in_lkg_opp_pol"]
+            no_lkg_found = results["no_lkg_found"]
+            failed_to_back_up_lkg = results["failed_to_back_up_lkg"]
+            error_pushing_lkg = results["error_pushing_lkg"]
+            pushed_lkg_files = results["pushed_lkg_files"]
+            offline_after_reboot = results["offline_after_reboot"]
+            online_after_reboot = results["online_after_reboot"]
+            failed_to_re_pin = results["failed_to_re_pin"]
+            on_wrong_beam_opp_pol = results["on_wrong_beam_opp_pol"]
+            on_wrong_beam_same_pol = results["on_wrong_beam_same_pol"]
+            failed_to_check_beam = results["failed_to_check_beam"]
+            on_goal_beam = results["on_goal_beam"]
+
+            # Step #14 - The pipeline only re-pins the modems it finished working on, so
+            #            re-pin the rest of the drifted modems here if we're preserving pinnings.
+            if beam_drift_utils.should_preserve_beam_pinnings():
+                beam_drift_utils.print_step(14, "re-pinning remaining modems to their goal beams")
+                _, failed_to_re_pin_remaining = beam_drift_utils.re_pin_beams(
+                    get_modems_left_to_re_pin(drifted_modems, results)
+                )
+                failed_to_re_pin += failed_to_re_pin_remaining
+            if not beam_drift_utils.is_fast_run():
+                beam_drift_db.record_fix_counts(
+                    fixed_by_cwmp_restart=len(on_goal_beam_after_cwmp_restart),
+                    fixed_by_lkg_update=len(on_goal_beam),
+                    verbose=common_utils.is_job_verbose(),
+                )
 
         else:
-            # Step #8 - Check if the modems have the goal beam in the LKG files. If they don't,
-            #           we'll proceed with updating those LKG files in Step #11.
-            beam_drift_utils.print_step(8, "check if goal beam info is missing from LKG file")
-            (
-                goal_beam_not_in_lkg,
-                goal_beam_in_lkg_same_pol,
-                goal_beam_in_lkg_opp_pol,
-                unknown_if_goal_in_lkg,
-            ) = beam_drift_utils.check_if_goal_beam_in_lkg(
-                jumpbox,
-                beam_drift_db,
-                on_wrong_beam_same_pol_after_cwmp_restart
-                + on_wrong_beam_opp_pol_after_cwmp_restart,
-            )
-
-            # Step #9 - For each beam to which any modem in this batch is trying to move,
-            #           obtain an LKG file from a modem currently online on that beam.
+            # Step #4 - Wait for the modems whose beam pinnings
+            #           we cleared in Step #2 to come online.
             beam_drift_utils.print_step(
-                9, "retrieving good LKG files from online modems on goal beams"
-            )
-            if beam_drift_utils.should_force_lkg_updates():
-                modems_whose_lkg_we_want_to_update = (
-                    goal_beam_not_in_lkg
-                    + goal_beam_in_lkg_same_pol
-                    + goal_beam_in_lkg_opp_pol
-                    + unknown_if_goal_in_lkg
-                )
-            else:
-                modems_whose_lkg_we_want_to_update = goal_beam_not_in_lkg + unknown_if_goal_in_lkg
-            found_good_lkg, no_lkg_found = beam_drift_utils.get_good_lkg_files(
-                jumpbox, modems_whose_lkg_we_want_to_update
-            )
-
-            # Step #10 - Back up the modems' existing LKG files just
-            #            in case something goes wrong in Step #11.
-            beam_drift_utils.print_step(10, "backing up existing LKG files on drifted modems")
-            backed_up_lkg_files, failed_to_back_up_lkg = beam_drift_utils.back_up_lkg_files(
-                jumpbox, found_good_lkg
+                4, "waiting for modems to come online now that their beam pinnings are cleared"
             )
-
-            # Step #11 - Push the good LKG files that we obtained in Step #9 onto the drifted
-            #            modems. This should give them the information they need to successfully
-            #            get online on the beam to which they're trying to move.
-            beam_drift_utils.print_step(11, "pushing good LKG files to drifted modems")
-            pushed_lkg_files, error_pushing_lkg = beam_drift_utils.push_good_lkg_files(
-                jumpbox, backed_up_lkg_files
+            (
+                online_after_clear,
+                offline_after_clear,
+            ) = beam_drift_utils.wait_till_modems_are_online(
+                cleared, beam_drift_utils.get_wait_secs_for_online_after_clear()
             )
 
-            # Step #12 - Reboot modems. Now that the modems have good LKG files on them,
-            #           they'll hopefully come back on the correct beam after we reboot them.
-            beam_drift_utils.print_step(
-                12, "rebooting drifted modems that now have good LKG files on them"
+            # Step #5 - Restart CWMP on drifted modems.
+            beam_drift_utils.print_step(5, "restarting CWMP")
+            jumpbox = Jumpbox()
+            restarted_cwmp, failed_to_restart_cwmp = beam_drift_utils.restart_cwmp(
+                jumpbox, online_after_clear
             )
-            beam_drift_utils.reboot_modems(jumpbox, pushed_lkg_files)
 
-            # Step #13 - Wait for the modems that we rebooted in Step #12 to come back online.
+            # Step #6 - If any modems were restarted by CWMP, wait for them to come online.
             beam_drift_utils.print_step(
-                13, "waiting for modems to come back online after we rebooted them"
+                6, "waiting for any modems rebooted by CWMP to come back online"
             )
             (
-                online_after_reboot,
-                offline_after_reboot,
+                online_after_cwmp_restart,
+                offline_after_cwmp_restart,
             ) = beam_drift_utils.wait_till_modems_are_online(
-                pushed_lkg_files, beam_drift_utils.get_wait_secs_for_online_after_lkg_push()
+                restarted_cwmp, beam_drift_utils.get_wait_secs_for_online_after_cwmp_restart()
             )
 
-        # Step #14 - Restore the modems' beam pinnings in ACS, undoing what we did in Step #2.
-        beam_drift_utils.print_step(14, "re-pinning modems to their goal beams in ACS")
-        if beam_drift_utils.should_preserve_beam_pinnings():
-            modems_to_re_pin = drifted_modems
-        elif beam_drift_utils.is_fast_run():
-            modems_to_re_pin = on_goal_beam_after_cwmp_restart
-        else:
-            modems_to_re_pin = pushed_lkg_files
-        _, failed_to_re_pin = beam_drift_utils.re_pin_beams(modems_to_re_pin)
-
-        if beam_drift_utils.is_fast_run():
-            # If the "fast run" box was checked, skip Step #8 - Step #13 & Step #15
-            common_utils.print_heading("skipping Step #15")
-
-        else:
-            # Step #15 - Use utstat -L to check whether the modems that we rebooted in
-            #            Step #12 came back online on the correct beam. If they didn't, check
-            #            whether the beam that they did come online on has a polarization
-            #            opposite to that of the beam to which they failed to move. If it
-            #            does, this could indicate a broken polarity switch on an AB modem.
+            # Step #7 - Check whether modems are on the correct beam now.
             beam_drift_utils.print_step(
-                15, "checking whether modems came back online on the correct beam"
+                7, "checking whether the CWMP restart got modems on the right beam"
             )
             (
-                on_goal_beam,
-                on_wrong_beam_opp_pol,
-                on_wrong_beam_same_pol,
-                failed_to_check_beam,
+                on_goal_beam_after_cwmp_restart,
+                on_wrong_beam_opp_pol_after_cwmp_restart,
+                on_wrong_beam_same_pol_after_cwmp_restart,
+                failed_to_check_beam_after_cwmp_restart,
             ) = beam_drift_utils.check_beams_match_on_modem(
-                jumpbox, beam_drift_db, online_after_reboot, flag_pol_swap_issue_on_failure=True
-            )
-            beam_drift_db.record_fix_counts(
-                fixed_by_cwmp_restart=len(on_goal_beam_after_cwmp_restart),
-                fixed_by_lkg_update=len(on_goal_beam),
-                verbose=common_utils.is_job_verbose(),
+                jumpbox,
+                beam_drift_db,
+                online_after_cwmp_restart,
+                flag_pol_swap_issue_on_failure=False,
             )
 
+            if beam_drift_utils.is_fast_run():
+                # If the "fast run" box was checked, skip Step #8 - Step #13 & Step #15
+                common_utils.print_heading("skipping Step #8 - Step #13")
+
+            else:
+                # Step #8 - Check if the modems have the goal beam in the LKG files. If they don't,
+                #           we'll proceed with updating those LKG files in Step #11.
+                beam_drift_utils.print_step(8, "check if goal beam info is missing from LKG file")
+                (
+                    goal_beam_not_in_lkg,
+                    goal_beam_in_lkg_same_pol,
+                    goal_beam_in_lkg_opp_pol,
+                    unknown_if_goal_in_lkg,
+                ) = beam_drift_utils.check_if_goal_beam_in_lkg(
+                    jumpbox,
+                    beam_drift_db,
+                    on_wrong_beam_same_pol_after_cwmp_restart
+                    + on_wrong_beam_opp_pol_after_cwmp_restart,
+                )
+
+                # Step #9 - For each beam to which any modem in this batch is trying to move,
+                #           obtain an LKG file from a modem currently online on that beam.
+                beam_drift_utils.print_step(
+                    9, "retrieving good LKG files from online modems on goal beams"
+                )
+                if beam_drift_utils.should_force_lkg_updates():
+                    modems_whose_lkg_we_want_to_update = (
+                        goal_beam_not_in_lkg
+                        + goal_beam_in_lkg_same_pol
+                        + goal_beam_in_lkg_opp_pol
+                        + unknown_if_goal_in_lkg
+                    )
+                else:
+                    modems_whose_lkg_we_want_to_update = (
+                        goal_beam_not_in_lkg + unknown_if_goal_in_lkg
+                    )
+                found_good_lkg, no_lkg_found = beam_drift_utils.get_good_lkg_files(
+                    jumpbox, modems_whose_lkg_we_want_to_update
+                )
+
+                # Step #10 - Back up the modems' existing LKG files just
+                #            in case something goes wrong in Step #11.
+                beam_drift_utils.print_step(10, "backing up existing LKG files on drifted modems")
+                backed_up_lkg_files, failed_to_back_up_lkg = beam_drift_utils.back_up_lkg_files(
+                    jumpbox, found_good_lkg
+                )
+
+                # Step #11 - Push the good LKG files that we obtained in Step #9 onto the drifted
+                #            modems. This should give them the information they need to successfully
+                #            get online on the beam to which they're trying to move.
+                beam_drift_utils.print_step(11, "pushing good LKG files to drifted modems")
+                pushed_lkg_files, error_pushing_lkg = beam_drift_utils.push_good_lkg_files(
+                    jumpbox, backed_up_lkg_files
+                )
+
+                # Step #12 - Reboot modems. Now that the modems have good LKG files on them,
+                #           they'll hopefully come back on the correct beam after we reboot them.
+                beam_drift_utils.print_step(
+                    12, "rebooting drifted modems that now have good LKG files on them"
+                )
+                beam_drift_utils.reboot_modems(jumpbox, pushed_lkg_files)
+
+                # Step #13 - Wait for the modems that we rebooted in Step #12 to come back online.
+                beam_drift_utils.print_step(
+                    13, "waiting for modems to come back online after we rebooted them"
+                )
+                (
+                    online_after_reboot,
+                    offline_after_reboot,
+                ) = beam_drift_utils.wait_till_modems_are_online(
+                    pushed_lkg_files, beam_drift_utils.get_wait_secs_for_online_after_lkg_push()
+                )
+
+            # Step #14 - Restore the modems' beam pinnings in ACS, undoing what we did in Step #2.
+            beam_drift_utils.print_step(14, "re-pinning modems to their goal beams in ACS")
+            if beam_drift_utils.should_preserve_beam_pinnings():
+                modems_to_re_pin = drifted_modems
+            elif beam_drift_utils.is_fast_run():
+                modems_to_re_pin = on_goal_beam_after_cwmp_restart
+            else:
+                modems_to_re_pin = pushed_lkg_files
+            _, failed_to_re_pin = beam_drift_utils.re_pin_beams(modems_to_re_pin)
+
+            if beam_drift_utils.is_fast_run():
+                # If the "fast run" box was checked, skip Step #8 - Step #13 & Step #15
+                common_utils.print_heading("skipping Step #15")
+
+            else:
+                # Step #15 - Use utstat -L to check whether the modems that we rebooted in
+                #            Step #12 came back online on the correct beam. If they didn't, check
+                #            whether the beam that they did come online on has a polarization
+                #            opposite to that of the beam to which they failed to move. If it
+                #            does, this could indicate a broken polarity switch on an AB modem.
+                beam_drift_utils.print_step(
+                    15, "checking whether modems came back online on the correct beam"
+                )
+                (
+                    on_goal_beam,
+                    on_wrong_beam_opp_pol,
+                    on_wrong_beam_same_pol,
+                    failed_to_check_beam,
+                ) = beam_drift_utils.check_beams_match_on_modem(
+                    jumpbox, beam_drift_db, online_after_reboot, flag_pol_swap_issue_on_failure=True
+                )
+                beam_drift_db.record_fix_counts(
+                    fixed_by_cwmp_restart=len(on_goal_beam_after_cwmp_restart),
+                    fixed_by_lkg_update=len(on_goal_beam),
+                    verbose=common_utils.is_job_verbose(),
+                )
+
         # Step #16 - Check the final beam pinnings in ACS and ensure that the modems
         #            we expected to be pinned to their goal beams actually are.
         beam_drift_utils.print_step(16, "checking whether beam re-pinnings went through in CM-T")
@@ -15,7 +15,6 @@ from libs.common_utils import timestamp, hw_type_of_sw_version, get_expected_env
 
 CMD_FILE_NAME = "reboot_fw_dwnld_mode_2_cmds.txt"
 CMD_LOCAL_FILE_PATH = f"jumpbox_communication/{CMD_FILE_NAME}"
-CMD_REMOTE_FILE_PATH = f"/tmp/{CMD_FILE_NAME}"
 
 
 def upgrade_fw_dwnld_mode_2():
@@ -41,7 +40,7 @@ def upgrade_fw_dwnld_mode_2():
     output_file_name = f"reboot_results_{timestamp()}"
     mtool_utils.run_mtool_command(
         jumpbox,
-        f"-a run_commands -c {CMD_REMOTE_FILE_PATH}"
+        f"-a run_commands -c {jumpbox.remote_upload_path(CMD_FILE_NAME)}"
         f" -L {get_expected_env_var('modem_limit')} -v {get_expected_env_var('vnos')}"
         f" -V {get_expected_env_var('old_versions')} -o {output_file_name}",
     )
@@ -378,14 +378,15 @@ def handle_streamon_shared_pp():
         env=streamon_vault_env, username=vlt_svc_streamon, password=vlt_svc_streamon_pwd
     )
 
-    # Get the private RSA 3072 key to decrypt ops payload
-    private_rsa_3072_key = vault_utils.get_streamon_private_key(
-        streamon_vault_token, streamon_vault_env
+    # Use the token to retrieve the private RSA 3072 key to decrypt ops payload
+    # and the UT KeySplit from Vault at the same time
+    private_rsa_3072_key, ut_keysplit = vault_utils.fetch_concurrently(
+        [
+            lambda: vault_utils.get_streamon_private_key(streamon_vault_token, streamon_vault_env),
+            lambda: vault_utils.get_ut_swkey(streamon_vault_token, streamon_vault_env),
+        ]
     )
 
-    # Use the token to retrieve the UT KeySplit from vault
-    ut_keysplit = vault_utils.get_ut_swkey(streamon_vault_token, streamon_vault_env)
-
     # Main function that will untar, decrypt, reencrypt with SFT and push back
     # to Artifactory
     return decrypt_reencrypt_and_put(
@@ -5,15 +5,22 @@ and use mtool to run utdiag on the list of modems not statpushing.
 
 import sys
 import os
+from collections import deque
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from libs.jumpbox import Jumpbox, print_command_results
 from libs.mtool_utils import (
     mtool_base_cmd,
+    MAC_ADDR_REGEX,
     UTDIAG_FILE_PATH,
 )
 from libs.common_utils import timestamp
 
+# how much of the end of utdiag's output to keep for printing if it fails, and how often
+# to print how many modems it's gotten through
+OUTPUT_LINES_TO_KEEP = 200
+PROGRESS_INTERVAL_MODEMS = 100
+
 
 def run_utdiag_on_modems_not_statpushing():
     """
@@ -22,24 +29,55 @@ def run_utdiag_on_modems_not_statpushing():
     jumpbox = Jumpbox()
     jumpbox.clear_any_previous_results(prefix="results_")
     jumpbox.clear_any_previous_results(prefix="ut_macs_")
+    jumpbox.grant_mtool_access()
+    summary_file_names = []
     for network in list_of_networks_to_check():
         command = (
-            f"{mtool_base_cmd()} -a utdiag_vwa_modem_list -d true -N {network} -T 30 "
+            f"{mtool_base_cmd(set_acl=False)} -a utdiag_vwa_modem_list -d true -N {network} -T 30 "
             f"-o results_{network}_{timestamp()} -s {UTDIAG_FILE_PATH} -p false -i"
         )
-        output, errors = jumpbox.run_command(
-            command, prompt_answers=[jumpbox.password, 2, jumpbox.password, jumpbox.password]
-        )
-        summary_file_name = find_utdiag_summary_file_name(output)
+        summary_file_name, output, errors = stream_utdiag(jumpbox, network, command)
         if summary_file_name == "error":
             print(f"\nERROR: failed to run utdiag on {network} list:")
             print_command_results(command, output, errors)
         else:
             print(f"\nSUCCESS: ran utdiag on {network} list")
-            jumpbox.download_file(summary_file_name)
+            summary_file_names.append(summary_file_name)
+    jumpbox.download_files(summary_file_names)
     jumpbox.disconnect()
 
 
+def stream_utdiag(jumpbox, network, command):
+    """
+    Run utdiag via mtool, reporting progress as it goes, and only keeping the end of its output.
+
+    :param jumpbox: an instance of the class used to connect to the MoDOT jumpbox
+    :param network: a string representing the network whose list utdiag is running on
+    :param command: a string representing the mtool command that runs utdiag
+    :return: a string representing the file name of the utdiag summary file (or the string
+             "error" if it can't be found in the command output), a list of strings representing
+             the last lines of the command's output, and a list of strings representing its errors
+    """
+    errors = []
+    recent_output = deque(maxlen=OUTPUT_LINES_TO_KEEP)
+    summary_file_name = "error"
+    modems_seen = set()
+    for line in jumpbox.stream_command(
+        command,
+        prompt_answers=[jumpbox.password, 2, jumpbox.password, jumpbox.password],
+        errors=errors,
+    ):
+        recent_output.append(line)
+        if summary_file_name == "error":
+            summary_file_name = find_utdiag_summary_file_name([line])
+        for mac in MAC_ADDR_REGEX.findall(line):
+            if mac.upper() not in modems_seen:
+                modems_seen.add(mac.upper())
+                if len(modems_seen) % PROGRESS_INTERVAL_MODEMS == 0:
+                    print(f"utdiag on {network} list has reached {len(modems_seen)} modems")
+    return summary_file_name, list(recent_output), errors
+
+
 def list_of_networks_to_check():
     """
     Get the list of networks from which to pull lists of modems not statpushing.
@@ -13,14 +13,14 @@ sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../.
 from packaging import version
 from libs.acs_db import AcsDb
 from libs.beam_drift_db import BeamDriftDb
-from libs.common_utils import batches, get_expected_env_var
-from libs.jumpbox import Jumpbox
-from libs.mtool_utils import (
-    check_if_cmd_had_expected_output,
-    create_mac_list_file,
-    format_mac_addr,
-    run_mtool_command,
+from libs.common_utils import get_expected_env_var
+from libs.jumpbox import Jumpbox, JumpboxPool
+from libs.mtool_executor import (
+    MtoolFleetExecutor,
+    expected_output_classifier,
+    macs_with_outcome,
 )
+from libs.mtool_utils import format_mac_addr
 
 # Future
 NEW_SW_EXPECTED_CONFIG_HEADER = "; odu.conf version Brazil.003 06-10-2022"
@@ -30,10 +30,10 @@ OLD_SW_EXPECTED_CONFIG_HEADER = "; odu.conf version Brazil.002 06-10-2022"
 FILE_PATH_FOR_OLD_ODU = "python_scripts/jobs/straggler_automation/odu_Brazil_002.conf"
 FILE_DOES_NOT_EXIST = "head: /mnt/jffs2/config/odu.conf: No such file or directory"
 SUBOPTIMAL_CONFIG_HEADER = "# odu.conf version Brazil.001 05-19-2022"
-DEFAULT_BATCH_SIZE = 35
 DATABASE_OF_KNOWN_GOOD = "brazil_odu_conf_file_true"
 DATABASE_OF_KNOWN_OFFLINE = "brazil_odu_conf_offline"
-MTOOL_FILE_NAME = "ut_macs_brazil_file_fixerizer.txt"
+# How many days an incremental scan trusts a modem's last check for if its software hasn't changed
+INCREMENTAL_MAX_AGE_DAYS_DEFAULT = 7
 
 
 def execute_file_fixerizer():
@@ -44,20 +44,26 @@ def execute_file_fixerizer():
     offline_after_fix = []
 
     # Get two lists of residential modems in Brazil via the ACS database and sorted by sw version
-    newer_software, older_software = get_full_list_of_brazil_modems()
+    newer_software, older_software, software_versions = get_full_list_of_brazil_modems()
 
     # Check Jenkins drop-down then diff the ACS database with the odu database accordingly
-    newer_software, older_software = find_jenkins_scan_depth(newer_software, older_software)
+    newer_software, older_software = find_jenkins_scan_depth(
+        newer_software, older_software, software_versions
+    )
 
     # Check list of modems for presence of odu.conf file. Sort and add to odu database if applicable
-    file_exists, new_file_not_exists, old_file_not_exists, offline = check_for_file(newer_software, older_software)
+    file_exists, new_file_not_exists, old_file_not_exists, offline = check_for_file(
+        newer_software, older_software, software_versions
+    )
 
     # Attempt to fix the list of modems missing the odu.conf file
     if len(new_file_not_exists) == 0 and len(old_file_not_exists) == 0:
         put_succeeded = []
         put_failed = []
     else:
-        put_succeeded, put_failed, offline_after_fix = fix_modems_missing_file(new_file_not_exists, old_file_not_exists)
+        put_succeeded, put_failed, offline_after_fix = fix_modems_missing_file(
+            new_file_not_exists, old_file_not_exists, software_versions
+        )
 
     file_not_exists = new_file_not_exists + old_file_not_exists
     # Print job statistics
@@ -78,30 +84,34 @@ def get_full_list_of_brazil_modems():
 
     :return: a list of mac addresses running newer software
     :return: a list of mac addresses running older software
+    :return: a dictionary mapping mac addresses to the software versions they're running
     """
     print("\n====================note=====================")
     print("Querying the ACS database")
-    acs_db = AcsDb()
-    if get_expected_env_var("scan_type") == "new_installs" or get_expected_env_var("scan_type") == "unknowns":
-        acs_query_results = acs_db.get_online_brazil_modems()
-    else:
-        acs_query_results = acs_db.get_all_brazil_modems()
-    acs_db.database.disconnect()
+    with AcsDb() as acs_db:
+        if get_expected_env_var("scan_type") in ["new_installs", "unknowns"]:
+            acs_query_results = acs_db.get_online_brazil_modems(use_dictionary=False, stream=True)
+        else:
+            acs_query_results = acs_db.get_all_brazil_modems(use_dictionary=False, stream=True)
 
-    # Format the list and separate by modem software version
-    new_software, old_software = format_acs_db_list(acs_query_results)
+        # Format the list and separate by modem software version as the rows come in
+        new_software, old_software, software_versions = format_acs_db_list(acs_query_results)
 
-    return new_software, old_software
+    return new_software, old_software, software_versions
 
 
-def find_jenkins_scan_depth(newer_software, older_software):
+def find_jenkins_scan_depth(newer_software, older_software, software_versions):
     """
     A function to determine which scan type was selected in the Jenkins job.
     A full scan will clear the database and start from scratch.
     A fast scan will only check modems not already confirmed to be fixed.
+    An incremental scan will only check modems that are new, whose software has changed since
+    they were last checked, or that haven't been checked in incremental_max_age_days days.
 
     :param newer_software: a list of all residential Brazil modems from the ACS database with newer code
     :param older_software: a list of all residential Brazil modems from the ACS database with older code
+    :param software_versions: a dictionary mapping mac addresses to the software versions
+                              they're running
     :return: a list of modems to check for new odu.conf
     :return: a list of modems to check for old odu.conf
     """
@@ -115,12 +125,23 @@ def find_jenkins_scan_depth(newer_software, older_software):
     # Clear the offline database and check for new installs and newly online
     elif get_expected_env_var("scan_type") == "unknowns":
         clear_database(DATABASE_OF_KNOWN_OFFLINE)
-        newer_software = diff_database_and_all_modems(newer_software)
-        older_software = diff_database_and_all_modems(older_software)
+        macs_in_database = get_macs_in_database()
+        newer_software = diff_database_and_all_modems(newer_software, macs_in_database)
+        older_software = diff_database_and_all_modems(older_software, macs_in_database)
     # Find new installs
     elif get_expected_env_var("scan_type") == "new_installs":
-        newer_software = diff_database_and_all_modems(newer_software, True)
-        older_software = diff_database_and_all_modems(older_software, True)
+        macs_in_database = get_macs_in_database(True)
+        newer_software = diff_database_and_all_modems(newer_software, macs_in_database)
+        older_software = diff_database_and_all_modems(older_software, macs_in_database)
+    # Recheck only the modems that are new, have changed software, or haven't been checked lately
+    elif get_expected_env_var("scan_type") == "incremental":
+        check_records = get_check_records(get_incremental_max_age_days())
+        newer_software = find_modems_to_recheck(newer_software, software_versions, check_records)
+        older_software = find_modems_to_recheck(older_software, software_versions, check_records)
+        print(
+            f"Rechecking {len(newer_software) + len(older_software)} modem(s)"
+            " that changed or are due"
+        )
 
     # This should not happen unless the Jenkins config was improperly modified
     else:
@@ -129,13 +150,15 @@ def find_jenkins_scan_depth(newer_software, older_software):
     return newer_software, older_software
 
 
-def check_for_file(newer_software, older_software):
+def check_for_file(newer_software, older_software, software_versions):
     """
     A function to send a list of modems to mtool
     to check for existence of /mnt/jffs2/config/odu.conf file.
 
     :param newer_software: a list of modems to check for the newest odu.conf
     :param older_software: a list of modems to check for the older odu.conf
+    :param software_versions: a dictionary mapping mac addresses to the software versions
+                              they're running
     :return: a list of mac addresses that already have the needed file
     :return: a list of mac addresses that need the newer odu.conf
     :return: a list of mac addresses that need the older odu.conf
@@ -146,112 +169,161 @@ def check_for_file(newer_software, older_software):
     old_file_not_exists = []
     offline = []
 
-    jumpbox = Jumpbox()
+    jumpbox = JumpboxPool()
     command_to_run = 'head -1 /mnt/jffs2/config/odu.conf'
     print("\n====================note=====================")
     print(f"Checking {len(newer_software) + len(older_software)} modem(s) for odu.conf file")
-
-    new_groups = batches(newer_software, DEFAULT_BATCH_SIZE)
-    old_groups = batches(older_software, DEFAULT_BATCH_SIZE)
-    groups = new_groups + old_groups
-    counter = 1
+    print(f"Spreading batches across {len(jumpbox.jumpboxes)} jumpbox(es)")
 
     if len(newer_software) > 0:
-        for group in new_groups:
-            create_mac_list_file(jumpbox, MTOOL_FILE_NAME, group)
-            print(f"Checking for odu file - batch {counter} of {len(groups)}")
-            new_file_version_output, _ = run_mtool_command(
-                jumpbox, f"-a run_commands -m {MTOOL_FILE_NAME} -C '{command_to_run}'",
-                verbose=False
-            )
-            for mac in group:
-                if check_if_cmd_had_expected_output(new_file_version_output, mac, NEW_SW_EXPECTED_CONFIG_HEADER):
-                    file_exists.append(mac)
-                elif check_if_cmd_had_expected_output(new_file_version_output, mac, OLD_SW_EXPECTED_CONFIG_HEADER):
-                    new_file_not_exists.append(mac)
-                elif check_if_cmd_had_expected_output(new_file_version_output, mac, SUBOPTIMAL_CONFIG_HEADER):
-                    new_file_not_exists.append(mac)
-                elif check_if_cmd_had_expected_output(new_file_version_output, mac, "[SRC]"):
-                    new_file_not_exists.append(mac)
-                elif check_if_cmd_had_expected_output(new_file_version_output, mac, FILE_DOES_NOT_EXIST):
-                    new_file_not_exists.append(mac)
-                else:
-                    offline.append(mac)
-            counter += 1
+        outcomes = MtoolFleetExecutor(
+            jumpbox, "check_odu_header", f"-a run_commands -C '{command_to_run}'",
+            expected_output_classifier([
+                (NEW_SW_EXPECTED_CONFIG_HEADER, "file exists"),
+                (OLD_SW_EXPECTED_CONFIG_HEADER, "file not exists"),
+                (SUBOPTIMAL_CONFIG_HEADER, "file not exists"),
+                ("[SRC]", "file not exists"),
+                (FILE_DOES_NOT_EXIST, "file not exists"),
+            ]),
+            retries=1,
+            unresolved_outcome="offline",
+        ).run(newer_software)
+        file_exists += macs_with_outcome(outcomes, "file exists")
+        new_file_not_exists += macs_with_outcome(outcomes, "file not exists")
+        offline += macs_with_outcome(outcomes, "offline")
 
     if len(older_software) > 0:
-        for group in old_groups:
-            create_mac_list_file(jumpbox, MTOOL_FILE_NAME, group)
-            print(f"Checking for odu file - batch {counter} of {len(groups)}")
-            old_file_version_output, _ = run_mtool_command(
-                jumpbox, f'-a run_commands -m {MTOOL_FILE_NAME} -C "{command_to_run}"',
-                verbose=False
-            )
-            for mac in group:
-                if check_if_cmd_had_expected_output(old_file_version_output, mac, OLD_SW_EXPECTED_CONFIG_HEADER):
-                    file_exists.append(mac)
-                elif check_if_cmd_had_expected_output(old_file_version_output, mac, SUBOPTIMAL_CONFIG_HEADER):
-                    old_file_not_exists.append(mac)
-                elif check_if_cmd_had_expected_output(old_file_version_output, mac, "[SRC]"):
-                    old_file_not_exists.append(mac)
-                elif check_if_cmd_had_expected_output(old_file_version_output, mac, FILE_DOES_NOT_EXIST):
-                    old_file_not_exists.append(mac)
-                else:
-                    offline.append(mac)
-            counter += 1
+        outcomes = MtoolFleetExecutor(
+            jumpbox, "check_odu_header", f'-a run_commands -C "{command_to_run}"',
+            expected_output_classifier([
+                (OLD_SW_EXPECTED_CONFIG_HEADER, "file exists"),
+                (SUBOPTIMAL_CONFIG_HEADER, "file not exists"),
+                ("[SRC]", "file not exists"),
+                (FILE_DOES_NOT_EXIST, "file not exists"),
+            ]),
+            retries=1,
+            unresolved_outcome="offline",
+        ).run(older_software)
+        file_exists += macs_with_outcome(outcomes, "file exists")
+        old_file_not_exists += macs_with_outcome(outcomes, "file not exists")
+        offline += macs_with_outcome(outcomes, "offline")
 
     jumpbox.clear_any_previous_results(prefix="ut_macs_")
     jumpbox.disconnect()
 
     if len(file_exists) > 0:
-        add_mac_to_database(file_exists, DATABASE_OF_KNOWN_GOOD)
+        add_mac_to_database(file_exists, DATABASE_OF_KNOWN_GOOD, software_versions)
         print(f"added {len(file_exists)} modem(s) to known fixed database")
     if len(offline) > 0:
-        add_mac_to_database(offline, DATABASE_OF_KNOWN_OFFLINE)
+        # Offline modems weren't really checked, so the next incremental scan should retry them
+        add_mac_to_database(offline, DATABASE_OF_KNOWN_OFFLINE, software_versions, checked=False)
         print(f"added {len(offline)} modem(s) to offline database")
 
     return file_exists, new_file_not_exists, old_file_not_exists, offline
 
 
-def diff_database_and_all_modems(modems, do_not_check_offline=False):
+def get_macs_in_database(do_not_check_offline=False):
+    """
+    A function to get the modems already recorded in the database.
+
+    :param do_not_check_offline: T/F to include the modems known to be offline
+    :return: a set of mac addresses
+    """
+    current_offline_database = []
+
+    with BeamDriftDb() as ut_ops_automations_db:
+        current_fixed_database = ut_ops_automations_db.get_brazil_records(DATABASE_OF_KNOWN_GOOD)
+        if do_not_check_offline:
+            current_offline_database = ut_ops_automations_db.get_brazil_records(
+                DATABASE_OF_KNOWN_OFFLINE
+            )
+
+    return set(format_ut_db_list(current_fixed_database + current_offline_database))
+
+
+def diff_database_and_all_modems(modems, macs_in_database):
     """
     A function to ignore modems that exist in the database and retain
     only the modems that need to be checked for presence of the odu.conf file.
 
     :param modems: a list of all modem mac addresses from the ACS db
-    :param do_not_check_offline: T/F to exclude offline modems
+    :param macs_in_database: a set of mac addresses from get_macs_in_database()
     :return: a list of modems to check
     """
-    modems_to_check = []
-    current_offline_database = []
+    return [modem for modem in modems if modem not in macs_in_database]
 
-    ut_ops_automations_db = BeamDriftDb()
-    current_fixed_database = ut_ops_automations_db.get_brazil_records(DATABASE_OF_KNOWN_GOOD)
-    if do_not_check_offline:
-        current_offline_database = ut_ops_automations_db.get_brazil_records(DATABASE_OF_KNOWN_OFFLINE)
-    ut_ops_automations_db.database.disconnect()
 
-    macs_in_database = current_fixed_database + current_offline_database
-    macs_in_database = format_ut_db_list(macs_in_database)
+def get_incremental_max_age_days():
+    """
+    A function to determine how many days an incremental scan trusts a modem's last check for.
 
-    for modem in modems:
-        if modem not in macs_in_database:
-            modems_to_check.append(modem)
+    :return: a number of days, specified by an optional parameter to the job. If unspecified,
+             a default is used.
+    """
+    if "incremental_max_age_days" in os.environ:
+        try:
+            max_age_days = int(get_expected_env_var("incremental_max_age_days"))
+            if max_age_days >= 0:
+                return max_age_days
+        except (ValueError, TypeError) as ex:
+            print(ex)
+    return INCREMENTAL_MAX_AGE_DAYS_DEFAULT
 
-    return modems_to_check
 
+def get_check_records(max_age_days):
+    """
+    A function to get the most recent check of each modem recorded in the database.
 
-def add_mac_to_database(modems, table):
+    :param max_age_days: a number representing how many days old a check can be before it's stale
+    :return: a dictionary mapping mac addresses to dictionaries containing the software
+             version the modem had when it was checked and whether that check is stale
+    """
+    check_records = {}
+    with BeamDriftDb() as ut_ops_automations_db:
+        # A fresh check of a modem wins over a stale one, and a check that found the file wins
+        # over one that found the modem offline
+        for table in [DATABASE_OF_KNOWN_OFFLINE, DATABASE_OF_KNOWN_GOOD]:
+            for record in ut_ops_automations_db.get_brazil_check_records(table, max_age_days):
+                previous = check_records.get(record["mac"])
+                if previous is None or previous["stale"] or not record["stale"]:
+                    check_records[record["mac"]] = record
+    return check_records
+
+
+def find_modems_to_recheck(modems, software_versions, check_records):
+    """
+    A function to retain only the modems that are new, whose software has changed since
+    they were last checked, or whose last check is stale.
+
+    :param modems: a list of modem mac addresses from the ACS db
+    :param software_versions: a dictionary mapping mac addresses to the software versions
+                              they're running
+    :param check_records: a dictionary as returned by get_check_records()
+    :return: a list of modems to check
+    """
+    return [
+        modem for modem in modems
+        if modem not in check_records
+        or check_records[modem]["stale"]
+        or check_records[modem]["sw_version"] != software_versions.get(modem)
+    ]
+
+
+def add_mac_to_database(modems, table, software_versions, checked=True):
     """
     A function to add modems with odu.conf file to the database.
 
     :param modems: a list of modems to add to the database
     :param table: name of table to add the list of modems
+    :param software_versions: a dictionary mapping mac addresses to the software versions
+                              they're running
+    :param checked: True to record the modems as checked just now, False to have the next
+                    incremental scan check them again
     """
-    ut_ops_automations_db = BeamDriftDb()
-    for modem in modems:
-        ut_ops_automations_db.add_brazil_records(modem, table)
-    ut_ops_automations_db.database.disconnect()
+    with BeamDriftDb() as ut_ops_automations_db:
+        ut_ops_automations_db.add_brazil_records_in_bulk(
+            modems, table, software_versions, checked=checked
+        )
 
 
 def clear_database(table):
@@ -261,17 +333,18 @@ def clear_database(table):
     :param table: name of the table to clear
     """
 
-    ut_ops_automations_db = BeamDriftDb()
-    ut_ops_automations_db.delete_brazil_records(table)
-    ut_ops_automations_db.database.disconnect()
+    with BeamDriftDb() as ut_ops_automations_db:
+        ut_ops_automations_db.delete_brazil_records(table)
 
 
-def fix_modems_missing_file(new_file_needed, old_file_needed):
+def fix_modems_missing_file(new_file_needed, old_file_needed, software_versions):
     """
     A function to put a file on a modem using mtool and if successful, reboot.
 
     :param new_file_needed: a list of modems needing the newer odu.conf file
     :param old_file_needed: a list of modems needing an older odu.conf file
+    :param software_versions: a dictionary mapping mac addresses to the software versions
+                              they're running
     :return: a list of modems that received the file and rebooted
     :return: a list of modems that did not receive the file
     :return: a list of modems offline after a fix was attempted
@@ -286,59 +359,44 @@ def fix_modems_missing_file(new_file_needed, old_file_needed):
     print("WARNING: THIS STEP TAKES A LONG TIME TO RUN")
     print(f"Attempting to fix {len(new_file_needed) + len(old_file_needed)} modem(s)")
 
-    new_groups = batches(new_file_needed, DEFAULT_BATCH_SIZE)
-    old_groups = batches(old_file_needed, DEFAULT_BATCH_SIZE)
-    groups = new_groups + old_groups
-    counter = 1
-
     if len(new_file_needed) > 0:
         jumpbox.upload_file(FILE_PATH_FOR_NEW_ODU, "odu.conf.new")
-        for group in new_groups:
-            command_to_run = '/mnt/jffs2/config/odu.conf'
-            create_mac_list_file(jumpbox, MTOOL_FILE_NAME, group)
-            print(f"Attempting to upload odu.conf - batch {counter} of {len(groups)}")
-            output, _ = run_mtool_command(
-                jumpbox, f"-a put_file -m {MTOOL_FILE_NAME} -l '/tmp/odu.conf.new' -r '{command_to_run}'",
-                verbose=False
-            )
-            counter += 1
+        command_to_run = '/mnt/jffs2/config/odu.conf'
+        print("Attempting to upload odu.conf")
+        MtoolFleetExecutor(
+            jumpbox, "put_odu_file",
+            f"-a put_file -l '{jumpbox.remote_upload_path('odu.conf.new')}' -r '{command_to_run}'",
+            retries=0,
+        ).run(new_file_needed)
     if len(old_file_needed) > 0:
         jumpbox.upload_file(FILE_PATH_FOR_OLD_ODU, "odu.conf.old")
-        for group in old_groups:
-            command_to_run = '/mnt/jffs2/config/odu.conf'
-            create_mac_list_file(jumpbox, MTOOL_FILE_NAME, group)
-            print(f"Attempting to upload odu.conf - batch {counter} of {len(groups)}")
-            output, _ = run_mtool_command(
-                jumpbox, f"-a put_file -m {MTOOL_FILE_NAME} -l '/tmp/odu.conf.old' -r '{command_to_run}'",
-                verbose=False
-            )
-            counter += 1
+        command_to_run = '/mnt/jffs2/config/odu.conf'
+        print("Attempting to upload odu.conf")
+        MtoolFleetExecutor(
+            jumpbox, "put_odu_file",
+            f"-a put_file -l '{jumpbox.remote_upload_path('odu.conf.old')}' -r '{command_to_run}'",
+            retries=0,
+        ).run(old_file_needed)
     modems = new_file_needed + old_file_needed
-    groups = batches(modems, DEFAULT_BATCH_SIZE)
-    counter = 1
-    for group in groups:
-        # Check the output
-        command_to_run = 'test -f /mnt/jffs2/config/odu.conf ; echo $?'
-        create_mac_list_file(jumpbox, MTOOL_FILE_NAME, group)
-        print(f"Validating - batch {counter} of {len(groups)}")
-        output, _ = run_mtool_command(
-            jumpbox, f"-a run_commands -m {MTOOL_FILE_NAME} -C '{command_to_run}'",
-            verbose=False
-        )
-        for mac in group:
-            if check_if_cmd_had_expected_output(output, mac, "0"):
-                file_exists.append(mac)
-            elif check_if_cmd_had_expected_output(output, mac, "1"):
-                file_not_exists.append(mac)
-            else:
-                offline.append(mac)
-        counter += 1
+    # Check the output
+    command_to_run = 'test -f /mnt/jffs2/config/odu.conf ; echo $?'
+    print("Validating")
+    outcomes = MtoolFleetExecutor(
+        jumpbox, "check_odu_file", f"-a run_commands -C '{command_to_run}'",
+        expected_output_classifier([("0", "file exists"), ("1", "file not exists")]),
+        retries=1,
+        unresolved_outcome="offline",
+    ).run(modems)
+    file_exists += macs_with_outcome(outcomes, "file exists")
+    file_not_exists += macs_with_outcome(outcomes, "file not exists")
+    offline += macs_with_outcome(outcomes, "offline")
 
     if len(file_exists) > 0:
-        add_mac_to_database(file_exists, DATABASE_OF_KNOWN_GOOD)
+        add_mac_to_database(file_exists, DATABASE_OF_KNOWN_GOOD, software_versions)
         print(f"Added {len(file_exists)} modem(s) to the known fixed database")
     if len(offline) > 0:
-        add_mac_to_database(offline, DATABASE_OF_KNOWN_OFFLINE)
+        # Offline modems weren't really checked, so the next incremental scan should retry them
+        add_mac_to_database(offline, DATABASE_OF_KNOWN_OFFLINE, software_versions, checked=False)
         print(f"Added {len(offline)} modem(s) to offline database")
 
     jumpbox.clear_any_previous_results(prefix="ut_macs_")
@@ -389,23 +447,28 @@ def print_results(
 
 def format_acs_db_list(modems):
     """
-    A function to change a list of dictionaries containing software and mac addresses into
+    A function to change an iterable of (software version, mac address) tuples into
     two lists of modem macs sorted by software version.
 
-    :param modems: a list of dictionaries containing software versions and mac addresses
+    :param modems: an iterable (e.g. a generator of rows streaming in from the ACS
+                   database) of tuples containing software versions and mac addresses
     :return: a unique list of mac addresses running code above or equal to VERSION_FOR_NEW_ODU
     :return: a unique list of mac addresses running code below VERSION_FOR_NEW_ODU
+    :return: a dictionary mapping mac addresses to the software versions they're running
     """
     new_software = []
     old_software = []
-    for modem in modems:
+    software_versions = {}
+    min_version_for_new_odu = version.parse(MIN_VERSION_FOR_NEW_ODU)
+    for software_version, cid in modems:
+        software_versions[cid] = software_version
         # NOTE: Formatters call a syntax error in this line but it is necessary in this case
-        if version.parse(modem["softwareVersion"].lstrip("UT2\_")) >= version.parse(MIN_VERSION_FOR_NEW_ODU):
-            new_software.append(modem["cid"])
+        if version.parse(software_version.lstrip("UT2\_")) >= min_version_for_new_odu:
+            new_software.append(cid)
         else:
-            old_software.append(modem["cid"])
+            old_software.append(cid)
 
-    return new_software, old_software
+    return new_software, old_software, software_versions
 
 
 def format_ut_db_list(modems):
@@ -8,14 +8,8 @@ import os
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 from libs.jumpbox import Jumpbox
-from libs.mtool_utils import (
-    run_mtool_command,
-    create_mac_list_file,
-)
-from libs.common_utils import batches
-
-DEFAULT_BATCH_SIZE = 35
-MAC_LIST_FILE_NAME = "ut_macs_caf.txt"
+from libs.mtool_executor import MtoolFleetExecutor
+from libs.mtool_utils import run_mtool_command
 
 
 def fix_statpush_on_caf_lists():
@@ -39,23 +33,15 @@ def fix_statpush_on_caf_lists():
     else:
         print(f"\n====================note=====================")
         print(f"Attempting to fix {len(modems)} modem(s)")
-        groups = batches(modems, DEFAULT_BATCH_SIZE)
-        counter = 1
         command_to_run = 'statpush_setup restart; utusage_setup restart; sudo statpush_setup restart'
         profile_to_push = 'modot_statpush_config_<hw type>'
 
-        for group in groups:
-            print(f"Working on batch {counter} of {len(groups)}")
-            create_mac_list_file(jumpbox, MAC_LIST_FILE_NAME, group)
-            output, _ = run_mtool_command(
-                jumpbox, f"-a run_commands -m {MAC_LIST_FILE_NAME} -C '{command_to_run}'",
-                verbose=False,
-            )
-            output, _ = run_mtool_command(
-                jumpbox, f"-a push_profile -m {MAC_LIST_FILE_NAME} -P '{profile_to_push}'",
-                verbose=False,
-            )
-            counter += 1
+        MtoolFleetExecutor(
+            jumpbox, "restart_statpush", f"-a run_commands -C '{command_to_run}'",
+        ).run(modems)
+        MtoolFleetExecutor(
+            jumpbox, "push_profile", f"-a push_profile -P '{profile_to_push}'",
+        ).run(modems)
         jumpbox.clear_any_previous_results(prefix="ut_macs_")
     jumpbox.disconnect()
 
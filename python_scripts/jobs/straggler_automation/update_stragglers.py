@@ -7,30 +7,33 @@ import os
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 
+import random
 import traceback
+from itertools import groupby
 from libs.acs_db import AcsDb  # for running SQL commands on the ACS database
-from libs.jumpbox import Jumpbox
-from libs.mtool_utils import (
-    create_mac_list_file,
-    run_mtool_command,
-    check_if_cmd_had_expected_output,
+from libs.jumpbox import Jumpbox, JumpboxPool, get_max_parallel_commands
+from libs.mtool_executor import (
+    MtoolFleetExecutor,
+    expected_output_classifier,
+    macs_with_outcome,
 )
 from libs.common_utils import (
-    batches,
     get_expected_env_var,
+    is_valid_number,
     print_heading,
 )
 import update_stragglers_versions as import_list
 
-DEFAULT_BATCH_SIZE = 35
-MAC_LIST_FILE_NAME = "ut_macs_app_stragglers.txt"
-
 
 def update_stragglers():
     """
     Gets data from Jenkins, determines what to send to SQL db, formats the list, then fixes them
     """
     app_to_query_and_fix = get_expected_env_var("app_to_query")
+    if app_to_query_and_fix == "all_apps":
+        for profile, list_of_macs in get_all_app_stragglers().items():
+            fix_stragglers_via_mtool(list_of_macs, profile)
+        return
     dict_of_macs_and_cids, profile = find_db_inputs_by_selection(app_to_query_and_fix)
     list_of_macs = format_straggler_list(dict_of_macs_and_cids)
     fix_stragglers_via_mtool(list_of_macs, profile)
@@ -120,14 +123,13 @@ def get_modoc_stragglers(versions):
     # A query for out-of-date modoc rules versions
     app = "modoc_rules"
     versions = import_list.MODOC_RULES_UNACCEPTABLE_VERSIONS
-    acs_db = AcsDb()
-    for version in versions:
-        modoc_mac_list += acs_db.get_app_stragglers(
-            app,
-            acceptable_hardware,
-            [f"%%with Version=2.4 and RulesVersion={version}"],
-        )
-    acs_db.database.disconnect()
+    with AcsDb() as acs_db:
+        for version in versions:
+            modoc_mac_list += acs_db.get_app_stragglers(
+                app,
+                acceptable_hardware,
+                [f"%%with Version=2.4 and RulesVersion={version}"],
+            )
 
     return modoc_mac_list
 
@@ -253,14 +255,13 @@ def get_allowlist_stragglers(versions):
     acceptable_hardware = (
         import_list.UT_HW + import_list.UT2_HW + import_list.DATA_HW + import_list.SPOCK_HW
     )
-    acs_db = AcsDb()
-    for version in versions:
-        allowlist_mac_list += acs_db.get_app_stragglers(
-            app,
-            acceptable_hardware,
-            [f"%%AppWhitelist_{version}%%"],
-        )
-    acs_db.database.disconnect()
+    with AcsDb() as acs_db:
+        for version in versions:
+            allowlist_mac_list += acs_db.get_app_stragglers(
+                app,
+                acceptable_hardware,
+                [f"%%AppWhitelist_{version}%%"],
+            )
     return allowlist_mac_list
 
 
@@ -320,68 +321,44 @@ def get_shield_with_localhost():
 
     # Check for localhost output in the ufwd file
     command_to_run = 'grep -c 127.0.0.1 /tmp/ufwdctrlsrv.conf'
-    groups = batches(formatted_shield_list, DEFAULT_BATCH_SIZE)
-    counter = 1
 
     print("\n\n====================note=====================")
     print(f"Checking {len(formatted_shield_list)} modem(s) for localhost in ufwdctrlsrv.conf.....")
-    for group in groups:
-        print(f"Checking batch {counter} of {len(groups)}")
-        create_mac_list_file(jumpbox, MAC_LIST_FILE_NAME, group)
-        output, _ = run_mtool_command(
-            jumpbox, f"-a run_commands -m {MAC_LIST_FILE_NAME} -C '{command_to_run}'",
-            verbose=False,
-        )
-        # Check the output
-        for mac in group:
-            if check_if_cmd_had_expected_output(output, mac, '0'):
-                modems_not_broken.append(mac)
-            elif check_if_cmd_had_expected_output(output, mac, '1'):
-                local_host_present.append(mac)
-            else:
-                offline.append(mac)
-        counter += 1
+    outcomes = MtoolFleetExecutor(
+        jumpbox, "check_localhost", f"-a run_commands -C '{command_to_run}'",
+        expected_output_classifier([('0', 'healthy'), ('1', 'localhost')]),
+        retries=1,
+        unresolved_outcome='offline',
+    ).run(formatted_shield_list)
+    modems_not_broken += macs_with_outcome(outcomes, 'healthy')
+    local_host_present += macs_with_outcome(outcomes, 'localhost')
+    offline += macs_with_outcome(outcomes, 'offline')
 
     # If modem failed the previous step, check again to exclude modems with shield disabled (bridge mode)
     if len(local_host_present) > 0:
-        counter = 1
         command_to_run = 'utstat -Y | grep shield | grep enabled'
         output_if_present = 'shield admin state:  enabled'
-        groups = batches(local_host_present, DEFAULT_BATCH_SIZE)
 
         print("\n\n====================note=====================")
         print(f"Checking {len(local_host_present)} modem(s) for shield state.....")
-        for group in groups:
-            print(f"Checking batch {counter} of {len(groups)}")
-            create_mac_list_file(jumpbox, MAC_LIST_FILE_NAME, group)
-            output, _ = run_mtool_command(
-                jumpbox, f"-a run_commands -m {MAC_LIST_FILE_NAME} -C '{command_to_run}'",
-                verbose=False,
-            )
-            # Check the output
-            for mac in group:
-                if check_if_cmd_had_expected_output(output, mac, output_if_present):
-                    modems_to_investigate.append(mac)
-                else:
-                    modems_not_broken.append(mac)
-            counter += 1
+        outcomes = MtoolFleetExecutor(
+            jumpbox, "check_shield", f"-a run_commands -C '{command_to_run}'",
+            expected_output_classifier([(output_if_present, 'broken')], otherwise='healthy'),
+            retries=1,
+            unresolved_outcome='healthy',
+        ).run(local_host_present)
+        modems_to_investigate += macs_with_outcome(outcomes, 'broken')
+        modems_not_broken += macs_with_outcome(outcomes, 'healthy')
 
     # Fix the broken modems by rebooting
     if len(modems_to_investigate) > 0:
-        counter = 1
         command_to_run = 'reboot'
-        groups = batches(modems_to_investigate, DEFAULT_BATCH_SIZE)
 
         print("\n\n====================note=====================")
         print(f"Fixing {len(modems_to_investigate)} modem(s).....")
-        for group in groups:
-            print(f"Fixing batch {counter} of {len(groups)}")
-            create_mac_list_file(jumpbox, MAC_LIST_FILE_NAME, group)
-            output, _ = run_mtool_command(
-                jumpbox, f"-a run_commands -m {MAC_LIST_FILE_NAME} -C '{command_to_run}'",
-                verbose=False,
-            )
-            counter += 1
+        MtoolFleetExecutor(
+            jumpbox, "reboot", f"-a run_commands -C '{command_to_run}'", retries=0,
+        ).run(modems_to_investigate)
 
     jumpbox.clear_any_previous_results(prefix="ut_macs_")
     jumpbox.disconnect()
@@ -416,27 +393,21 @@ def get_42x_and_vstat():
     # jumpbox.run_command("sshca-client -v")
 
     command_to_run = 'utstat -Y | grep "ufwd admin state"'
-    groups = batches(formatted_old_vstat_list, DEFAULT_BATCH_SIZE)
-    counter = 1
 
     print("\n\n====================note=====================")
     print(f"Checking {len(formatted_old_vstat_list)} modem(s) for uForwarder status....")
-    for group in groups:
-        print(f"Checking batch {counter} of {len(groups)}")
-        create_mac_list_file(jumpbox, MAC_LIST_FILE_NAME, group)
-        output, _ = run_mtool_command(
-            jumpbox, f"-a run_commands -m {MAC_LIST_FILE_NAME} -C '{command_to_run}'",
-            verbose=False,
-        )
-        # Check the output
-        for mac in group:
-            if check_if_cmd_had_expected_output(output, mac, 'ufwd admin state:    enabled'):
-                modems_to_investigate.append(mac)
-            elif check_if_cmd_had_expected_output(output, mac, 'ufwd admin state:    disabled'):
-                modems_not_broken.append(mac)
-            else:
-                offline.append(mac)
-        counter += 1
+    outcomes = MtoolFleetExecutor(
+        jumpbox, "check_ufwd", f"-a run_commands -C '{command_to_run}'",
+        expected_output_classifier([
+            ('ufwd admin state:    enabled', 'broken'),
+            ('ufwd admin state:    disabled', 'healthy'),
+        ]),
+        retries=1,
+        unresolved_outcome='offline',
+    ).run(formatted_old_vstat_list)
+    modems_to_investigate += macs_with_outcome(outcomes, 'broken')
+    modems_not_broken += macs_with_outcome(outcomes, 'healthy')
+    offline += macs_with_outcome(outcomes, 'offline')
 
     if len(modems_to_investigate) > 0:
         print("\n\n====================action_needed=====================")
@@ -483,6 +454,159 @@ def get_vwa_stragglers():
     return vwa_mac_list
 
 
+def get_all_app_stragglers():
+    """
+    A function to get the stragglers for every app whose version is kept in its App row in
+    the ACS (modoc, modoc rules, vstat, esp and statpush) with a single pass over those rows,
+    rather than the separate queries that get_modoc_stragglers() etc. run for each of them
+    :return: a dictionary mapping profile names to lists of mac addresses, with up to
+             max_num_modems randomly chosen stragglers for each profile
+    """
+    all_hardware = (
+        import_list.UT_HW + import_list.UT2_HW + import_list.DATA_HW + import_list.SPOCK_HW
+    )
+    print("\n====================all_apps=====================")
+    with AcsDb() as acs_db:
+        stragglers = find_app_stragglers(
+            acs_db.iterate_app_services(all_hardware), app_straggler_rules()
+        )
+
+    # Error check the max limit sent by Jenkins. Default to 100 if the check fails
+    max_modem_limit = get_expected_env_var("max_num_modems")
+    if not is_valid_number(max_modem_limit):
+        print(f' \nERROR: non-integer limit "{max_modem_limit}" provided')
+        max_modem_limit = 100
+
+    for profile, macs in stragglers.items():
+        print(f"Found {len(macs)} straggler(s) for {profile}")
+        stragglers[profile] = random.sample(sorted(macs), min(len(macs), int(max_modem_limit)))
+    return stragglers
+
+
+def app_straggler_rules():
+    """
+    A function to translate the versions in update_stragglers_versions into the same checks
+    that get_modoc_stragglers(), get_vstat_stragglers(), get_esp_stragglers() and
+    get_statpush_stragglers() make in SQL, so they can be made on the rows of every app at once
+    :return: a list of tuples containing a profile name and a function that takes a modem's
+             hardware version and its App rows and returns True if it needs that profile
+    """
+    modoc_hardware = import_list.UT2_HW + import_list.DATA_HW + import_list.SPOCK_HW
+    all_hardware = (
+        import_list.UT_HW + import_list.UT2_HW + import_list.DATA_HW + import_list.SPOCK_HW
+    )
+    # A modem without the app at all won't have an acceptable version of it either, so the
+    # version checks also cover the queries for modems missing modoc, vstats or esp entirely
+    return [
+        (
+            "modot_install_modoc",
+            lacks_app_value(
+                modoc_hardware, "value6", [f"modoc-{x}" for x in import_list.MODOC_VERSIONS]
+            ),
+        ),
+        (
+            "modot_install_modoc",
+            has_app_value_ending(
+                modoc_hardware,
+                "value10",
+                [
+                    f"with Version=2.4 and RulesVersion={x}"
+                    for x in import_list.MODOC_RULES_UNACCEPTABLE_VERSIONS
+                ],
+            ),
+        ),
+        (
+            "modot_install_vstat_<hw type>",
+            lacks_app_value(
+                import_list.UT2_HW + import_list.SPOCK_HW,
+                "value6",
+                [f"vstats-{x}" for x in import_list.VSTAT_VERSIONS],
+            ),
+        ),
+        (
+            "modot_install_esp",
+            lacks_app_value(
+                all_hardware, "value6", [f"esp-{x}" for x in import_list.ESP_VERSIONS]
+            ),
+        ),
+        ("modot_statpush_config_<hw type>", lacks_app_value(all_hardware, "value3", ["statpush"])),
+        (
+            "modot_statpush_config_<hw type>",
+            lacks_app_value(import_list.UT_HW, "value5", import_list.STATPUSH_UT_VERSIONS),
+        ),
+        (
+            "modot_statpush_config_<hw type>",
+            lacks_app_value(import_list.UT2_HW, "value5", import_list.STATPUSH_UT2_VERSIONS),
+        ),
+        (
+            "modot_statpush_config_<hw type>",
+            lacks_app_value(import_list.DATA_HW, "value5", import_list.STATPUSH_DATA_VERSIONS),
+        ),
+        (
+            "modot_statpush_config_<hw type>",
+            lacks_app_value(import_list.SPOCK_HW, "value5", import_list.STATPUSH_SPOCK_VERSIONS),
+        ),
+    ]
+
+
+def lacks_app_value(hardware, column, values):
+    """
+    A function to make a check for modems that have none of the given values in an App row,
+    ignoring case like the "=" and "IN" comparisons in the ACS database's SQL queries do
+    :param hardware: a list of the hardware versions the check applies to
+    :param column: a string with the name of the AXServiceTable column to look at
+    :param values: a list of the acceptable values for that column
+    :return: a function that takes a modem's hardware version and a list of
+             dictionaries containing its App rows and returns True if it's a straggler
+    """
+    values = {value.lower() for value in values}
+
+    def is_straggler(hardware_version, app_rows):
+        return hardware_version in hardware and not any(
+            (row[column] or "").lower() in values for row in app_rows
+        )
+
+    return is_straggler
+
+
+def has_app_value_ending(hardware, column, endings):
+    """
+    A function to make a check for modems that have an App row ending in one of the given values,
+    ignoring case like the "LIKE '%...'" comparisons in the ACS database's SQL queries do
+    :param hardware: a list of the hardware versions the check applies to
+    :param column: a string with the name of the AXServiceTable column to look at
+    :param endings: a list of the unacceptable endings for that column
+    :return: a function that takes a modem's hardware version and a list of
+             dictionaries containing its App rows and returns True if it's a straggler
+    """
+    endings = tuple(ending.lower() for ending in endings)
+
+    def is_straggler(hardware_version, app_rows):
+        return hardware_version in hardware and any(
+            (row[column] or "").lower().endswith(endings) for row in app_rows
+        )
+
+    return is_straggler
+
+
+def find_app_stragglers(rows, rules):
+    """
+    A function to check every modem's App rows against every rule as the rows stream in
+    :param rows: an iterable of dictionaries containing App rows, sorted by cid
+                 (see AcsDb.iterate_app_services())
+    :param rules: a list of tuples as returned by app_straggler_rules()
+    :return: a dictionary mapping profile names to sets of mac addresses
+    """
+    stragglers = {profile: set() for profile, _ in rules}
+    for cid, app_rows in groupby(rows, key=lambda row: row["cid"]):
+        app_rows = list(app_rows)
+        hardware_version = app_rows[0]["hardwareVersion"]
+        for profile, is_straggler in rules:
+            if is_straggler(hardware_version, app_rows):
+                stragglers[profile].add(cid)
+    return stragglers
+
+
 def run_sql_queries(application, hardware, helper_string=None):
     """
     A function to query the ACS SQL database
@@ -491,10 +615,8 @@ def run_sql_queries(application, hardware, helper_string=None):
     :param helper_string: an SQL fragment string of versions or other needed search strings
     :return: a list of dictionaries containing mac addresses
     """
-    acs_db = AcsDb()
-    db_query_results = acs_db.get_app_stragglers(application, hardware, helper_string)
-    acs_db.database.disconnect()
-    return db_query_results
+    with AcsDb() as acs_db:
+        return acs_db.get_app_stragglers(application, hardware, helper_string)
 
 
 def fix_stragglers_via_mtool(modems, profile):
@@ -503,24 +625,17 @@ def fix_stragglers_via_mtool(modems, profile):
     :param modems: a list of mac addresses
     :param profile: a string with the profile to apply
     """
-    jumpbox = Jumpbox()
+    jumpbox = JumpboxPool()
     # Refresh the ssh-ca certs
     # jumpbox.run_command("sshca-client -v")
-    mac_list_file_name = "ut_macs_app_stragglers.txt"
 
     print(f"\n====================note=====================")
     print(f"Attempting to fix {len(modems)} modem(s)")
-    groups = batches(modems, DEFAULT_BATCH_SIZE)
-    counter = 1
-
-    for group in groups:
-        print(f"Working on batch {counter} of {len(groups)}")
-        create_mac_list_file(jumpbox, mac_list_file_name, group)
-        run_mtool_command(
-            jumpbox, f"-a push_profile -m 'ut_macs_app_stragglers.txt' -P '{profile}' -i -t 10",
-            verbose=False
-        )
-        counter += 1
+    print(
+        f"Working on up to {get_max_parallel_commands()} batch(es) at a time"
+        f" on each of {len(jumpbox.jumpboxes)} jumpbox(es)"
+    )
+    MtoolFleetExecutor(jumpbox, "push_profile", f"-a push_profile -P '{profile}' -t 10").run(modems)
     jumpbox.clear_any_previous_results(prefix="ut_macs_")
     jumpbox.disconnect()
 
@@ -529,7 +644,8 @@ def format_straggler_list(modems):
     """
     A function to change a list of dictionaries containing mac addresses into
                             a single formatted list of modems
-    :param modems: a list of dictionaries containing mac addresses
+    :param modems: an iterable (e.g. a list or a generator of rows streaming
+                   in from the ACS database) of dictionaries containing mac addresses
     :return: a unique list of mac addresses considered to be stragglers
     """
     return list({modem["cid"] for modem in modems})
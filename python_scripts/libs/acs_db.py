@@ -3,6 +3,7 @@ Contains functionality for querying the ACS database (read-only).
 """
 
 import os
+import random
 from libs import common_utils, vault_utils
 from libs.mysql_db import MySqlDb
 
@@ -162,10 +163,8 @@ MODEM_EXCLUSIONS_ON_OR_OFFLINE = (
     "NOT LIKE 'MOBTEST_%%' AND cid LIKE '00A0BC%%'"
 )
 
-# The SQL fragment containing the columns and database for finding modem application stragglers
-MODEM_STRAGGLER_COLUMNS_DB_MODEMS = (
-    f"cid FROM acs_db.CPEManager_CPEs WHERE {MODEM_STRAGGLER_EXCLUSIONS} AND hardwareVersion IN "
-)
+# The start of the cid of every Viasat modem; the rest of it is six hex digits
+VIASAT_CID_PREFIX = "00A0BC"
 
 # The SQL fragment containing the standard query for missing apps or older app versions
 MODEM_STRAGGLER_DIFF_INNER_DB = "cid FROM AXServiceTable WHERE cid LIKE '00A0BC%%' AND"
@@ -181,15 +180,21 @@ class AcsDb:
 
     def __init__(self):
         """
-        Initialize the AcsDb class by pulling the credentials
-        from Vault and connecting to the MySQL database.
+        Initialize the AcsDb class by connecting to the MySQL database, pulling
+        the credentials from Vault if there isn't already a connection we can reuse.
         """
         usr = common_utils.ACS_DB_SERVICE_ACCT_USR
-        pwd = vault_utils.get_acs_db_service_account_password()
+        pwd = vault_utils.get_acs_db_service_account_password
         hostname = common_utils.get_expected_env_var("acs_db_hostname")
         db_name = "acs_db"
         self.database = MySqlDb(usr, pwd, hostname, db_name)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.database.disconnect()
+
     def connect(self):
         """
         Connect to the ACS database.
@@ -305,6 +310,8 @@ class AcsDb:
                                     ex. statpush on spock runs several different versions
         :return: a list of dictionaries containing mac addresses
         """
+        # The rows of each query are streamed straight onto the end of this list rather
+        # than being fetched into a list of their own and then copied over.
         straggler_modems_from_db = []
 
         # Error check the max limit sent by Jenkins. Default to 100 if the check fails
@@ -316,209 +323,233 @@ class AcsDb:
         # Format helpers are used to insert the desired number of %s entries
         # which will then be replaced by the "params" that are sent to
         # execute_query for safe sql queries
-        format_hw_str = ", ".join(["%s"] * len(hardware))
-        format_app_str = "".join("%s")
         format_helper_str = ""
+        helper_params = tuple(helper_string or ())
         if helper_string:
-            if len(helper_string) == 1:
-                format_helper_str = "".join("%s")
-            elif len(helper_string) > 1:
-                format_helper_str = ", ".join(["%s"] * len(helper_string))
+            format_helper_str = ", ".join(["%s"] * len(helper_string))
 
         # Build the SQL query based on the application selected in Jenkins
         try:
             if app in ["modoc", "esp", "vstats", "statpush"]:
                 # Looks for applicable modems that do not have the app entirely
-                sql_string = (
-                    f"SELECT {MODEM_STRAGGLER_COLUMNS_DB_MODEMS}(%s)"
-                    " AND cid NOT IN"
-                    f" (SELECT {MODEM_STRAGGLER_DIFF_INNER_DB} {MODEM_STRAGGLER_APPS}"
-                    " value3 = %s)"
-                    " ORDER BY RAND () LIMIT 0, %%s" % (format_hw_str, format_app_str)
-                )
-                straggler_modems_from_db += self.database.execute_query(
-                    sql_string,
-                    params=tuple(hardware) + (str(app),) + (int(max_modem_limit),),
-                    result_expected=True,
-                    verbose=False,
+                straggler_modems_from_db += self.sample_modems(
+                    hardware,
+                    f"{MODEM_STRAGGLER_APPS} value3 = %s",
+                    (str(app),),
+                    max_modem_limit,
                 )
                 # Then looks for applicable modems that have the app but an out of date version
                 if helper_string:
-                    sql_string = (
-                        f"SELECT {MODEM_STRAGGLER_COLUMNS_DB_MODEMS}(%s)"
-                        " AND cid NOT IN"
-                        f" (SELECT {MODEM_STRAGGLER_DIFF_INNER_DB} {MODEM_STRAGGLER_APPS}"
-                        " value6 IN (%s))"
-                        " ORDER BY RAND () LIMIT 0, %%s" % (format_hw_str, format_helper_str)
-                    )
-                    straggler_modems_from_db += self.database.execute_query(
-                        sql_string,
-                        params=tuple(hardware) + tuple(helper_string) + (int(max_modem_limit),),
-                        result_expected=True,
-                        verbose=False,
+                    straggler_modems_from_db += self.sample_modems(
+                        hardware,
+                        f"{MODEM_STRAGGLER_APPS} value6 IN ({format_helper_str})",
+                        helper_params,
+                        max_modem_limit,
                     )
             elif app in ["statpush_by_hw"]:
-                sql_string = (
-                    f"SELECT {MODEM_STRAGGLER_COLUMNS_DB_MODEMS}(%s)"
-                    " AND cid NOT IN"
-                    f" (SELECT {MODEM_STRAGGLER_DIFF_INNER_DB} {MODEM_STRAGGLER_APPS}"
-                    " value5 IN (%s))"
-                    " ORDER BY RAND () LIMIT 0, %%s" % (format_hw_str, format_helper_str)
-                )
-                straggler_modems_from_db += self.database.execute_query(
-                    sql_string,
-                    params=tuple(hardware) + tuple(helper_string) + (int(max_modem_limit),),
-                    result_expected=True,
-                    verbose=False,
+                straggler_modems_from_db += self.sample_modems(
+                    hardware,
+                    f"{MODEM_STRAGGLER_APPS} value5 IN ({format_helper_str})",
+                    helper_params,
+                    max_modem_limit,
                 )
             elif app in ["bb_url", "blueout"]:
-                sql_string = (
-                    f"SELECT {MODEM_STRAGGLER_COLUMNS_DB_MODEMS}(%s)"
-                    " AND cid NOT IN"
-                    f" (SELECT {MODEM_STRAGGLER_DIFF_INNER_DB}"
-                    " valueProps LIKE %s)"
-                    " ORDER BY RAND () LIMIT 0, %%s" % (format_hw_str, format_helper_str)
-                )
-                straggler_modems_from_db += self.database.execute_query(
-                    sql_string,
-                    params=tuple(hardware) + tuple(helper_string) + (int(max_modem_limit),),
-                    result_expected=True,
-                    verbose=False,
+                straggler_modems_from_db += self.sample_modems(
+                    hardware, f"valueProps LIKE {format_helper_str}", helper_params, max_modem_limit
                 )
-
             elif app in ["fl_unlock"]:
-                sql_string = (
-                    f"SELECT {MODEM_STRAGGLER_COLUMNS_DB_MODEMS}(%s)"
-                    " AND cid NOT IN"
-                    f" (SELECT {MODEM_STRAGGLER_DIFF_INNER_DB}"
-                    " servicetype = 'satelliteinterface' AND value3 IN (21600))"
-                    " ORDER BY RAND () LIMIT 0, %%s" % format_hw_str
-                )
-                straggler_modems_from_db += self.database.execute_query(
-                    sql_string,
-                    params=tuple(hardware) + (int(max_modem_limit),),
-                    result_expected=True,
-                    verbose=False,
+                straggler_modems_from_db += self.sample_modems(
+                    hardware,
+                    "servicetype = 'satelliteinterface' AND value3 IN (21600)",
+                    (),
+                    max_modem_limit,
                 )
             elif app in ["modoc_rules"]:
-                sql_string = (
-                    f"SELECT {MODEM_STRAGGLER_COLUMNS_DB_MODEMS}(%s)"
-                    " AND cid IN"
-                    f" (SELECT {MODEM_STRAGGLER_DIFF_INNER_DB}"
-                    " servicetype = 'App' and value10 LIKE %s)"
-                    " ORDER BY RAND () LIMIT 0, %%s" % (format_hw_str, format_helper_str)
-                )
-                straggler_modems_from_db += self.database.execute_query(
-                    sql_string,
-                    params=tuple(hardware) + tuple(helper_string) + (int(max_modem_limit),),
-                    result_expected=True,
-                    verbose=False,
+                straggler_modems_from_db += self.sample_modems(
+                    hardware,
+                    f"servicetype = 'App' and value10 LIKE {format_helper_str}",
+                    helper_params,
+                    max_modem_limit,
+                    has_service=True,
                 )
             elif app in ["fw_dwld"]:
-                sql_string = (
-                    f"SELECT {MODEM_STRAGGLER_COLUMNS_DB_MODEMS}(%s)"
-                    " AND cid IN"
-                    f" (SELECT {MODEM_STRAGGLER_DIFF_INNER_DB}"
-                    " servicetype = 'Modem' AND value24 IS NULL)"
-                    " ORDER BY RAND () LIMIT 0, %%s" % format_hw_str
-                )
-                straggler_modems_from_db += self.database.execute_query(
-                    sql_string,
-                    params=tuple(hardware) + (int(max_modem_limit),),
-                    result_expected=True,
-                    verbose=False,
+                straggler_modems_from_db += self.sample_modems(
+                    hardware,
+                    "servicetype = 'Modem' AND value24 IS NULL",
+                    (),
+                    max_modem_limit,
+                    has_service=True,
                 )
             elif app in ["allowlist"]:
-                sql_string = (
-                    f"SELECT {MODEM_STRAGGLER_COLUMNS_DB_MODEMS}(%s)"
-                    " AND cid IN"
-                    f" (SELECT {MODEM_STRAGGLER_DIFF_INNER_DB}"
-                    " valueProps LIKE %s)"
-                    " ORDER BY RAND () LIMIT 0, %%s" % (format_hw_str, format_helper_str)
-                )
-                straggler_modems_from_db += self.database.execute_query(
-                    sql_string,
-                    params=tuple(hardware) + tuple(helper_string) + (int(max_modem_limit),),
-                    result_expected=True,
-                    verbose=False,
+                straggler_modems_from_db += self.sample_modems(
+                    hardware,
+                    f"valueProps LIKE {format_helper_str}",
+                    helper_params,
+                    max_modem_limit,
+                    has_service=True,
                 )
             elif app in ["shield_localhost"]:
                 # Note, this is a temporary addition, see TERMSW-32980
-                sql_string = (
-                    "SELECT cid FROM acs_db.CPEManager_CPEs WHERE state != "
-                    "4 AND cid LIKE '00A0BC%%' AND hardwareVersion IN (%s) "
-                    f"AND cid IN (SELECT {MODEM_STRAGGLER_DIFF_INNER_DB} "
-                    "servicetype = 'ModemMetaData' and value10 = 3) "
-                    "LIMIT 0, %%s" % format_hw_str
-                )
-                straggler_modems_from_db += self.database.execute_query(
-                    sql_string,
-                    params=tuple(hardware) + (int(max_modem_limit),),
-                    result_expected=True,
-                    verbose=False
+                straggler_modems_from_db += self.sample_modems(
+                    hardware,
+                    "servicetype = 'ModemMetaData' and value10 = 3",
+                    (),
+                    max_modem_limit,
+                    has_service=True,
+                    exclusions="state != 4 AND cid LIKE '00A0BC%%'",
                 )
             elif app in ["vstat_42x_fix"]:
                 # Note, this is a temporary addition, see TERMSW-33245
-                sql_string = (
-                    f"SELECT {MODEM_STRAGGLER_COLUMNS_DB_MODEMS}(%s)"
-                    " AND softwareVersion LIKE %s AND cid IN"
-                    f" (SELECT {MODEM_STRAGGLER_DIFF_INNER_DB}"
-                    " servicetype = 'App' AND value3 = 'vstats' AND"
-                    " value10 != 'CurrentStatus=Running with 2.1.4')"
-                    " ORDER BY RAND () LIMIT 0, %%s" % (format_hw_str, format_helper_str)
-                )
-                straggler_modems_from_db += self.database.execute_query(
-                    sql_string,
-                    params=tuple(hardware) + tuple(helper_string) + (int(max_modem_limit),),
-                    result_expected=True,
-                    verbose=False,
+                straggler_modems_from_db += self.sample_modems(
+                    hardware,
+                    "servicetype = 'App' AND value3 = 'vstats' AND"
+                    " value10 != 'CurrentStatus=Running with 2.1.4'",
+                    (),
+                    max_modem_limit,
+                    has_service=True,
+                    extra_filter=f"softwareVersion LIKE {format_helper_str}",
+                    extra_filter_params=helper_params,
                 )
             elif app in ["vwa"]:
-                sql_string = (
-                    f"SELECT {MODEM_STRAGGLER_COLUMNS_DB_MODEMS}(%s)"
-                    " AND cid IN"
-                    f" (SELECT {MODEM_STRAGGLER_DIFF_INNER_DB}"
-                    " servicetype = 'VWA' and right(value4,11) != value6)"
-                    " ORDER BY RAND () LIMIT 0, %%s" % format_hw_str
+                straggler_modems_from_db += self.sample_modems(
+                    hardware,
+                    "servicetype = 'VWA' and right(value4,11) != value6",
+                    (),
+                    max_modem_limit,
+                    has_service=True,
                 )
-                straggler_modems_from_db += self.database.execute_query(
-                    sql_string,
-                    params=tuple(hardware) + (int(max_modem_limit),),
-                    result_expected=True,
-                    verbose=False,
-                )
-                
+
             return straggler_modems_from_db
         except Exception as error_msg:
             return error_msg
 
-    def get_all_brazil_modems(self, use_dictionary=True):
+    def iterate_app_services(self, hardware):
+        """
+        Read the App rows in AXServiceTable for every modem with one of the given hardware
+        versions in a single pass, so that the version rules for every app can be checked
+        against them at once instead of running a query per app.
+
+        :param hardware: a list of hardware versions
+        :return: a generator of dictionaries containing each modem's cid, hardwareVersion, and
+                 the value3, value5, value6 and value10 columns of one of its App rows, sorted
+                 by cid so that a modem's rows are all together (a modem without any App
+                 rows gets one dictionary in which those four columns are None)
+        """
+        format_hw_str = ", ".join(["%s"] * len(hardware))
+        return self.database.iterate_query(
+            "SELECT c.cid, c.hardwareVersion, s.value3, s.value5, s.value6, s.value10"
+            " FROM (SELECT cid, hardwareVersion FROM acs_db.CPEManager_CPEs"
+            f" WHERE {MODEM_STRAGGLER_EXCLUSIONS % ()} AND hardwareVersion IN ({format_hw_str})) c"
+            " LEFT JOIN AXServiceTable s ON s.cid = c.cid AND s.servicetype = 'App'"
+            " ORDER BY c.cid",
+            params=tuple(hardware),
+            verbose=False,
+        )
+
+    def sample_modems(
+        self,
+        hardware,
+        service_condition,
+        service_params,
+        limit,
+        has_service=False,
+        extra_filter="",
+        extra_filter_params=(),
+        exclusions=MODEM_STRAGGLER_EXCLUSIONS,
+        columns="c.cid",
+        use_dictionary=True,
+    ):  # pylint: disable=too-many-arguments
+        """
+        Pull a random sample of modems from the ACS database that have (or don't have) a row in
+        AXServiceTable matching a condition, starting at a random cid and wrapping around to the
+        lowest cids if there aren't enough modems after it (see build_straggler_query()).
+
+        :param hardware: a list of acceptable hardware versions
+        :param service_condition: an SQL fragment with the conditions on AXServiceTable
+        :param service_params: a tuple containing service_condition's parameters
+        :param limit: a number representing the max quantity of modems to pull
+        :param has_service: True to pull modems that have a matching row in AXServiceTable,
+                            False to pull modems that don't
+        :param extra_filter: an SQL fragment with any other conditions on CPEManager_CPEs
+        :param extra_filter_params: a tuple containing extra_filter's parameters
+        :param exclusions: an SQL fragment with the conditions for leaving modems out
+        :param columns: an SQL fragment with the columns of CPEManager_CPEs to pull
+        :param use_dictionary: True to yield each row as a dictionary mapping column
+                               names to values, False to yield it as a tuple of values
+        :return: a generator of dictionaries or tuples representing the modems
+        """
+        limit = int(limit)
+        params = (
+            tuple(hardware)
+            + tuple(extra_filter_params)
+            + tuple(service_params)
+            + (random_cid_start(),)
+        )
+        sampled = 0
+        for wrap_around in [False, True]:
+            query = build_straggler_query(
+                len(hardware),
+                service_condition,
+                has_service=has_service,
+                extra_filter=extra_filter,
+                exclusions=exclusions,
+                columns=columns,
+                wrap_around=wrap_around,
+            )
+            for row in self.database.iterate_query(
+                query,
+                params=params + (limit - sampled,),
+                use_dictionary=use_dictionary,
+                verbose=False,
+            ):
+                sampled += 1
+                yield row
+            if sampled >= limit:
+                return
+
+    def get_all_brazil_modems(self, use_dictionary=True, stream=False):
         """
         A function to get a list of mac addresses from the ACS
         database based on realm, excluding mobile terminals.
 
+        :param use_dictionary: True to get each modem as a dictionary, False
+                               to get it as a (software version, mac address) tuple
+        :param stream: True to get a generator that yields the modems as they're read from the
+                       database (see MySqlDb.iterate_query()), False to get a list of them
         :return: a list of dictionaries containing software version and mac addresses
         """
         format_str = ", ".join(["%s"] * len(ALL_BRAZIL_REALMS))
         format_hw_str = ", ".join(["%s"] * len(BRAZIL_RES_HW_TYPES))
-        all_brazil_modems = self.database.execute_query(
+        query = (
             f"SELECT softwareVersion,cid FROM acs_db.CPEManager_CPEs "
             f"WHERE {MODEM_EXCLUSIONS_ON_OR_OFFLINE} AND hardwareVersion IN "
             f"(%s) AND cid IN (SELECT {MODEM_STRAGGLER_DIFF_INNER_DB} "
             f"servicetype = 'Modem' AND value2 IN (%s))"
-            % (format_hw_str, format_str),
-            params=tuple(BRAZIL_RES_HW_TYPES) + tuple(ALL_BRAZIL_REALMS),
+            % (format_hw_str, format_str)
+        )
+        params = tuple(BRAZIL_RES_HW_TYPES) + tuple(ALL_BRAZIL_REALMS)
+        if stream:
+            return self.database.iterate_query(
+                query, params=params, use_dictionary=use_dictionary, verbose=False
+            )
+        all_brazil_modems = self.database.execute_query(
+            query,
+            params=params,
             result_expected=True,
             use_dictionary=use_dictionary,
             verbose=False,
         )
         return all_brazil_modems
 
-    def get_online_brazil_modems(self, use_dictionary=True):
+    def get_online_brazil_modems(self, use_dictionary=True, stream=False):
         """
         A function to get a list of online mac addresses from the ACS
         database based on realm, excluding offline and mobile terminals.
 
+        :param use_dictionary: True to get each modem as a dictionary, False
+                               to get it as a (software version, mac address) tuple
+        :param stream: True to get a generator that yields the modems as they're read from the
+                       database (see MySqlDb.iterate_query()), False to get a list of them
         :return: a list of dictionaries containing software version and mac addresses
         """
         # Error check the max limit sent by Jenkins. Default to 100 if the check fails
@@ -528,18 +559,73 @@ class AcsDb:
             max_modem_limit = 100
 
         format_str = ", ".join(["%s"] * len(ALL_BRAZIL_REALMS))
-        format_hw_str = ", ".join(["%s"] * len(BRAZIL_RES_HW_TYPES))
-        online_brazil_modems = self.database.execute_query(
-           f"SELECT softwareVersion,{MODEM_STRAGGLER_COLUMNS_DB_MODEMS}"
-           f"(%s) AND cid IN (SELECT {MODEM_STRAGGLER_DIFF_INNER_DB} "
-           f"servicetype = 'Modem' AND value2 IN (%s)) ORDER BY RAND () LIMIT 0, %%s"
-           % (format_hw_str, format_str),
-           params=tuple(BRAZIL_RES_HW_TYPES) + tuple(ALL_BRAZIL_REALMS) + (int(max_modem_limit),),
-           result_expected=True,
-           use_dictionary=use_dictionary,
-           verbose=False,
+        online_brazil_modems = self.sample_modems(
+            BRAZIL_RES_HW_TYPES,
+            f"servicetype = 'Modem' AND value2 IN ({format_str})",
+            tuple(ALL_BRAZIL_REALMS),
+            max_modem_limit,
+            has_service=True,
+            columns="c.softwareVersion, c.cid",
+            use_dictionary=use_dictionary,
         )
-        return online_brazil_modems
+        if stream:
+            return online_brazil_modems
+        return list(online_brazil_modems)
+
+
+def build_straggler_query(
+    hardware_count,
+    service_condition,
+    has_service=False,
+    extra_filter="",
+    exclusions=MODEM_STRAGGLER_EXCLUSIONS,
+    columns="c.cid",
+    wrap_around=False,
+):  # pylint: disable=too-many-arguments
+    """
+    Build a query that pulls modems from CPEManager_CPEs that have (or don't have) a row in
+    AXServiceTable matching a condition.
+
+    The check is a correlated [NOT] EXISTS so that MySQL can run it as a semi-join (or anti-join)
+    that looks up each candidate's rows in AXServiceTable by cid, instead of building the whole
+    list of cids that a NOT IN subquery returns. Rather than sorting every matching modem with
+    ORDER BY RAND(), the query reads forward in cid order from a random starting cid, so it only
+    has to read about as many rows as it returns. (Modems after a big gap in the cids are a bit
+    more likely to be picked, which is fine for spreading the work out between runs.)
+
+    :param hardware_count: a number representing how many hardware versions are in the params
+    :param service_condition: an SQL fragment with the conditions on AXServiceTable
+    :param has_service: True to pull modems that have a matching row in AXServiceTable,
+                        False to pull modems that don't
+    :param extra_filter: an SQL fragment with any other conditions on CPEManager_CPEs
+    :param exclusions: an SQL fragment with the conditions for leaving modems out
+                       (with any literal % escaped as %%, like MODEM_STRAGGLER_EXCLUSIONS)
+    :param columns: an SQL fragment with the columns of CPEManager_CPEs to pull
+    :param wrap_around: False to pull modems whose cids are at or after the starting
+                        cid, True to pull the ones before it
+    :return: a string representing the query, whose params are the hardware versions,
+             extra_filter's params, service_condition's params, the starting cid, and the limit
+    """
+    format_hw_str = ", ".join(["%s"] * hardware_count)
+    exists = "EXISTS" if has_service else "NOT EXISTS"
+    extra_filter = f" AND {extra_filter}" if extra_filter else ""
+    comparison = "<" if wrap_around else ">="
+    return (
+        f"SELECT {columns} FROM acs_db.CPEManager_CPEs c"
+        f" WHERE {exclusions % ()} AND c.hardwareVersion IN ({format_hw_str}){extra_filter}"
+        f" AND {exists} (SELECT 1 FROM AXServiceTable s"
+        f" WHERE s.cid = c.cid AND {service_condition})"
+        f" AND c.cid {comparison} %s ORDER BY c.cid LIMIT %s"
+    )
+
+
+def random_cid_start():
+    """
+    Pick a random cid to start pulling a sample of modems from.
+
+    :return: a string representing a cid somewhere in the range of Viasat cids
+    """
+    return f"{VIASAT_CID_PREFIX}{random.randrange(16 ** 6):06X}"
 
 
 def get_permitted_realms():
@@ -5,13 +5,15 @@ Contains generic functionality for interfacing with the Artifactory REST API
 import os
 import hashlib
 from typing import List, Tuple
-import requests
-from libs import common_utils
+from libs import common_utils, http_utils
 
 ARTI_API = "https://artifactory.viasat.com/artifactory/api/storage"
 ARTI_BASE_URL = "https://artifactory.viasat.com/artifactory"
 LIST_SUFFIX = "?list"
 
+# uploading and downloading artifacts can take much longer than a typical API call
+TRANSFER_TIMEOUT = (http_utils.CONNECT_TIMEOUT, 600)  # seconds
+
 
 def put_file(auth: Tuple[str], src_path: str, dest_uri: str) -> str:
     """
@@ -40,7 +42,13 @@ def put_file(auth: Tuple[str], src_path: str, dest_uri: str) -> str:
             "X-Checksum-Sha1": sha1sum,
             "X-Checksum-Sha256": sha256sum,
         }
-        resp = requests.put(f"{ARTI_BASE_URL}{dest_uri}", auth=auth, data=file, headers=headers)
+        resp = http_utils.put(
+            f"{ARTI_BASE_URL}{dest_uri}",
+            auth=auth,
+            data=file,
+            headers=headers,
+            timeout=TRANSFER_TIMEOUT,
+        )
         try:
             if resp.status_code in (201, 200):
                 return resp.json()
@@ -64,7 +72,7 @@ def get_artifact_list(auth: Tuple[str], path: str) -> List[str]:
     """
     # Extract uri from each element of artifacts list and return as list of strings
     # ignore any folders encountered
-    resp = requests.get(ARTI_API + path + LIST_SUFFIX + "&listFolders=0", auth=auth)
+    resp = http_utils.get(ARTI_API + path + LIST_SUFFIX + "&listFolders=0", auth=auth)
     resp.raise_for_status()
     raw_list = resp.json()["files"]
     return [x["uri"] for x in raw_list]
@@ -78,7 +86,7 @@ def download_file(auth: Tuple[str], uri: str):
         auth (tuple): Username and password tuple used to access Artifactory
         uri (str): Path to the Artifactory repository and subfolders
     """
-    resp = requests.get(f"{ARTI_BASE_URL}{uri}", auth=auth)
+    resp = http_utils.get(f"{ARTI_BASE_URL}{uri}", auth=auth, timeout=TRANSFER_TIMEOUT)
     resp.raise_for_status()
     with open(os.path.basename(uri), "wb") as file:
         file.write(resp.content)
@@ -3,10 +3,44 @@ Contains functionality for querying the beam drift database. We use this
 database to keep track of information across runs of the beam drift job.
 """
 
+import os
 from netaddr import valid_mac
 from libs.mysql_db import MySqlDb
 from libs import common_utils, vault_utils
 
+# how many rows to read or write per query when operating on many modems at once
+CHUNK_SIZE_DEFAULT = 500
+
+# the tables that the brazil odu.conf fixer keeps track of modems in; table names can't be
+# passed as query parameters, so only these are allowed to be formatted into its queries
+BRAZIL_ODU_TABLES = ["brazil_odu_conf_file_true", "brazil_odu_conf_offline"]
+
+# the columns the brazil odu tables use to keep track of when each modem was last checked and
+# what software it was running at the time, which jobs/add_tracking_columns_to_brazil_odu_tables.py
+# adds to the tables (until it's run, the tables are read and written without them)
+BRAZIL_ODU_TRACKING_COLUMNS = {"sw_version": "VARCHAR(64) NULL", "last_checked": "DATETIME NULL"}
+
+# the brazil odu tables that we've already seen have the tracking columns during this run
+_brazil_tables_with_tracking = set()
+
+
+def get_chunk_size():
+    """
+    Determine how many rows to read or write per query when operating on many modems at once.
+
+    :return: a number representing the max quantity of modems per bulk query during this run
+             of the job. This is specified by an optional parameter to the job. If unspecified,
+             a default is used.
+    """
+    if "beam_drift_db_chunk_size" in os.environ:
+        try:
+            chunk_size = int(common_utils.get_expected_env_var("beam_drift_db_chunk_size"))
+            if chunk_size > 0:
+                return chunk_size
+        except (ValueError, TypeError) as ex:
+            print(ex)
+    return CHUNK_SIZE_DEFAULT
+
 
 class BeamDriftDb:
     """
@@ -15,15 +49,21 @@ class BeamDriftDb:
 
     def __init__(self):
         """
-        Initialize the BeamDriftDb class by pulling the credentials
-        from Vault and connecting to the MySQL database.
+        Initialize the BeamDriftDb class by connecting to the MySQL database, pulling
+        the credentials from Vault if there isn't already a connection we can reuse.
         """
         usr = common_utils.BEAM_DRIFT_DB_SERVICE_ACCT_USER
-        pwd = vault_utils.get_beam_drift_db_service_account_password()
+        pwd = vault_utils.get_beam_drift_db_service_account_password
         hostname = "beam-drift-db.cacxgne3yan9.us-east-1.rds.amazonaws.com"
         db_name = "drifted_modems"
         self.database = MySqlDb(usr, pwd, hostname, db_name)
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.database.disconnect()
+
     def connect(self):
         """
         Connect to the ACS database.
@@ -62,8 +102,42 @@ class BeamDriftDb:
             params={"mac": mac, "goal_sat": goal_sat, "goal_beam": goal_beam, "goal_pol": goal_pol},
             result_expected=False,
             verbose=verbose,
+            prepared=True,
         )
 
+    def update_goals(self, goals, verbose=False):
+        """
+        Update many modems' goal beams in the local database using one query per chunk of modems.
+
+        :param goals: a list of tuples (mac, goal sat, goal beam, goal pol)
+        :param verbose: True to print the queries and their results, False otherwise
+        """
+        valid_goals = []
+        for mac, goal_sat, goal_beam, goal_pol in goals:
+            if not (
+                valid_mac(mac)
+                and common_utils.is_valid_number(goal_sat)
+                and common_utils.is_valid_number(goal_beam)
+                and common_utils.is_valid_beam_pol(goal_pol)
+            ):
+                print(
+                    f' \nERROR: invalid MAC address "{mac}", goal sat "{goal_sat}",'
+                    f' goal beam "{goal_beam}", or goal pol "{goal_pol}"'
+                )
+                continue
+            valid_goals.append((mac, goal_sat, goal_beam, goal_pol))
+
+        for chunk in common_utils.batches(valid_goals, get_chunk_size()):
+            self.database.execute_query(
+                "INSERT INTO goals(mac, goal_sat, goal_beam, goal_pol)"
+                f" VALUES {', '.join(['(%s, %s, %s, %s)'] * len(chunk))}"
+                " ON DUPLICATE KEY UPDATE goal_sat=VALUES(goal_sat),"
+                " goal_beam=VALUES(goal_beam), goal_pol=VALUES(goal_pol);",
+                params=tuple(value for goal in chunk for value in goal),
+                result_expected=False,
+                verbose=verbose,
+            )
+
     def look_up_goal(self, mac, use_dictionary=True, verbose=True):
         """
         Look up the goal beam for a modem in our local database.
@@ -87,9 +161,45 @@ class BeamDriftDb:
             result_expected=True,
             use_dictionary=use_dictionary,
             verbose=verbose,
+            prepared=True,
         )
         return result[0] if result else {}
 
+    def look_up_goals(self, macs, verbose=True):
+        """
+        Look up the goal beams for many modems in our local database
+        using one query per chunk of modems.
+
+        :param macs: a list of strings representing the MAC addresses
+                     of modems whose goal beam info we want to look up
+        :param verbose: True to print the queries and their results, False otherwise
+        :return: a dictionary mapping each input MAC address that has a saved goal to a dictionary
+                 representing its goal beam; looks like:
+                 {"AABBCCDDEEFF": {"goal_sat": 999, goal_beam: "999", goal_pol: "LHCP"}}
+        """
+        valid_macs = []
+        for mac in macs:
+            if valid_mac(mac):
+                valid_macs.append(mac)
+            else:
+                print(f' \nERROR: invalid MAC address "{mac}"')
+        input_macs = {mac.upper(): mac for mac in valid_macs}
+
+        goals = {}
+        for chunk in common_utils.batches(list(input_macs.values()), get_chunk_size()):
+            result = self.database.execute_query(
+                "SELECT mac, goal_sat, goal_beam, goal_pol FROM goals"
+                f" WHERE mac IN ({', '.join(['%s'] * len(chunk))});",
+                params=tuple(chunk),
+                result_expected=True,
+                verbose=verbose,
+            )
+            for row in result:
+                mac = input_macs.get(str(row.pop("mac")).upper())
+                if mac:
+                    goals[mac] = row
+        return goals
+
     def look_up_goal_without_pol(self, mac, use_dictionary=True, verbose=True):
         """
         Look up the goal beam for a modem in the old version of our database.
@@ -145,8 +255,43 @@ class BeamDriftDb:
             params={"mac": mac, "sat": sat, "cross_pol": cross_pol},
             result_expected=False,
             verbose=verbose,
+            prepared=True,
         )
 
+    def flag_unhelpable_modems(self, modems, verbose=False):
+        """
+        Flag many modems as having a possible issue switching
+        polarizations using one query per chunk of modems.
+
+        :param modems: a list of tuples (mac, sat, cross_pol) where cross_pol is a boolean
+                       representing whether the modem was attempting to move to a beam
+                       of an opposite polarization
+        :param verbose: True to print the queries and their results, False otherwise
+        """
+        valid_modems = {}
+        for mac, sat, cross_pol in modems:
+            if not valid_mac(mac):
+                print(f' \nERROR: invalid MAC address "{mac}"')
+            elif not common_utils.is_valid_number(sat):
+                print(f" \nERROR: invalid satellite ID {sat}")
+            elif not common_utils.is_valid_bool(cross_pol):
+                print(f" \nERROR: invalid boolean {cross_pol}")
+            else:
+                valid_modems.setdefault(mac.upper(), (mac, sat, cross_pol))
+
+        # Like flag_unhelpable_modem(), only add modems that aren't flagged already.
+        for chunk in common_utils.batches(list(valid_modems.values()), get_chunk_size()):
+            self.database.execute_query(
+                "INSERT INTO will_not_move (mac, sat, cross_pol)"
+                " SELECT candidate.mac, candidate.sat, candidate.cross_pol FROM ("
+                + " UNION ALL ".join(["SELECT %s AS mac, %s AS sat, %s AS cross_pol"] * len(chunk))
+                + ") AS candidate"
+                " WHERE NOT EXISTS (SELECT mac FROM will_not_move WHERE mac = candidate.mac);",
+                params=tuple(value for modem in chunk for value in modem),
+                result_expected=False,
+                verbose=verbose,
+            )
+
     def get_broken_pol_switch_candidates(self, added_since=None, verbose=False):
         """
         Retrieve the list of modems that have been flagged
@@ -286,6 +431,8 @@ class BeamDriftDb:
         :param table: name of a table to retrieve contents
         :return: a list of dictionaries containing mac addresses
         """
+        if not is_brazil_table(table):
+            return []
         format_table = (table,)
         return self.database.execute_query(
             "SELECT mac FROM %s;" % format_table,
@@ -293,28 +440,166 @@ class BeamDriftDb:
             verbose=False,
         )
 
-    def add_brazil_records(self, mac, table):
+    def get_brazil_check_records(self, table, max_age_days):
         """
-        A function to add a mac address to the brazil odu table.
+        A function to retrieve when each modem in the brazil odu table was last checked.
 
-        :param mac: a string representing a mac address
-        :param table: name of table to add to
+        :param table: name of a table to retrieve contents
+        :param max_age_days: a number representing how many days old a check can be before
+                             the modem should be checked again
+        :return: a list of dictionaries containing mac addresses, the software version each
+                 modem was running when it was checked ("sw_version", None if unknown), and
+                 whether that check is older than max_age_days or of unknown age ("stale")
         """
-        self.database.execute_query(
-            "INSERT IGNORE INTO %s (mac) VALUES ('%s')" % (table, mac),
-            result_expected=False,
+        if not is_brazil_table(table):
+            return []
+        if not self.has_brazil_tracking_columns(table):
+            print(f" \n{table} has no tracking columns, so treating all of its checks as stale")
+            return self.database.execute_query(
+                "SELECT mac, NULL AS sw_version, 1 AS stale FROM %s;" % (table,),
+                result_expected=True,
+                verbose=False,
+            )
+        return self.database.execute_query(
+            "SELECT mac, sw_version,"
+            " (last_checked IS NULL OR last_checked < NOW() - INTERVAL %%s DAY) AS stale"
+            " FROM %s;" % (table,),
+            params=(int(max_age_days),),
+            result_expected=True,
             verbose=False,
         )
 
+    def add_brazil_records_in_bulk(self, macs, table, software_versions, checked=True):
+        """
+        A function to add many mac addresses to the brazil odu table using one query per chunk,
+        recording which software versions they're running and, if they were checked
+        successfully, that they were checked just now.
+
+        :param macs: a list of strings representing mac addresses
+        :param table: name of table to add to
+        :param software_versions: a dictionary mapping mac addresses to software versions
+        :param checked: True to record the modems as checked just now, False to leave their
+                        last check time empty so that the next incremental scan checks them
+                        again (e.g. because they were offline)
+        """
+        if not is_brazil_table(table):
+            return
+        has_tracking_columns = self.has_brazil_tracking_columns(table)
+        for chunk in common_utils.batches(list(macs), get_chunk_size()):
+            if has_tracking_columns:
+                row_str = "(%s, %s, NOW())" if checked else "(%s, %s, NULL)"
+                self.database.execute_query(
+                    "INSERT INTO %s (mac, sw_version, last_checked) VALUES %s"
+                    " ON DUPLICATE KEY UPDATE sw_version=VALUES(sw_version),"
+                    " last_checked=VALUES(last_checked);"
+                    % (table, ", ".join([row_str] * len(chunk))),
+                    params=tuple(
+                        value for mac in chunk for value in (mac, software_versions.get(mac))
+                    ),
+                    result_expected=False,
+                    verbose=False,
+                )
+            else:
+                self.database.execute_query(
+                    "INSERT IGNORE INTO %s (mac) VALUES %s;"
+                    % (table, ", ".join(["(%s)"] * len(chunk))),
+                    params=tuple(chunk),
+                    result_expected=False,
+                    verbose=False,
+                )
+
+    def has_brazil_tracking_columns(self, table):
+        """
+        A function to check whether the brazil odu table has the columns
+        in BRAZIL_ODU_TRACKING_COLUMNS yet.
+
+        :param table: name of table to check
+        :return: True if the table has the columns, False otherwise
+        """
+        if table not in _brazil_tables_with_tracking:
+            if set(BRAZIL_ODU_TRACKING_COLUMNS) <= self.get_brazil_columns(table):
+                _brazil_tables_with_tracking.add(table)
+        return table in _brazil_tables_with_tracking
+
+    def add_brazil_tracking_columns(self, table):
+        """
+        A function to add the columns in BRAZIL_ODU_TRACKING_COLUMNS to
+        the brazil odu table if it doesn't have them yet. Only meant to be run by
+        jobs/add_tracking_columns_to_brazil_odu_tables.py, since it needs ALTER privileges.
+
+        :param table: name of table to add them to
+        :return: True if the table has the columns, False otherwise
+        """
+        if not is_brazil_table(table):
+            return False
+        if self.has_brazil_tracking_columns(table):
+            return True
+        existing_columns = self.get_brazil_columns(table)
+        if not existing_columns:
+            print(f" \nERROR: couldn't look up the columns of {table}")
+            return False
+        missing_columns = [
+            f"ADD COLUMN {column} {definition}"
+            for column, definition in BRAZIL_ODU_TRACKING_COLUMNS.items()
+            if column not in existing_columns
+        ]
+        if missing_columns:
+            print(f" \nadding {len(missing_columns)} tracking column(s) to {table}")
+            self.database.execute_query(
+                "ALTER TABLE %s %s;" % (table, ", ".join(missing_columns)),
+                result_expected=False,
+                verbose=False,
+            )
+            # execute_query() prints errors rather than raising them, so make sure it worked
+            still_missing = set(BRAZIL_ODU_TRACKING_COLUMNS) - self.get_brazil_columns(table)
+            if still_missing:
+                print(f" \nERROR: couldn't add {', '.join(sorted(still_missing))} to {table}")
+                return False
+        _brazil_tables_with_tracking.add(table)
+        return True
+
+    def get_brazil_columns(self, table):
+        """
+        A function to look up the names of the columns in the brazil odu table.
+
+        :param table: name of table to look up
+        :return: a set of lowercase strings representing column names, empty if the lookup failed
+        """
+        return {
+            row["COLUMN_NAME"].lower()
+            for row in self.database.execute_query(
+                "SELECT COLUMN_NAME FROM information_schema.COLUMNS"
+                " WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME = %s;",
+                params=(table,),
+                result_expected=True,
+                verbose=False,
+            )
+        }
+
     def delete_brazil_records(self, table):
         """
         A function to delete all records from the brazil odu table.
 
         :param table: name of table to clear
         """
+        if not is_brazil_table(table):
+            return
         format_table = (table,)
         self.database.execute_query(
             "TRUNCATE TABLE %s" % format_table,
             result_expected=False,
             verbose=False,
         )
+
+
+def is_brazil_table(table):
+    """
+    Check that a table name is one of the brazil odu tables before formatting it into a query.
+
+    :param table: a string representing the name of a table
+    :return: True if it's one of BRAZIL_ODU_TABLES, False otherwise
+    """
+    if table in BRAZIL_ODU_TABLES:
+        return True
+    print(f' \nERROR: "{table}" is not one of the brazil odu tables {BRAZIL_ODU_TABLES}')
+    return False
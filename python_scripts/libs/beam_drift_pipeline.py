@@ -0,0 +1,493 @@
+"""
+Contains an alternative engine for Step #4 - Step #15 of the beam drift job.
+
+Rather than running each step on the whole batch of modems and waiting for the slowest modem
+before starting the next step, each modem moves through the steps on its own as a small state
+machine. A scheduler repeatedly picks whichever step has modems ready for it and runs that step
+on just those modems, so a modem that comes online quickly can have its LKG file fixed while
+other modems are still waiting to come online.
+"""
+
+from time import sleep, time
+from libs import beam_drift_utils, cmt_utils
+
+# the states a modem can be in, each corresponding to a step of the job
+WAIT_ONLINE_AFTER_CLEAR = 4
+RESTART_CWMP = 5
+WAIT_ONLINE_AFTER_CWMP_RESTART = 6
+CHECK_BEAM_AFTER_CWMP_RESTART = 7
+CHECK_GOAL_BEAM_IN_LKG = 8
+GET_GOOD_LKG = 9
+BACK_UP_LKG = 10
+PUSH_LKG = 11
+REBOOT = 12
+WAIT_ONLINE_AFTER_REBOOT = 13
+RE_PIN = 14
+CHECK_BEAM_AFTER_REBOOT = 15
+DONE = None
+
+WAIT_STATES = [WAIT_ONLINE_AFTER_CLEAR, WAIT_ONLINE_AFTER_CWMP_RESTART, WAIT_ONLINE_AFTER_REBOOT]
+
+# The steps we can run on batches of modems, in order of priority. Later steps go first so that
+# modems that are furthest along finish as soon as possible.
+ACTION_STATES = [
+    RE_PIN,
+    CHECK_BEAM_AFTER_REBOOT,
+    REBOOT,
+    PUSH_LKG,
+    BACK_UP_LKG,
+    GET_GOOD_LKG,
+    CHECK_GOAL_BEAM_IN_LKG,
+    CHECK_BEAM_AFTER_CWMP_RESTART,
+    RESTART_CWMP,
+]
+
+STATE_DESCRIPTIONS = {
+    WAIT_ONLINE_AFTER_CLEAR: "waiting to come online after clearing beam pinning",
+    RESTART_CWMP: "restarting CWMP",
+    WAIT_ONLINE_AFTER_CWMP_RESTART: "waiting to come online after CWMP restart",
+    CHECK_BEAM_AFTER_CWMP_RESTART: "checking beam after CWMP restart",
+    CHECK_GOAL_BEAM_IN_LKG: "checking whether goal beam is in LKG file",
+    GET_GOOD_LKG: "retrieving good LKG file",
+    BACK_UP_LKG: "backing up existing LKG file",
+    PUSH_LKG: "pushing good LKG file",
+    REBOOT: "rebooting",
+    WAIT_ONLINE_AFTER_REBOOT: "waiting to come online after reboot",
+    RE_PIN: "re-pinning to goal beam",
+    CHECK_BEAM_AFTER_REBOOT: "checking beam after reboot",
+}
+
+# the result lists this engine fills in, named after the arguments of print_results() in
+# correct_beam_drifted_modems.py (except re_pinned, which the job uses to re-pin the rest)
+RESULT_NAMES = [
+    "offline_after_clear",
+    "failed_to_restart_cwmp",
+    "offline_after_cwmp_restart",
+    "on_goal_beam_after_cwmp_restart",
+    "failed_to_check_beam_after_cwmp_restart",
+    "goal_beam_in_lkg_same_pol",
+    "goal_beam_in_lkg_opp_pol",
+    "no_lkg_found",
+    "failed_to_back_up_lkg",
+    "error_pushing_lkg",
+    "pushed_lkg_files",
+    "offline_after_reboot",
+    "online_after_reboot",
+    "failed_to_re_pin",
+    "on_wrong_beam_opp_pol",
+    "on_wrong_beam_same_pol",
+    "failed_to_check_beam",
+    "on_goal_beam",
+    "re_pinned",
+]
+
+
+def get_modems_left_to_re_pin(drifted_modems, results):
+    """
+    Step #14 - Get the drifted modems that the pipeline didn't try to re-pin.
+
+    :param drifted_modems: a list of dictionaries that represent modems
+                           that have drifted from their intended beams
+    :param results: a dictionary returned by BeamDriftPipeline.run()
+    :return: a list of dictionaries representing the modems that still need re-pinning
+    """
+    attempted_macs = {modem["mac"] for modem in results["re_pinned"] + results["failed_to_re_pin"]}
+    return [modem for modem in drifted_modems if modem["mac"] not in attempted_macs]
+
+
+class BeamDriftPipeline:
+    """
+    Moves each drifted modem through Step #4 - Step #15 independently.
+    """
+
+    def __init__(self, jumpbox, beam_drift_db):
+        """
+        Initialize an instance of this class.
+
+        :param jumpbox: an instance of the class used to connect to the MoDOT jumpbox
+        :param beam_drift_db: an instance of the BeamDriftDb class
+        """
+        self.jumpbox = jumpbox
+        self.beam_drift_db = beam_drift_db
+        self.fast_run = beam_drift_utils.is_fast_run()
+        self.force_lkg_updates = beam_drift_utils.should_force_lkg_updates()
+        self.batch_size = beam_drift_utils.get_mtool_batch_size()
+        self.max_in_flight = cmt_utils.get_max_requests_in_flight()
+        self.bulk_online_check = beam_drift_utils.is_bulk_online_check_enabled()
+        self.wait_secs = {
+            WAIT_ONLINE_AFTER_CLEAR: beam_drift_utils.get_wait_secs_for_online_after_clear(),
+            WAIT_ONLINE_AFTER_CWMP_RESTART: (
+                beam_drift_utils.get_wait_secs_for_online_after_cwmp_restart()
+            ),
+            WAIT_ONLINE_AFTER_REBOOT: beam_drift_utils.get_wait_secs_for_online_after_lkg_push(),
+        }
+        self.offline_result_names = {
+            WAIT_ONLINE_AFTER_CLEAR: "offline_after_clear",
+            WAIT_ONLINE_AFTER_CWMP_RESTART: "offline_after_cwmp_restart",
+            WAIT_ONLINE_AFTER_REBOOT: "offline_after_reboot",
+        }
+        self.results = {name: [] for name in RESULT_NAMES}
+        self.trackers = {}
+        self.found_lkg_beams = set()
+        self.failed_lkg_beams = set()
+
+    def run(self, cleared_modems):
+        """
+        Run Step #4 - Step #15 on modems whose beam pinnings we cleared in Step #2.
+
+        :param cleared_modems: a list of dictionaries that represent modems
+                               that have drifted from their intended beams
+        :return: a dictionary mapping each name in RESULT_NAMES to a list of
+                 dictionaries representing the modems with that outcome
+        """
+        start_time = time()
+        for modem in cleared_modems:
+            self.trackers[modem["mac"]] = {"modem": modem, "state": DONE}
+            self.move(modem, WAIT_ONLINE_AFTER_CLEAR)
+        self.jumpbox.clear_any_previous_results(prefix="sat_", suffix=".conf")
+
+        next_online_check = start_time
+        while self.in_progress():
+
+            # Check on the modems waiting to come online at a steady cadence.
+            if time() >= next_online_check:
+                next_online_check = time() + beam_drift_utils.ONLINE_CHECK_INTERVAL_SECS
+                self.check_waiting_modems()
+                self.print_progress(start_time)
+
+            # Run the highest priority step that has modems ready for it, or sleep until
+            # either it's time to check on waiting modems again or another modem is ready.
+            if not self.run_next_action():
+                ready_times = [
+                    tracker["ready_at"]
+                    for tracker in self.trackers.values()
+                    if tracker["state"] in ACTION_STATES
+                ]
+                sleep(max(0, min(ready_times + [next_online_check]) - time()))
+
+        print(f" \nfinished Step #4 - Step #15 in {int(time() - start_time)} seconds")
+        return self.results
+
+    def move(self, modem, state, delay=0, next_state=DONE):
+        """
+        Move a modem into a new state.
+
+        :param modem: a dictionary that represents a modem
+        :param state: the state to move the modem into
+        :param delay: a number representing how many seconds from now the modem will be ready
+                      for this state
+        :param next_state: the state to move the modem into after this one
+                           (only used by states that don't determine it themselves)
+        """
+        tracker = self.trackers[modem["mac"]]
+        tracker["state"] = state
+        tracker["ready_at"] = time() + delay
+        tracker["next state"] = next_state
+        if state in WAIT_STATES:
+            tracker["deadline"] = tracker["ready_at"] + self.wait_secs[state]
+
+    def finish(self, modem, result_name=None):
+        """
+        Record a modem's outcome and stop processing it.
+
+        :param modem: a dictionary that represents a modem
+        :param result_name: the name of the result list to add the modem to, if any
+        """
+        if result_name:
+            self.results[result_name].append(modem)
+        self.move(modem, DONE)
+
+    def in_progress(self):
+        """
+        Determine whether any modems still have steps left to go through.
+
+        :return: True if any modems aren't done, False otherwise
+        """
+        return any(tracker["state"] is not DONE for tracker in self.trackers.values())
+
+    def ready_modems(self, state, limit=None):
+        """
+        Get the modems in a given state that are ready to be processed.
+
+        :param state: the state whose modems we want
+        :param limit: a number representing the max quantity of modems to return, or None
+        :return: a list of dictionaries representing modems
+        """
+        now = time()
+        ready = [
+            tracker["modem"]
+            for tracker in sorted(self.trackers.values(), key=lambda tracker: tracker["ready_at"])
+            if tracker["state"] == state and tracker["ready_at"] <= now
+        ]
+        return ready[:limit] if limit else ready
+
+    def check_waiting_modems(self):
+        """
+        Step #4, Step #6, and Step #13 - Move any modems that have come online to their next
+        step and give up on any that haven't come online in time.
+        """
+        waiting = [modem for state in WAIT_STATES for modem in self.ready_modems(state)]
+        if not waiting:
+            return
+
+        # Modems that will have run out of time by the next check get pinged if the beam
+        # listings don't show them, in case they came online on some other beam.
+        last_check_by = time() + beam_drift_utils.ONLINE_CHECK_INTERVAL_SECS
+        online_macs = beam_drift_utils.get_online_macs(
+            waiting,
+            set(),
+            self.max_in_flight,
+            self.bulk_online_check,
+            last_chance_macs={
+                modem["mac"]
+                for modem in waiting
+                if self.trackers[modem["mac"]]["deadline"] <= last_check_by
+            },
+        )
+        stabilize_secs = beam_drift_utils.WAIT_FOR_NEWLY_ONLINE_MODEM_TO_STABILIZE_SECS
+        now = time()
+        for modem in waiting:
+            tracker = self.trackers[modem["mac"]]
+            state = tracker["state"]
+            if modem["mac"] in online_macs:
+                print(f" \n{modem['mac']} came online ({STATE_DESCRIPTIONS[state]})")
+                if state == WAIT_ONLINE_AFTER_CLEAR:
+                    self.move(modem, RESTART_CWMP, delay=stabilize_secs)
+                elif state == WAIT_ONLINE_AFTER_CWMP_RESTART:
+                    self.move(modem, CHECK_BEAM_AFTER_CWMP_RESTART, delay=stabilize_secs)
+                else:
+                    self.results["online_after_reboot"].append(modem)
+                    self.move(modem, RE_PIN, next_state=CHECK_BEAM_AFTER_REBOOT)
+                    tracker["stable at"] = now + stabilize_secs
+            elif now >= tracker["deadline"]:
+                print(f" \n{modem['mac']} did not come online ({STATE_DESCRIPTIONS[state]})")
+                self.results[self.offline_result_names[state]].append(modem)
+                if state == WAIT_ONLINE_AFTER_REBOOT:
+                    self.move(modem, RE_PIN)
+                else:
+                    self.finish(modem)
+
+    def run_next_action(self):
+        """
+        Run the highest priority step that has modems ready for it on a batch of those modems.
+
+        :return: True if a step was run, False if no modems were ready for any step
+        """
+        handlers = {
+            RESTART_CWMP: self.restart_cwmp,
+            CHECK_BEAM_AFTER_CWMP_RESTART: self.check_beam_after_cwmp_restart,
+            CHECK_GOAL_BEAM_IN_LKG: self.check_goal_beam_in_lkg,
+            GET_GOOD_LKG: self.get_good_lkg,
+            BACK_UP_LKG: self.back_up_lkg,
+            PUSH_LKG: self.push_lkg,
+            REBOOT: self.reboot,
+            RE_PIN: self.re_pin,
+            CHECK_BEAM_AFTER_REBOOT: self.check_beam_after_reboot,
+        }
+        for state in ACTION_STATES:
+            modems = self.ready_modems(state, limit=self.batch_size)
+            if modems:
+                print(
+                    f" \n[Step #{state}] {STATE_DESCRIPTIONS[state]}"
+                    f" on {beam_drift_utils.list_macs(modems)}"
+                )
+                handlers[state](modems)
+                return True
+        return False
+
+    def restart_cwmp(self, modems):
+        """
+        Step #5 - Restart CWMP on a batch of modems.
+
+        :param modems: a list of dictionaries that represent modems
+        """
+        succeeded_macs, _ = beam_drift_utils.restart_cwmp_on_macs(
+            self.jumpbox, [modem["mac"] for modem in modems]
+        )
+        for modem in modems:
+            if modem["mac"] in succeeded_macs:
+                self.move(
+                    modem,
+                    WAIT_ONLINE_AFTER_CWMP_RESTART,
+                    delay=beam_drift_utils.WAIT_AFTER_CWMP_RESTART_SECS,
+                )
+            else:
+                self.finish(modem, "failed_to_restart_cwmp")
+
+    def check_beam_after_cwmp_restart(self, modems):
+        """
+        Step #7 - Check whether a batch of modems is on the correct beam after a CWMP restart.
+
+        :param modems: a list of dictionaries that represent modems
+        """
+        (
+            on_goal_beam,
+            on_wrong_beam_opp_pol,
+            on_wrong_beam_same_pol,
+            failed_to_check,
+        ) = beam_drift_utils.check_beams_match_on_modem(
+            self.jumpbox, self.beam_drift_db, modems, flag_pol_swap_issue_on_failure=False
+        )
+        for modem in on_goal_beam:
+            self.results["on_goal_beam_after_cwmp_restart"].append(modem)
+            if self.fast_run:
+                self.move(modem, RE_PIN)
+            else:
+                self.finish(modem)
+        for modem in on_wrong_beam_opp_pol + on_wrong_beam_same_pol:
+            if self.fast_run:
+                self.finish(modem)
+            else:
+                self.move(modem, CHECK_GOAL_BEAM_IN_LKG)
+        for modem in failed_to_check:
+            self.finish(modem, "failed_to_check_beam_after_cwmp_restart")
+
+    def check_goal_beam_in_lkg(self, modems):
+        """
+        Step #8 - Check whether the goal beam is missing from a batch of modems' LKG files.
+
+        :param modems: a list of dictionaries that represent modems
+        """
+        (
+            goal_beam_not_in_lkg,
+            goal_beam_in_lkg_same_pol,
+            goal_beam_in_lkg_opp_pol,
+            unknown_if_goal_in_lkg,
+        ) = beam_drift_utils.check_if_goal_beam_in_lkg(self.jumpbox, self.beam_drift_db, modems)
+        for result_name, in_lkg in [
+            ("goal_beam_in_lkg_same_pol", goal_beam_in_lkg_same_pol),
+            ("goal_beam_in_lkg_opp_pol", goal_beam_in_lkg_opp_pol),
+        ]:
+            for modem in in_lkg:
+                self.results[result_name].append(modem)
+                if self.force_lkg_updates:
+                    self.move(modem, GET_GOOD_LKG)
+                else:
+                    self.finish(modem)
+        for modem in goal_beam_not_in_lkg + unknown_if_goal_in_lkg:
+            self.move(modem, GET_GOOD_LKG)
+
+    def get_good_lkg(self, modems):
+        """
+        Step #9 - Obtain good LKG files for a batch of modems' goal beams, reusing any
+        LKG files we've already obtained for those beams earlier in this run.
+
+        :param modems: a list of dictionaries that represent modems
+        """
+        need_lkg = [
+            modem
+            for modem in modems
+            if (modem["goal sat"], modem["goal beam"])
+            not in self.found_lkg_beams | self.failed_lkg_beams
+        ]
+        if need_lkg:
+            found, _ = beam_drift_utils.get_good_lkg_files(
+                self.jumpbox, need_lkg, clear_previous_results=False
+            )
+            found_beams = {(modem["goal sat"], modem["goal beam"]) for modem in found}
+            self.found_lkg_beams |= found_beams
+            self.failed_lkg_beams |= {
+                (modem["goal sat"], modem["goal beam"]) for modem in need_lkg
+            } - found_beams
+        for modem in modems:
+            if (modem["goal sat"], modem["goal beam"]) in self.found_lkg_beams:
+                self.move(modem, BACK_UP_LKG)
+            else:
+                self.finish(modem, "no_lkg_found")
+
+    def back_up_lkg(self, modems):
+        """
+        Step #10 - Back up a batch of modems' existing LKG files.
+
+        :param modems: a list of dictionaries that represent modems
+        """
+        succeeded, failed = beam_drift_utils.back_up_lkg_files(self.jumpbox, modems)
+        for modem in succeeded:
+            self.move(modem, PUSH_LKG)
+        for modem in failed:
+            self.finish(modem, "failed_to_back_up_lkg")
+
+    def push_lkg(self, modems):
+        """
+        Step #11 - Push good LKG files onto a batch of modems.
+
+        :param modems: a list of dictionaries that represent modems
+        """
+        succeeded, error_pushing_lkg = beam_drift_utils.push_good_lkg_files(self.jumpbox, modems)
+        for modem in succeeded:
+            self.results["pushed_lkg_files"].append(modem)
+            self.move(modem, REBOOT)
+        for modem in error_pushing_lkg:
+            self.finish(modem, "error_pushing_lkg")
+
+    def reboot(self, modems):
+        """
+        Step #12 - Reboot a batch of modems that now have good LKG files on them.
+
+        :param modems: a list of dictionaries that represent modems
+        """
+        beam_drift_utils.reboot_modems(self.jumpbox, modems, wait_after_reboot=False)
+        for modem in modems:
+            self.move(
+                modem, WAIT_ONLINE_AFTER_REBOOT, delay=beam_drift_utils.WAIT_AFTER_REBOOT_SECS
+            )
+
+    def re_pin(self, modems):
+        """
+        Step #14 - Restore a batch of modems' goal beam pinnings in ACS.
+
+        :param modems: a list of dictionaries that represent modems
+        """
+        repinned, failed = beam_drift_utils.re_pin_beams(modems)
+        self.results["re_pinned"] += repinned
+        self.results["failed_to_re_pin"] += failed
+        for modem in modems:
+            tracker = self.trackers[modem["mac"]]
+            self.move(
+                modem,
+                tracker["next state"],
+                delay=max(0, tracker.get("stable at", 0) - time()),
+            )
+
+    def check_beam_after_reboot(self, modems):
+        """
+        Step #15 - Check whether a batch of modems came back online on the correct beam.
+
+        :param modems: a list of dictionaries that represent modems
+        """
+        (
+            on_goal_beam,
+            on_wrong_beam_opp_pol,
+            on_wrong_beam_same_pol,
+            failed_to_check_beam,
+        ) = beam_drift_utils.check_beams_match_on_modem(
+            self.jumpbox, self.beam_drift_db, modems, flag_pol_swap_issue_on_failure=True
+        )
+        for result_name, result in [
+            ("on_goal_beam", on_goal_beam),
+            ("on_wrong_beam_opp_pol", on_wrong_beam_opp_pol),
+            ("on_wrong_beam_same_pol", on_wrong_beam_same_pol),
+            ("failed_to_check_beam", failed_to_check_beam),
+        ]:
+            for modem in result:
+                self.finish(modem, result_name)
+
+    def print_progress(self, start_time):
+        """
+        Print how many modems are in each state.
+
+        :param start_time: a number representing the epoch time at which the pipeline started
+        """
+        counts = {}
+        for tracker in self.trackers.values():
+            if tracker["state"] is not DONE:
+                counts[tracker["state"]] = counts.get(tracker["state"], 0) + 1
+        done = len(self.trackers) - sum(counts.values())
+        print(
+            f" \n{int(time() - start_time)} seconds elapsed with {done}/{len(self.trackers)}"
+            " modems done"
+            + "".join(
+                f"\n\t{count} {STATE_DESCRIPTIONS[state]}"
+                for state, count in sorted(counts.items())
+            )
+        )
@@ -11,6 +11,13 @@ from time import sleep, time
 from random import shuffle
 import urllib3
 from libs import common_utils, mtool_utils, cmt_utils
+from libs.mtool_executor import (
+    FAILED,
+    SUCCEEDED,
+    MtoolFleetExecutor,
+    expected_output_classifier,
+    macs_with_outcome,
+)
 from libs.acs_db import AcsDb
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
@@ -29,39 +36,67 @@ ONLINE_CHECK_INTERVAL_SECS = 15
 # how many seconds to wait after a modem comes online to try to interact with it
 WAIT_FOR_NEWLY_ONLINE_MODEM_TO_STABILIZE_SECS = 20
 
+# how many seconds to give CWMP a chance to fix modems after we restart it
+WAIT_AFTER_CWMP_RESTART_SECS = 180
+
+# how many seconds to give modems a chance to begin rebooting after we reboot them
+WAIT_AFTER_REBOOT_SECS = 30
+
 # mtool struggles when we give it too many modems at once
 MTOOL_BATCH_SIZE_DEFAULT = 35
 
 
 def get_modems_on_wrong_beam(
-    beam_drift_db, modems
+    beam_drift_db, modems, max_in_flight=None
 ):  # pylint: disable=too-many-locals,too-many-branches,too-many-statements
     """
     Step #1 - Check whether input modems are on the wrong beam and create dictionaries for each
               modem we're working on to keep track of its current beam and goal beam.
 
     :param beam_drift_db: an instance of the BeamDriftDb class
+    :param modems: a list of tuples (mac, goal sat, goal beam, goal pol) as returned by
+                   get_list_of_drifted_modems()
+    :param max_in_flight: a number representing the maximum quantity of modems to look up in
+                          CM-T at once; if None, the job parameter or default is used
     :return: a list of dictionaries representing the modems that are already on their goal beams,
              a list of dictionaries representing the modems that have drifted from their goal
              beams, and a list of dictionaries representing the modems whose beam pinnings we were
              unable to check in ACS
     """
 
-    # We need to confirm whether each modem is has drifted from its goal beam.
+    # We need to confirm whether each modem is has drifted from its goal beam. The CM-T lookups
+    # are made concurrently up front, then the responses are examined in the input order.
     print(" \nlooking up each modem's current and goal beam via CM-T")
+    responses = cmt_utils.get_enrichment_data_and_cpe_configs(
+        [modem[0] for modem in modems], max_in_flight=max_in_flight
+    )
     mismatched = []
     matched = []
     ambitionless = []
     goal_on_different_satellite = []
     failed_to_check = []
-    for modem in modems:
+
+    # Look up the saved goals of all the modems whose beam pinnings we cleared in previous runs
+    # of the job at once, since we'll need them to determine those modems' goals below.
+    saved_goals = beam_drift_db.look_up_goals(
+        [
+            modem[0]
+            for modem, (_, config_response) in zip(modems, responses)
+            if not (modem[1] and modem[2] and modem[3])
+            and config_response is not None
+            and config_response.status_code == 200
+            and cmt_utils.parse_goal_beam_from_cpe_config(config_response) == 0
+        ],
+        verbose=common_utils.is_job_verbose(),
+    )
+
+    for modem, (enrichment_response, config_response) in zip(modems, responses):
         mac = modem[0]
         goal_sat = modem[1]  # will be None if job parameter didn't provide an override
         goal_beam = modem[2]  # will be None if job parameter didn't provide an override
         goal_pol = modem[3]  # will be None if job parameter didn't provide an override
 
         # Get information about each modem's current satellite and beam.
-        enrichment_response = cmt_utils.get_enrichment_data(mac)
         orig_sat = cmt_utils.parse_orig_sat_from_enrichment_data(enrichment_response)
         orig_beam = cmt_utils.parse_orig_beam_from_enrichment_data(enrichment_response)
         orig_pol = cmt_utils.parse_orig_pol_from_enrichment_data(enrichment_response)
@@ -72,6 +107,7 @@ def get_modems_on_wrong_beam(
                     "mac": mac,
                     "orig sat": "?",
                     "orig beam": "?",
+                    "orig pol": "?",
                     "goal sat": goal_sat or "?",
                     "goal beam": goal_beam or "?",
                     "goal pol": goal_pol or "?",
@@ -89,7 +125,6 @@ def get_modems_on_wrong_beam(
 
         # Determine each what satellite and beam each modem is
         # pinned to in the ACS by looking at its CPE config.
-        config_response = cmt_utils.get_cpe_config(mac)
         if config_response.status_code != 200:
             failed_to_check.append(
                 {
@@ -126,7 +161,7 @@ def get_modems_on_wrong_beam(
             # previous run of the job. We attempt to look up its former goal in our local
             # goal database, where we save goal data before we clear it.
             if beam_pin == 0:
-                saved_goal = beam_drift_db.look_up_goal(mac, verbose=common_utils.is_job_verbose())
+                saved_goal = saved_goals.get(mac, {})
                 if saved_goal and "goal_sat" in saved_goal and "goal_beam" in saved_goal:
                     goal_sat = saved_goal["goal_sat"]
                     goal_beam = saved_goal["goal_beam"]
@@ -245,17 +280,18 @@ def clear_beam_pinnings(beam_drift_db, drifted_modems):
     cleared = []
     already_cleared = []
     failed = []
-    for modem in drifted_modems:
 
-        # Before clearing the beam pinnings, record the original goal sat and beam for
-        # future reference, since this information will be removed from the ACS database.
-        beam_drift_db.update_goal(
-            modem["mac"],
-            modem["goal sat"],
-            modem["goal beam"],
-            modem["goal pol"],
-            verbose=common_utils.is_job_verbose(),
-        )
+    # Before clearing the beam pinnings, record the original goal sat and beam for
+    # future reference, since this information will be removed from the ACS database.
+    beam_drift_db.update_goals(
+        [
+            (modem["mac"], modem["goal sat"], modem["goal beam"], modem["goal pol"])
+            for modem in drifted_modems
+        ],
+        verbose=common_utils.is_job_verbose(),
+    )
+
+    for modem in drifted_modems:
 
         # Attempt to clear the pinnings if they aren't already.
         if modem["beam pin"] or modem["goal pol"] != "NOT_SET":
@@ -329,43 +365,53 @@ def wait_till_modems_are_online(drifted_modems, max_wait_secs):
     """
 
     # Until we've checked, assume all modems might be offline.
-    online_modems = []
-    offline_modems = drifted_modems
+    macs = list({modem["mac"]: None for modem in drifted_modems})
+    online_macs = set()
+    max_in_flight = cmt_utils.get_max_requests_in_flight()
+    bulk_online_check = is_bulk_online_check_enabled()
 
     # Wait until there are no more offline modems or until we've hit our time limit.
-    start_time = int(time())
-    current_time = start_time
-    end_time = current_time + max_wait_secs
-    while current_time < end_time and offline_modems:
-        sleep(ONLINE_CHECK_INTERVAL_SECS)
-        current_time = int(time())
+    start_time = time()
+    end_time = start_time + max_wait_secs
+    round_start_time = start_time
+    while time() < end_time and len(online_macs) < len(macs):
+
+        # Keep a steady cadence by only sleeping for whatever's left of the interval.
+        sleep(max(0, ONLINE_CHECK_INTERVAL_SECS - (time() - round_start_time)))
+        round_start_time = time()
         print(
-            f" \n{current_time - start_time}/{max_wait_secs} seconds elapsed with"
-            f" {len(online_modems)}/{len(drifted_modems)} modems online"
+            f" \n{int(round_start_time - start_time)}/{max_wait_secs} seconds elapsed with"
+            f" {len(online_macs)}/{len(macs)} modems online"
         )
 
-        # Check if any new modems have come online between sleep intervals.
-        just_came_online = []
-        for modem in offline_modems:
-            if cmt_utils.ping_modem(modem["mac"]):
-                just_came_online.append(modem)
+        # Check which modems are online, including ones that were online in previous rounds.
+        # On the last round, make sure of any modem the beam listings don't show as online.
+        last_round = round_start_time + ONLINE_CHECK_INTERVAL_SECS >= end_time
+        now_online_macs = get_online_macs(
+            drifted_modems,
+            online_macs,
+            max_in_flight,
+            bulk_online_check,
+            last_chance_macs=set(macs) if last_round else set(),
+        )
+        just_came_online = [mac for mac in macs if mac in now_online_macs - online_macs]
         if just_came_online:
-            print(f" \n{list_macs(just_came_online)} came online")
-
-        # Check if any previously online modems have fallen offline between sleep intervals.
-        fell_back_offline = []
-        for modem in online_modems:
-            if not cmt_utils.ping_modem(modem["mac"]):
-                fell_back_offline.append(modem)
+            print(f" \n{common_utils.readable_list(just_came_online)} came online")
+        fell_back_offline = [mac for mac in macs if mac in online_macs - now_online_macs]
         if fell_back_offline:
-            print(f" \n{list_macs(fell_back_offline)} fell back offline")
+            print(f" \n{common_utils.readable_list(fell_back_offline)} fell back offline")
+        online_macs = now_online_macs
+
+        round_latency = time() - round_start_time
+        print(f" \nchecked {len(macs)} modems in {round_latency:.1f} seconds")
+        if round_latency > ONLINE_CHECK_INTERVAL_SECS:
+            print(
+                f"WARNING: checking took longer than the {ONLINE_CHECK_INTERVAL_SECS} second"
+                f" check interval; consider increasing max_cmt_requests_in_flight"
+            )
 
-        # Update the lists of modems that are currently online and offline.
-        for modem in just_came_online:
-            online_modems.append(modem)
-        for modem in fell_back_offline:
-            online_modems.remove(modem)
-        offline_modems = [modem for modem in drifted_modems if modem not in online_modems]
+    online_modems = [modem for modem in drifted_modems if modem["mac"] in online_macs]
+    offline_modems = [modem for modem in drifted_modems if modem["mac"] not in online_macs]
 
     # Print and return the results.
     if offline_modems:
@@ -379,6 +425,93 @@ def wait_till_modems_are_online(drifted_modems, max_wait_secs):
     return online_modems, offline_modems
 
 
+def get_online_macs(
+    drifted_modems, online_macs, max_in_flight, bulk_online_check, last_chance_macs=frozenset()
+):
+    """
+    Check which modems are online right now.
+
+    :param drifted_modems: a list of dictionaries that represent modems
+                          that have drifted from their intended beams
+    :param online_macs: a set of strings representing the MAC
+                        addresses of modems that were online last time we checked
+    :param max_in_flight: a number representing the maximum quantity of CM-T requests at once
+    :param bulk_online_check: True to use CM-T's per-beam listings of online
+                              modems, False to ping every modem individually
+    :param last_chance_macs: a set of strings representing the MAC addresses of modems that
+                             we'll give up on if they aren't online now, which get pinged if
+                             the beam listings don't show them as online
+    :return: a set of strings representing the MAC addresses of the modems that are online
+    """
+    if bulk_online_check:
+        return check_which_modems_are_online(
+            drifted_modems, online_macs | set(last_chance_macs), max_in_flight
+        )
+    macs = list({modem["mac"]: None for modem in drifted_modems})
+    return {
+        mac
+        for mac, is_online in zip(macs, cmt_utils.ping_modems(macs, max_in_flight))
+        if is_online
+    }
+
+
+def check_which_modems_are_online(drifted_modems, online_macs, max_in_flight):
+    """
+    Check which modems are online by asking CM-T for the online modems on each beam the modems
+    could be on, only pinging individual modems when the beam listings can't settle it.
+
+    This is a helper function to wait_till_modems_are_online().
+
+    :param drifted_modems: a list of dictionaries that represent modems
+                          that have drifted from their intended beams
+    :param online_macs: a set of strings representing the MAC addresses of modems to ping if
+                        they aren't listed online, e.g. because they were online last time we
+                        checked or because this is our last chance to find them online (a
+                        modem can come online on a beam other than its original or goal beam)
+    :param max_in_flight: a number representing the maximum quantity of CM-T requests at once
+    :return: a set of strings representing the MAC addresses of the modems that are online
+    """
+
+    # A modem could be on either its original beam or its goal beam.
+    beams_by_mac = {}
+    for modem in drifted_modems:
+        beams_by_mac.setdefault(modem["mac"], set()).update(
+            (modem[f"{which} sat"], modem[f"{which} beam"])
+            for which in ("orig", "goal")
+            if common_utils.is_valid_number(modem[f"{which} sat"])
+            and common_utils.is_valid_number(modem[f"{which} beam"])
+        )
+    beams = list(set().union(*beams_by_mac.values()))
+    listings = common_utils.run_concurrently(
+        lambda sat_beam: cmt_utils.get_online_macs_on_beam(*sat_beam), beams, max_in_flight
+    )
+    complete_beams = {beam for beam, listing in zip(beams, listings) if listing is not None}
+    listed_online_macs = set().union(*(listing for listing in listings if listing is not None))
+
+    # Ping any modem that isn't listed online and either might be on a beam we couldn't get a
+    # complete listing for or is in online_macs (e.g. it may have landed on some other beam).
+    online = set()
+    ambiguous_macs = []
+    for mac, mac_beams in beams_by_mac.items():
+        if mac.replace(":", "").upper() in listed_online_macs:
+            online.add(mac)
+        elif mac in online_macs or not mac_beams or not mac_beams <= complete_beams:
+            ambiguous_macs.append(mac)
+    if ambiguous_macs:
+        print(
+            f" \n{len(beams)} beam listings found {len(online)} modems online;"
+            f" pinging {len(ambiguous_macs)} more to be sure"
+        )
+        online.update(
+            mac
+            for mac, is_online in zip(
+                ambiguous_macs, cmt_utils.ping_modems(ambiguous_macs, max_in_flight)
+            )
+            if is_online
+        )
+    return online
+
+
 def restart_cwmp(jumpbox, drifted_modems):
     """
     Step #5 - Restart CWMP on drifted modems.
@@ -395,7 +528,7 @@ def restart_cwmp(jumpbox, drifted_modems):
     failed = [modem for modem in drifted_modems if modem["mac"] in failed_macs]
     if succeeded:
         print(" \nwaiting 3 minutes to give CWMP a chance to fix modems")
-        sleep(180)
+        sleep(WAIT_AFTER_CWMP_RESTART_SECS)
     return succeeded, failed
 
 
@@ -415,23 +548,15 @@ def restart_cwmp_on_macs(jumpbox, macs):
 
     # Use mtool to restart CWMP on these modems.
     if macs:
-        mac_list_file_name = "ut_macs_restart_cwmp"
-        batches = common_utils.batches(macs, get_mtool_batch_size())
-        for batch in batches:
-            mtool_utils.create_mac_list_file(jumpbox, mac_list_file_name, batch)
-            output, _ = mtool_utils.run_mtool_command(
-                jumpbox,
-                f"-a run_commands -m {mac_list_file_name}"
-                " -C 'killall vstat; cwmpclient_setup RESTART'",
-            )
-
-            # Examine the output of the mtool command to see which modems we succeeded on.
-            for mac in batch:
-                (
-                    succeeded
-                    if mtool_utils.check_if_cmd_no_output_succeeded(output, mac)
-                    else failed
-                ).append(mac)
+        outcomes = MtoolFleetExecutor(
+            jumpbox,
+            "restart_cwmp",
+            "-a run_commands -C 'killall vstat; cwmpclient_setup RESTART'",
+            batch_size=get_mtool_batch_sizer("restart_cwmp"),
+            verbose=True,
+        ).run(macs)
+        succeeded = macs_with_outcome(outcomes, SUCCEEDED)
+        failed = macs_with_outcome(outcomes, FAILED)
 
     # Print and return the results.
     if failed:
@@ -464,6 +589,7 @@ def check_if_goal_beam_in_lkg(
     goal_beam_in_lkg_same_pol = []
     goal_beam_in_lkg_opp_pol = []
     failed_to_check = []
+    unhelpable = []
 
     # Get the subset of modems that are trying to move to each goal beam. We'll run mtool
     # on batches of all the modems with the same goal beam since they'll share an LKG file.
@@ -476,30 +602,32 @@ def check_if_goal_beam_in_lkg(
         ]
 
         # Use mtool to grep for these modems' goal beam in their LKG file.
-        mac_list_file_name = f"ut_macs_sat_{sat}_beam_{beam}"
-        mtool_utils.create_mac_list_file(
-            jumpbox, mac_list_file_name, [modem["mac"] for modem in modems]
-        )
-        output, _ = mtool_utils.run_mtool_command(
+        outcomes = MtoolFleetExecutor(
             jumpbox,
-            f"-a run_commands -m {mac_list_file_name} -C "
+            f"sat_{sat}_beam_{beam}",
+            "-a run_commands -C "
             f"\"egrep 'Neighbor_Beam_Id = {beam}|Beam_Id  = {beam}' {LKG_FILE_PATH_ON_MODEM}\"",
-        )
+            lambda records, beam=beam: (
+                SUCCEEDED if is_goal_beam_in_records(records, beam) else None
+            ),
+            batch_size=get_mtool_batch_sizer("check_lkg"),
+            retries=0,
+            verbose=True,
+        ).run([modem["mac"] for modem in modems])
 
         # Examine the output of the mtool command to see which modems have their goal
         # beam info in their LKG file already.
         for modem in modems:
-            if is_goal_beam_in_mtool_output(output, modem["mac"], beam):
+            if outcomes[modem["mac"]] == SUCCEEDED:
                 opp_pol = str(modem["orig beam"])[1] != str(beam)[1]
                 if opp_pol:
                     goal_beam_in_lkg_opp_pol.append(modem)
                 else:
                     goal_beam_in_lkg_same_pol.append(modem)
-                beam_drift_db.flag_unhelpable_modem(
-                    modem["mac"], modem["goal sat"], opp_pol, verbose=common_utils.is_job_verbose()
-                )
+                unhelpable.append((modem["mac"], modem["goal sat"], opp_pol))
             else:
                 goal_beam_not_in_lkg.append(modem)
+    beam_drift_db.flag_unhelpable_modems(unhelpable, verbose=common_utils.is_job_verbose())
 
     # Print and return the results.
     if goal_beam_not_in_lkg:
@@ -525,7 +653,9 @@ def check_if_goal_beam_in_lkg(
     )
 
 
-def get_good_lkg_files(jumpbox, drifted_modems):  # pylint: disable=too-many-locals
+def get_good_lkg_files(
+    jumpbox, drifted_modems, clear_previous_results=True
+):  # pylint: disable=too-many-locals
     """
     Step #9 - For each beam to which any modem in this batch is trying to move,
               obtain an LKG file from a modem currently online on that beam.
@@ -533,10 +663,14 @@ def get_good_lkg_files(jumpbox, drifted_modems):  # pylint: disable=too-many-loc
     :param jumpbox: an instance of the class used to connect to the MoDOT jumpbox
     :param drifted_modems: a list of dictionaries that represent modems
                           that have drifted from their intended beams
+    :param clear_previous_results: True to delete any LKG files left on the jumpbox by previous
+                                   calls first, False to keep them (e.g. because they haven't
+                                   been pushed to their modems yet)
     """
 
     # Clear any previous results
-    jumpbox.clear_any_previous_results(prefix="sat_", suffix=".conf")
+    if clear_previous_results:
+        jumpbox.clear_any_previous_results(prefix="sat_", suffix=".conf")
 
     # Get the set of beams for which we need to find modems with good LKG files.
     desired_beams = {(modem["goal sat"], modem["goal beam"]) for modem in drifted_modems}
@@ -618,25 +752,17 @@ def back_up_lkg_files(jumpbox, drifted_modems):
 
     # Use mtool to back up the LKG files on these modems.
     if drifted_modems:
-        mac_list_file_name = "ut_macs_back_up_lkg"
-        batches = common_utils.batches(drifted_modems, get_mtool_batch_size())
-        for batch in batches:
-            mtool_utils.create_mac_list_file(
-                jumpbox, mac_list_file_name, [modem["mac"] for modem in batch]
-            )
-            output, _ = mtool_utils.run_mtool_command(
-                jumpbox,
-                f"-a run_commands -m {mac_list_file_name}"
-                f" -C 'cp {LKG_FILE_PATH_ON_MODEM} {LKG_FILE_PATH_ON_MODEM}.bk'",
-            )
+        outcomes = MtoolFleetExecutor(
+            jumpbox,
+            "back_up_lkg",
+            f"-a run_commands -C 'cp {LKG_FILE_PATH_ON_MODEM} {LKG_FILE_PATH_ON_MODEM}.bk'",
+            batch_size=get_mtool_batch_sizer("back_up_lkg"),
+            verbose=True,
+        ).run([modem["mac"] for modem in drifted_modems])
 
-            # Examine the output of the mtool command to see which modems we succeeded on.
-            for modem in batch:
-                (
-                    succeeded
-                    if mtool_utils.check_if_cmd_no_output_succeeded(output, modem["mac"])
-                    else failed
-                ).append(modem)
+        # Examine the outcomes to see which modems we succeeded on.
+        for modem in drifted_modems:
+            (succeeded if outcomes[modem["mac"]] == SUCCEEDED else failed).append(modem)
 
     # Print and return the results.
     if succeeded:
@@ -684,10 +810,12 @@ def push_good_lkg_files(jumpbox, drifted_modems):
         )
 
         # Examine the output of the mtool command to see which modems received the file.
+        output_lines = set(output)
         for modem in modems:
             (
                 succeeded
-                if f"Put file succeeded to {mtool_utils.format_mac_addr(modem['mac'])}." in output
+                if f"Put file succeeded to {mtool_utils.format_mac_addr(modem['mac'])}."
+                in output_lines
                 else error_pushing_lkg
             ).append(modem)
 
@@ -699,7 +827,7 @@ def push_good_lkg_files(jumpbox, drifted_modems):
     return succeeded, error_pushing_lkg
 
 
-def reboot_modems(jumpbox, drifted_modems):
+def reboot_modems(jumpbox, drifted_modems, wait_after_reboot=True):
     """
     Step #12 - Reboot modems. Now that the modems have good LKG files on them,
               they'll hopefully come back on the correct beam after we reboot them.
@@ -707,35 +835,31 @@ def reboot_modems(jumpbox, drifted_modems):
     :param jumpbox: an instance of the class used to connect to the MoDOT jumpbox
     :param drifted_modems: a list of dictionaries that represent modems
                           that have drifted from their intended beams
+    :param wait_after_reboot: True to sleep to give the modems a chance to begin rebooting
+                              before returning, False if the caller will handle waiting
     """
     succeeded = []
     failed = []
 
     # Use mtool to reboot the modems.
     if drifted_modems:
-        mac_list_file_name = "ut_macs_reboot"
-        batches = common_utils.batches(drifted_modems, get_mtool_batch_size())
-        for batch in batches:
-            mtool_utils.create_mac_list_file(
-                jumpbox, mac_list_file_name, [modem["mac"] for modem in batch]
-            )
-            output, _ = mtool_utils.run_mtool_command(
-                jumpbox, f"-a run_commands -m {mac_list_file_name} -C reboot"
-            )
-
-            # Examine the output of the mtool command to
-            # see which modems were rebooted successfully.
-            for modem in batch:
-                (
-                    succeeded
-                    if mtool_utils.check_if_cmd_had_expected_output(
-                        output, modem["mac"], "called at"
-                    )
-                    else failed
-                ).append(modem)
+        outcomes = MtoolFleetExecutor(
+            jumpbox,
+            "reboot",
+            "-a run_commands -C reboot",
+            expected_output_classifier([("called at", SUCCEEDED)]),
+            batch_size=get_mtool_batch_sizer("reboot"),
+            retries=0,
+            verbose=True,
+        ).run([modem["mac"] for modem in drifted_modems])
+
+        # Examine the outcomes to see which modems were rebooted successfully.
+        for modem in drifted_modems:
+            (succeeded if outcomes[modem["mac"]] == SUCCEEDED else failed).append(modem)
 
         # Sleep to give modems a chance to begin rebooting.
-        sleep(30)
+        if wait_after_reboot:
+            sleep(WAIT_AFTER_REBOOT_SECS)
 
     # Print the results.
     if succeeded:
@@ -796,47 +920,45 @@ def check_beams_match_on_modem(  # pylint: disable=too-many-branches,too-many-lo
     on_wrong_beam_opp_pol = []
     on_wrong_beam_same_pol = []
     failed_to_check_beam = []
+    unhelpable = []
 
     # Use mtool to check the modems' beam IDs.
-    if drifted_modems:  # pylint: disable=too-many-nested-blocks
-        mac_list_file_name = "ut_macs_check_mismatch"
-        batches = common_utils.batches(drifted_modems, get_mtool_batch_size())
-        for batch in batches:
-            mtool_utils.create_mac_list_file(
-                jumpbox, mac_list_file_name, [modem["mac"] for modem in batch]
-            )
-            output, _ = mtool_utils.run_mtool_command(
-                jumpbox, f"-a run_commands -m {mac_list_file_name} -C 'utstat -L | grep beamId'"
-            )
+    if drifted_modems:
+        beams = MtoolFleetExecutor(
+            jumpbox,
+            "check_mismatch",
+            "-a run_commands -C 'utstat -L | grep beamId'",
+            get_beam_from_records,
+            batch_size=get_mtool_batch_sizer("check_mismatch"),
+            retries=1,
+            unresolved_outcome=None,
+            verbose=True,
+        ).run([modem["mac"] for modem in drifted_modems])
+
+        # Examine the output of the mtool command to see whether each modem came up on its goal
+        # beam. If it didn't, compare the polarizations of the actual and goal beams to provide
+        # evidence as to whether this modem is likely to have a broken polarity switch.
+        for modem in drifted_modems:
+            beam = beams[modem["mac"]]
+            if not beam:
+                failed_to_check_beam.append(modem)
+            elif beam == modem["goal beam"]:
+                on_goal_beam.append(modem)
+            else:
+                try:
+                    goal_pol = str(modem["goal beam"])[1]
+                    actual_pol = str(beam)[1]
+                    opp_pol = actual_pol != goal_pol
+
+                    if opp_pol:
+                        on_wrong_beam_opp_pol.append(modem)
+                    else:
+                        on_wrong_beam_same_pol.append(modem)
+                    unhelpable.append((modem["mac"], modem["goal sat"], opp_pol))
 
-            # Examine the output of the mtool command to see whether each modem came up on its goal
-            # beam. If it didn't, compare the polarizations of the actual and goal beams to provide
-            # evidence as to whether this modem is likely to have a broken polarity switch.
-            for modem in batch:
-                beam = get_beam_from_mtool_output(output, modem["mac"])
-                if not beam:
+                except IndexError:
                     failed_to_check_beam.append(modem)
-                elif beam == modem["goal beam"]:
-                    on_goal_beam.append(modem)
-                else:
-                    try:
-                        goal_pol = str(modem["goal beam"])[1]
-                        actual_pol = str(beam)[1]
-                        opp_pol = actual_pol != goal_pol
-
-                        if opp_pol:
-                            on_wrong_beam_opp_pol.append(modem)
-                        else:
-                            on_wrong_beam_same_pol.append(modem)
-                        beam_drift_db.flag_unhelpable_modem(
-                            modem["mac"],
-                            modem["goal sat"],
-                            opp_pol,
-                            verbose=common_utils.is_job_verbose(),
-                        )
-
-                    except IndexError:
-                        failed_to_check_beam.append(modem)
+        beam_drift_db.flag_unhelpable_modems(unhelpable, verbose=common_utils.is_job_verbose())
 
     # Print and return the results.
     if on_goal_beam:
@@ -1157,22 +1279,26 @@ def get_beam_from_mtool_output(output, mac):
 
     This is a helper function to check_beams_match_on_modem (Step #7 & Step #15).
 
-    :param output: a string representing the output of running the utstat -L
-                   command on a list of modems via mtool
+    :param output: a list of strings representing the output of running the utstat -L command
+                   on a list of modems via mtool, or that output already parsed by
+                   mtool_utils.parse_mtool_output()
     :param mac: a string representing the MAC address of one of those modems
     :return: a number representing the modem's beam ID,
              or None if it couldn't be determined
     """
-    for i in range(len(output) - 3):
-        if (
-            mtool_utils.format_mac_addr(mac) in output[i]
-            and "swVersion:" in output[i + 1]
-            and "beamId:" in output[i + 3]
-        ):
-            try:
-                return int(output[i + 3].split()[1])
-            except (IndexError, ValueError):
-                return None
+    return get_beam_from_records(mtool_utils.get_mtool_records(output, mac))
+
+
+def get_beam_from_records(records):
+    """
+    Obtain a modem's beam ID from the records mtool printed for it after running utstat -L.
+
+    :param records: a list of dictionaries as described in mtool_utils.iter_mtool_records()
+    :return: a number representing the modem's beam ID, or None if it couldn't be determined
+    """
+    for record in records:
+        if record["lines"] and "beamId:" in record["lines"][0]:
+            return record["beam id"]
     return None
 
 
@@ -1183,22 +1309,30 @@ def is_goal_beam_in_mtool_output(output, mac, beam):
 
     This is a helper function to check_beams_match_on_modem (Step #7 & Step #15).
 
-    :param output: a string representing the output of searching
-                   for the beam in the modem's LKG file
+    :param output: a list of strings representing the output of searching for the beam in
+                   the modems' LKG files, or that output already parsed by
+                   mtool_utils.parse_mtool_output()
     :param mac: a string representing the MAC address of one of those modems
     :param beam: a number representing the beam ID that we're looking
                  for in the LKG file for the modem in question
     :return: True if the modem has its goal beam in its LKG file, False otherwise
     """
-    for i in range(len(output) - 3):
-        if (
-            mtool_utils.format_mac_addr(mac) in output[i]
-            and "swVersion:" in output[i + 1]
-            and "Beam_Id" in output[i + 3]
-            and str(beam) in output[i + 3]
-        ):
-            return True
-    return False
+    return is_goal_beam_in_records(mtool_utils.get_mtool_records(output, mac), beam)
+
+
+def is_goal_beam_in_records(records, beam):
+    """
+    Check whether the records mtool printed for a modem after searching its Last Known Good
+    file show that its goal beam is in that file.
+
+    :param records: a list of dictionaries as described in mtool_utils.iter_mtool_records()
+    :param beam: a number representing the beam ID that we're looking for in the LKG file
+    :return: True if the modem has its goal beam in its LKG file, False otherwise
+    """
+    return any(
+        record["lines"] and "Beam_Id" in record["lines"][0] and str(beam) in record["lines"][0]
+        for record in records
+    )
 
 
 def should_preserve_beam_pinnings():
@@ -1244,14 +1378,26 @@ def should_force_lkg_updates():
     return common_utils.check_expected_env_bool("force_lkg_updates")
 
 
+def is_streaming_run():
+    """
+    Determine based on an optional checkbox parameter to the job whether to move each modem
+    through Step #4 - Step #15 independently (see beam_drift_pipeline.py) rather than
+    waiting for every modem to finish each step before starting the next one.
+
+    :return: True to use the streaming pipeline, False to run the steps one at a time
+    """
+    return os.getenv("streaming_pipeline", "false").lower() == "true"
+
+
 def get_mtool_batch_size():
     """
     Determine how many modems to give mtool at once, because
     sometimes it struggles when we give it too many at a time.
 
-    :return: a number representing the max quantity of modems to pass to mtool
-             commands at once during this run of the job. This is specified
-             by a parameter to the job. If unspecified, a default is used.
+    :return: a number representing the max quantity of modems to pass to mtool commands at once
+             during this run of the job (or to start out with, if the batch size is adaptive; see
+             get_mtool_batch_sizer()). This is specified by a parameter to the job. If unspecified,
+             a default is used.
     """
     if "mtool_batch_size" in os.environ:
         try:
@@ -1262,6 +1408,27 @@ def get_mtool_batch_size():
     return MTOOL_BATCH_SIZE_DEFAULT
 
 
+def get_mtool_batch_sizer(name):
+    """
+    Get the batch sizer for a particular kind of mtool command run by this job.
+
+    :param name: a string identifying the kind of mtool command (e.g. "reboot")
+    :return: an instance of the MtoolBatchSizer class from mtool_utils that starts
+             out at the batch size from get_mtool_batch_size()
+    """
+    return mtool_utils.get_mtool_batch_sizer(name, get_mtool_batch_size())
+
+
+def is_bulk_online_check_enabled():
+    """
+    Determine whether to check which modems are online using CM-T's per-beam listings
+    of online modems rather than by pinging each modem individually.
+
+    :return: True unless the optional job parameter to disable it is set to false
+    """
+    return os.getenv("bulk_online_check", "true").lower() != "false"
+
+
 def print_step(step, description):
     """
     This is a formatting helper function for indicating
@@ -4,10 +4,9 @@ Contains generic functionality for making CM-T API calls from Jenkins.
 
 import os
 import requests
-from libs import common_utils, vault_utils
+from libs import common_utils, http_utils, jwt_utils, vault_utils
 
 MAX_RESULTS_FROM_CMT = 10000
-JWT_DIR_PATH = os.path.expanduser("~/etc")
 JWT_FILE_PATH = os.path.expanduser("~/etc/cmtjwt")
 ENV_TO_CMT_API_URL = {
     "dev": "https://api01-fat.dev.naw01.cmt.viasat.io",
@@ -17,6 +16,9 @@ ENV_TO_CMT_API_URL = {
 
 ONE_MINUTE = 60  # seconds
 
+# how many CM-T requests we're willing to have in flight at once when looking up many modems
+MAX_REQUESTS_IN_FLIGHT_DEFAULT = 10
+
 
 def get_cmt_api_url():
     """
@@ -28,53 +30,41 @@ def get_cmt_api_url():
     return ENV_TO_CMT_API_URL[common_utils.get_expected_env_var("environment")]
 
 
-def get_cmt_token():
+def get_cmt_jwt_manager():
     """
-    Checks if the current token is valid and gets a new one if it's missing or invalid.
+    Get the manager of the JWT token we use as credentials for the CM-T API in this environment.
 
-    :return: a string representing a JWT token to use as credentials for the CM-T API
+    :return: an instance of the JwtManager class from jwt_utils
     """
+    env = os.environ["environment"]
+    env = "preprod" if (env == "dev") else env
+    return jwt_utils.get_jwt_manager(
+        ("cmt", env), f"{JWT_FILE_PATH}_{env}", lambda: get_new_cmt_token(env)
+    )
 
-    # Check whether we already have the JWT token saved in a file. If we don't, obtain a new one.
-    try:
-        with open(os.path.expanduser(JWT_FILE_PATH), "r") as jwt_file:
-            jwt = f"Bearer {jwt_file.read()}"
-    except IOError:
-        jwt = get_new_cmt_token()
 
-    # Check whether the JWT token we have is valid. If it's not, obtain a new one.
-    try:
-        response = requests.get(
-            get_cmt_api_url() + "/whoami", headers={"Authorization": jwt}, verify=False
-        )
-        if response.status_code != 200:
-            raise ValueError
-    except ValueError:
-        jwt = get_new_cmt_token()
-
-    # Ensure that the JWT file directory and file have the correct permissions.
-    try:
-        if oct(os.stat(JWT_DIR_PATH).st_mode) != "0o40700":
-            os.chmod(JWT_DIR_PATH, 0o700)
-        if oct(os.stat(JWT_FILE_PATH).st_mode) != "0o100700":
-            os.chmod(os.path.expanduser(JWT_FILE_PATH), 0o700)
-    except Exception as ex:
-        print(f"JWT file permissions not set. Exception: {ex}")
+def get_cmt_token():
+    """
+    Get a JWT token for the CM-T API, reusing the cached one unless it's about to expire.
 
-    return jwt
+    :return: a string representing a JWT token to use as credentials for the CM-T API
+    """
+    token = get_cmt_jwt_manager().get_token()
+    return f"Bearer {token}" if token else None
 
 
-def get_new_cmt_token():
+def get_new_cmt_token(env=None):
     """
     Request a new token for the CM-T API.
 
+    :param env: "preprod" or "prod"
     :return: a string representing a JWT token to use as credentials for the CM-T API.
     """
-    env = os.environ["environment"]
+    env = env or os.environ["environment"]
     env = "preprod" if (env == "dev") else env
 
     # Request the JWT token.
-    response = requests.get(
+    response = http_utils.get(
         "https://jwt.us-or.viasat.io/v1/token?stripe=cmt&token_type=user",
         auth=(
             f"ut-devops-{env}_cmt_api_user",
@@ -85,22 +75,22 @@ def get_new_cmt_token():
     if not response or response.status_code != 200:
         print(f"Unable to get token! Status Code: {response.status_code}")
         return None
+    return response.text
 
-    # Store the JWT token in a file so that we don't have to request it every time.
-    token = response.text
-    local_etc_path = os.path.expanduser(JWT_DIR_PATH)
-    if not os.path.exists(local_etc_path):
-        os.mkdir(local_etc_path)
-        print(f"Required dir ({local_etc_path}) created for storing JWT file.")
-    try:
-        with open(os.path.expanduser(JWT_FILE_PATH), "w") as jwt_file:
-            jwt_file.write(token)
-    except IOError as ex:
-        print(
-            f"Cannot access {JWT_FILE_PATH} directory due to {ex}."
-            f" You will have to authenticate each time you run the script."
-        )
-    return f"Bearer {token}"
+
+def cmt_request(method, url, **kwargs):
+    """
+    Make a request to the CM-T API, requesting a new token
+    and retrying once if the API rejects the one we have.
+
+    Takes the same keyword arguments as http_utils.request().
+
+    :param method: a string representing the HTTP method (e.g. "GET")
+    :param url: a string representing the URL to make the request to
+    :return: an instance of the Response class from the requests
+             library representing the response to this HTTP request
+    """
+    return get_cmt_jwt_manager().request(method, url, verify=False, **kwargs)
 
 
 def get_modems(
@@ -152,11 +142,10 @@ def get_modems(
         params["sw_version"] = sw_version
 
     url = f"{get_cmt_api_url()}/modems"
-    response = requests.get(
+    response = cmt_request(
+        "GET",
         url,
         params=params,
-        headers={"Authorization": get_cmt_token()},
-        verify=False,
         timeout=timeout,
     )
     if response.status_code != 200:
@@ -168,6 +157,32 @@ def get_modems(
     return list(modems)
 
 
+def get_online_macs_on_beam(sat_id, beam, timeout=ONE_MINUTE):
+    """
+    Get the MAC addresses of all the modems CM-T considers online on a given beam.
+
+    Unlike get_modems(), this distinguishes a failed request from a beam with no online modems.
+
+    :param sat_id: a number representing the satellite ID
+    :param beam: a number representing the beam ID
+    :param timeout: a number representing the timeout for the CM-T API call
+    :return: a set of strings representing the normalized (upper case, no colons) MAC addresses
+             of the online modems on that beam, or None if the request failed or if the beam
+             has so many online modems that CM-T may have left some out of the response
+    """
+    url = f"{get_cmt_api_url()}/modems"
+    params = {"satellite_id": sat_id, "beam_id": beam, "online": "true"}
+    response = cmt_request("GET", url, params=params, timeout=timeout)
+    if response.status_code != 200:
+        print(f"failed to get modems (url {url}, params {params}, response {response.text}")
+        return None
+    try:
+        macs = {str(mac).replace(":", "").upper() for mac in response.json() or []}
+    except (TypeError, ValueError):
+        return None
+    return macs if len(macs) < MAX_RESULTS_FROM_CMT else None
+
+
 def print_modem_list_retrieval_info(sat_id, beam, vno, sw_version, limit, online):
     """
     Print information to the user about which modems we're about to retrieve from the CM-T API.
@@ -214,11 +229,10 @@ def pin_beam(mac, beam, pol):
 
     :return: True on success, False otherwise
     """
-    response = requests.put(
+    response = cmt_request(
+        "PUT",
         f"{get_cmt_api_url()}/cpe_management/cpe/{mac}",
         json={"Modem": {"PrimaryBeamID": beam, "PrimaryBeamPolarization": pol}},
-        headers={"Authorization": get_cmt_token()},
-        verify=False,
         timeout=ONE_MINUTE,
     )
     if response.status_code != 200 or common_utils.is_job_verbose():
@@ -237,11 +251,10 @@ def pin_beam_without_pol(mac, beam):
     :param beam: a number representing the beam to which we want to pin the modem in ACS
     :return: True on success, False otherwise
     """
-    response = requests.put(
+    response = cmt_request(
+        "PUT",
         f"{get_cmt_api_url()}/cpe_management/cpe/{mac}",
         json={"Modem": {"PrimaryBeamID": beam}},
-        headers={"Authorization": get_cmt_token()},
-        verify=False,
         timeout=ONE_MINUTE,
     )
     if response.status_code != 200 or common_utils.is_job_verbose():
@@ -254,21 +267,39 @@ def ping_modem(mac):
     Pings a modem to check if it's online.
 
     param mac: a string representing a modem's MAC address
-    :return: True if the modem could be reached, False otherwise
+    :return: True if the modem could be reached, False otherwise (including
+             if the request to CM-T failed or we couldn't get a token for it)
     """
     try:
         return (
-            requests.get(
+            cmt_request(
+                "GET",
                 f"{get_cmt_api_url()}/modems/{mac}/ping",
                 params={"count": 2, "interval": 1, "timeout": 3},
-                headers={"Authorization": get_cmt_token()},
-                verify=False,
                 timeout=10,
             ).status_code
             == 200
         )
     except requests.exceptions.ReadTimeout:
         return False
+    except (requests.exceptions.RequestException, RuntimeError) as ex:
+        print(f" \nERROR: failed to ping {mac}: {ex}")
+        return False
+
+
+def ping_modems(macs, max_in_flight=None):
+    """
+    Ping many modems at once to check which ones are online.
+
+    :param macs: a list of strings representing modems' MAC addresses
+    :param max_in_flight: a number representing the maximum quantity of modems to ping at
+                          once; if None, the value is determined by get_max_requests_in_flight()
+    :return: a list of booleans, one per input MAC address and in the same order,
+             that are True if the modem could be reached and False otherwise
+    """
+    return common_utils.run_concurrently(
+        ping_modem, macs, max_in_flight or get_max_requests_in_flight()
+    )
 
 
 def get_enrichment_data(mac):
@@ -279,10 +310,9 @@ def get_enrichment_data(mac):
     :return: an instance of the Response class from the requests
              library representing the response to this HTTP request
     """
-    return requests.get(
+    return cmt_request(
+        "GET",
         f"{get_cmt_api_url()}/modems/{mac}/enrichment",
-        headers={"Authorization": get_cmt_token()},
-        verify=False,
         timeout=ONE_MINUTE,
     )
 
@@ -295,15 +325,63 @@ def get_cpe_config(mac):
     :return: an instance of the Response class from the requests
              library representing the response to this HTTP request
     """
-    return requests.get(
+    return cmt_request(
+        "GET",
         f"{get_cmt_api_url()}/cpe_management/cpe/{mac}",
         params={"filter": "acs", "type": "modem"},
-        headers={"Authorization": get_cmt_token()},
-        verify=False,
         timeout=ONE_MINUTE,
     )
 
 
+def get_enrichment_data_and_cpe_configs(macs, max_in_flight=None):
+    """
+    Get the CM-T enrichment data and CPE config for many modems at once
+    by looking up a bounded number of modems concurrently.
+
+    The CPE config is only requested for modems whose enrichment data
+    was retrieved successfully and contains their current satellite and beam.
+
+    :param macs: a list of strings representing modems' MAC addresses
+    :param max_in_flight: a number representing the maximum quantity of modems to look up at
+                          once; if None, the value is determined by get_max_requests_in_flight()
+    :return: a list of tuples, one per input MAC address and in the same order, each containing
+             the response to the enrichment data request and the response to the CPE config
+             request (or None if the CPE config wasn't requested)
+    """
+
+    def look_up_modem(mac):
+        enrichment_response = get_enrichment_data(mac)
+        if (
+            enrichment_response.status_code != 200
+            or not parse_orig_beam_from_enrichment_data(enrichment_response)
+            or not parse_orig_sat_from_enrichment_data(enrichment_response)
+        ):
+            return enrichment_response, None
+        return enrichment_response, get_cpe_config(mac)
+
+    return common_utils.run_concurrently(
+        look_up_modem, macs, max_in_flight or get_max_requests_in_flight()
+    )
+
+
+def get_max_requests_in_flight():
+    """
+    Determine how many CM-T requests to have in flight at once when looking up many modems.
+
+    :return: a number representing the max quantity of concurrent CM-T requests during this run
+             of the job. This is specified by an optional parameter to the job. If unspecified,
+             a default is used.
+    """
+    if "max_cmt_requests_in_flight" in os.environ:
+        try:
+            max_in_flight = int(common_utils.get_expected_env_var("max_cmt_requests_in_flight"))
+            if max_in_flight > 0:
+                return max_in_flight
+        except (ValueError, TypeError) as ex:
+            print(ex)
+    return MAX_REQUESTS_IN_FLIGHT_DEFAULT
+
+
 def parse_goal_sat_id_from_cpe_config(response):
     """
     Parse the satellite ID from a response to a GET request
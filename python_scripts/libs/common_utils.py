@@ -3,6 +3,7 @@ Contains generic helper functions that could be useful in a broad variety of con
 """
 
 import os
+from concurrent.futures import ThreadPoolExecutor
 from math import floor, ceil
 from datetime import datetime
 import json
@@ -185,6 +186,26 @@ def batches(listy, chunk_size):
     return [listy[i : i + chunk_size] for i in range(0, len(listy), chunk_size)]
 
 
+def run_concurrently(func, items, max_workers):
+    """
+    Call a function on every item in a list using a bounded pool of threads.
+
+    Used for I/O bound work such as HTTP requests, where waiting on each call one
+    at a time would dominate the run time of a job.
+
+    :param func: a function that takes a single item from the list as its only argument
+    :param items: a list of inputs to pass to the function
+    :param max_workers: a number representing the maximum quantity of calls
+                        to have in flight at once
+    :return: a list containing the return value of the function for each item,
+             in the same order as the input list
+    """
+    if not items:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(int(max_workers), len(items)))) as executor:
+        return list(executor.map(func, items))
+
+
 def is_valid_number(something):
     """
     Check if something is a number.
@@ -0,0 +1,120 @@
+"""
+Contains generic functionality for making HTTP requests through pooled, keep-alive sessions.
+
+Every request to a given host goes through the same session, so the TCP and TLS handshakes
+happen once per connection in the pool rather than once per request.
+"""
+
+import os
+import threading
+from urllib.parse import urlsplit
+import requests
+from requests.adapters import HTTPAdapter
+from libs import common_utils
+
+# how many connections to keep open to each host (also the most that can be in flight at once)
+POOL_SIZE_DEFAULT = 20
+
+# (connect timeout, read timeout) in seconds used for any request that doesn't specify its own
+CONNECT_TIMEOUT = 10
+DEFAULT_TIMEOUT = (CONNECT_TIMEOUT, 60)
+
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def get_pool_size():
+    """
+    Determine how many connections to keep open to each host.
+
+    :return: a number representing the connection pool size per host during this run of the job.
+             This is specified by an optional parameter to the job. If unspecified,
+             a default is used.
+    """
+    if "http_pool_size" in os.environ:
+        try:
+            pool_size = int(common_utils.get_expected_env_var("http_pool_size"))
+            if pool_size > 0:
+                return pool_size
+        except (ValueError, TypeError) as ex:
+            print(ex)
+    return POOL_SIZE_DEFAULT
+
+
+def get_session(url):
+    """
+    Get the pooled session for the host that a URL points to, creating it on first use.
+
+    :param url: a string representing the URL we want to make a request to
+    :return: an instance of the Session class from the requests library
+    """
+    parts = urlsplit(url)
+    host = f"{parts.scheme}://{parts.netloc}"
+    with _sessions_lock:
+        session = _sessions.get(host)
+        if session is None:
+            pool_size = get_pool_size()
+            adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, pool_block=True)
+            session = requests.Session()
+            session.mount(f"{host}/", adapter)
+            _sessions[host] = session
+    return session
+
+
+def close_sessions():
+    """
+    Close every pooled session along with its open connections.
+    """
+    with _sessions_lock:
+        for session in _sessions.values():
+            session.close()
+        _sessions.clear()
+
+
+def request(method, url, timeout=None, **kwargs):
+    """
+    Make an HTTP request through the pooled session for the URL's host.
+
+    Takes the same keyword arguments as requests.request().
+
+    :param method: a string representing the HTTP method (e.g. "GET")
+    :param url: a string representing the URL to make the request to
+    :param timeout: a number or a (connect, read) tuple representing the timeout in seconds
+                    for this endpoint; if None, DEFAULT_TIMEOUT is used
+    :return: an instance of the Response class from the requests
+             library representing the response to this HTTP request
+    """
+    return get_session(url).request(method, url, timeout=timeout or DEFAULT_TIMEOUT, **kwargs)
+
+
+def get(url, **kwargs):
+    """
+    Make a GET request through the pooled session for the URL's host.
+
+    :param url: a string representing the URL to make the request to
+    :return: an instance of the Response class from the requests
+             library representing the response to this HTTP request
+    """
+    return request("GET", url, **kwargs)
+
+
+def put(url, **kwargs):
+    """
+    Make a PUT request through the pooled session for the URL's host.
+
+    :param url: a string representing the URL to make the request to
+    :return: an instance of the Response class from the requests
+             library representing the response to this HTTP request
+    """
+    return request("PUT", url, **kwargs)
+
+
+def post(url, **kwargs):
+    """
+    Make a POST request through the pooled session for the URL's host.
+
+    :param url: a string representing the URL to make the request to
+    :return: an instance of the Response class from the requests
+             library representing the response to this HTTP request
+    """
+    return request("POST", url, **kwargs)
@@ -4,11 +4,41 @@ Contains the Jumpbox class that enables Jenkins jobs to run commands on the MoDO
 
 import os
 import sys
+import random
+import re
+import select
+import threading
+import uuid
+from time import sleep, time
 import paramiko
-from libs.common_utils import get_expected_env_var
+from libs.common_utils import check_expected_env_bool, get_expected_env_var, run_concurrently
 
 ACTIVATE_MODOT_VENV = "source /var/tmp/modot_venv/bin/activate"
 
+# the user that mtool runs as, which needs access to the files we create for it in our home dir
+MTOOL_USER = "sshproxy"
+
+# how many commands to run on the jumpbox at once by default (each one gets its own ssh channel)
+MAX_PARALLEL_COMMANDS_DEFAULT = 4
+
+# how often to send an ssh keepalive so that a dropped connection is noticed (and idle
+# connections aren't closed by firewalls) without having to run a command to find out
+KEEPALIVE_INTERVAL_SECS = 30
+
+# how many times to try reconnecting after the connection drops, and the most to wait in between
+MAX_RECONNECT_ATTEMPTS = 5
+MAX_RECONNECT_BACKOFF_SECS = 30
+
+# where each run of a job keeps its files on the jumpbox (relative to the home directory), so
+# that jobs running at the same time don't overwrite or clean up each other's files, and how old
+# a run's directory has to be before we assume the job that made it died without cleaning up
+RUNS_DIR = "ut_runs"
+STALE_RUN_DAYS = 2
+
+# how long to wait for more output from a streamed command before checking whether it timed out
+STREAM_POLL_SECS = 1
+STREAM_READ_BYTES = 32768
+
 
 class Jumpbox:
     """
@@ -37,11 +67,16 @@ class Jumpbox:
             print(line)
         for error in errors:
             print(error)
+        for output, errors in jumpbox.run_commands(["ls -la", "cat hello.txt"]):
+            print(output)
+        for line in jumpbox.stream_command("tail -n 1000 big_file.txt", timeout=60):
+            print(line)
+        jumpbox.write_file("macs.txt", "00:A0:BC:11:22:33\n")  # in this run's work_dir
         jumpbox.download_file("hello.txt")
         jumpbox.disconnect()
     """
 
-    def __init__(self, environment=None):
+    def __init__(self, environment=None, hostname=None, exit_on_failure=True, run_id=None):
         """
         Initialize the Jumpbox class by getting the credentials from the
         environment and establishing an ssh connection to the MoDOT jumpbox.
@@ -49,35 +84,120 @@ class Jumpbox:
         :param environment: A string ("preprod" or "prod") representing which
                             environment's jumpbox we should connect to. If omitted,
                             the string will be pulled from an environment variable.
+        :param hostname: a string representing the specific jumpbox to connect to. If omitted,
+                         one of the environment's jumpboxes (see get_jumpbox_hosts()) is chosen
+                         at random, falling back to the others if it's unreachable.
+        :param exit_on_failure: True to exit the job if we can't connect (or reconnect), False
+                                to leave the instance disconnected (or raise ConnectionError)
+        :param run_id: a string naming the directory this run works in on the jumpbox, or None
+                       to make a new one (see make_run_id())
         """
         self.client = paramiko.SSHClient()
         self.client.set_missing_host_key_policy(paramiko.AutoAddPolicy())
         environment = environment or get_expected_env_var("environment")
         self.environment = "preprod" if environment == "dev" else environment
-        self.hostname = f"jumpbox.ut-devops-{self.environment}.viasat.io"
+        self.hostnames = [hostname] if hostname else get_jumpbox_hosts(self.environment)
+        random.shuffle(self.hostnames)
+        self.hostname = self.hostnames[0]
+        self.exit_on_failure = exit_on_failure
         self.username = get_expected_env_var(f"username_{self.environment}")
         self.password = get_expected_env_var(f"password_{self.environment}")
-        self.connect()
+        self.reconnect_count = 0
+        self.run_id = run_id or make_run_id()
+        self.work_dir = f"{RUNS_DIR}/{self.run_id}"
+        self.setup_command = f"{ACTIVATE_MODOT_VENV}; cd ~/{self.work_dir}"
+        self.use_persistent_shell = is_persistent_shell_enabled()
+        self.shell = None
+        self.shell_lock = threading.Lock()
+        self.granted_mtool_access = False
+        self.sftp = None
+        self.sftp_lock = threading.RLock()
+        self.reconnect_lock = threading.Lock()
+        self.connect(exit_on_failure=exit_on_failure)
 
-    def connect(self):
+    def connect(self, exit_on_failure=True, failover=True):
         """
         Connect to the MoDOT jumpbox.
+
+        :param exit_on_failure: True to exit the job if we can't connect, False to return False
+        :param failover: True to try the environment's other jumpboxes if we can't connect to
+                         the current one, False to only try the current one (e.g. because files
+                         we need are on it)
+        :return: True if we connected successfully, False otherwise
         """
-        try:
-            self.client.connect(
-                hostname=self.hostname, username=self.username, password=self.password
-            )
-            print(f" \nconnected to {self.hostname}")
-        except Exception as ex:
-            print(f" \nERROR: can't connect to {self.hostname}:\n\t{ex}")
+        hostnames = [self.hostname]
+        if failover:
+            hostnames += [hostname for hostname in self.hostnames if hostname != self.hostname]
+        for hostname in hostnames:
+            try:
+                self.client.connect(
+                    hostname=hostname, username=self.username, password=self.password
+                )
+                self.client.get_transport().set_keepalive(KEEPALIVE_INTERVAL_SECS)
+                self.hostname = hostname
+                self.create_work_dir()
+                print(f" \nconnected to {self.hostname} (working in ~/{self.work_dir})")
+                return True
+            except Exception as ex:
+                print(f" \nERROR: can't connect to {hostname}:\n\t{ex}")
+                self.client.close()
+        if exit_on_failure:
             self.disconnect()
             sys.exit(1)
+        return False
 
     def disconnect(self):
         """
-        End the ssh connection to the MoDOT jumpbox.
+        End the ssh connection to the MoDOT jumpbox, removing this run's files from it first.
         """
+        self.close_shell()
+        self.close_sftp()
+        if self.is_connected():
+            try:
+                _, stdout, _ = self.client.exec_command(f"rm -rf ~/{self.work_dir}")
+                stdout.channel.recv_exit_status()
+            except Exception as ex:
+                print(f" \nERROR: failed to remove ~/{self.work_dir} on {self.hostname}:\n\t{ex}")
         self.client.close()
+        if self.reconnect_count:
+            print(
+                f" \nreconnected to {self.hostname} {self.reconnect_count} time(s) during this job"
+            )
+
+    def create_work_dir(self):
+        """
+        Create the directory on the MoDOT jumpbox that this run's commands run in and its files
+        are kept in, and remove any left behind by runs that didn't get to clean up after
+        themselves. It's safe to call this again after reconnecting.
+        """
+        _, stdout, _ = self.client.exec_command(
+            f"mkdir -p ~/{self.work_dir}; find ~/{RUNS_DIR} -mindepth 1 -maxdepth 1 -type d"
+            f" -mtime +{STALE_RUN_DAYS} -exec rm -rf {{}} + > /dev/null 2>&1"
+        )
+        stdout.channel.recv_exit_status()
+
+    def is_connected(self):
+        """
+        Check whether the ssh connection to the MoDOT jumpbox is still up, going by the state
+        of the underlying transport rather than by running a command.
+
+        :return: True if the connection is active, False otherwise
+        """
+        transport = self.client.get_transport()
+        return transport is not None and transport.is_active()
+
+    def get_load(self):
+        """
+        Check how busy the MoDOT jumpbox is.
+
+        :return: a number representing the jumpbox's one minute load average per CPU,
+                 or infinity if it couldn't be determined
+        """
+        try:
+            output, _ = self.execute("cut -d ' ' -f 1 /proc/loadavg; nproc")
+            return float(output[0]) / max(1, int(output[1]))
+        except Exception:
+            return float("inf")
 
     def run_command(self, command, prompt_answers=None, verbose=False):
         """
@@ -92,9 +212,121 @@ class Jumpbox:
                  and the second containing the command's errors. Either list may be empty.
         """
         self.reconnect_if_necessary()
+        if self.use_persistent_shell:
+            output, errors, _ = self.run_in_shell(command, prompt_answers)
+        else:
+            output, errors = self.execute(command, prompt_answers)
+        if verbose:
+            print_command_results(command, output, errors)
+        return output, errors
+
+    def run_in_shell(self, command, prompt_answers=None):
+        """
+        Run a command in the long-lived shell on the MoDOT jumpbox (opening it if necessary),
+        so that the MoDOT venv only has to be activated once per job.
 
+        :param command: a string representing a command to run on the MoDOT jumpbox.
+        :param prompt_answers: a list of strings representing answers to expected
+                               prompts for user input after running the command
+        :return: a list of strings containing the lines of the output of the command, a list of
+                 strings containing the command's errors, and a number representing the command's
+                 exit status (or None if the shell died while running it)
+        """
+        with self.shell_lock:
+            if not self.shell or not self.shell.is_open():
+                self.shell = PersistentShell(self.client, self.setup_command)
+            output, errors, exit_status = self.shell.run(command, prompt_answers)
+            if exit_status is None:
+                self.close_shell()
+            return output, errors, exit_status
+
+    def close_shell(self):
+        """
+        Close the long-lived shell on the MoDOT jumpbox, if one is open.
+        """
+        if self.shell:
+            self.shell.close()
+            self.shell = None
+
+    def grant_mtool_access(self):
+        """
+        Give the user that mtool runs as access to our home directory on the MoDOT jumpbox.
+
+        This only needs to happen once per job because the default ACL we set on the
+        directories is inherited by any files that are created in them later.
+        """
+        if not self.granted_mtool_access:
+            self.run_command(
+                f"setfacl -R -m u:{MTOOL_USER}:rwx ~/ > /dev/null 2>&1;"
+                f" setfacl -R -d -m u:{MTOOL_USER}:rwx ~/ > /dev/null 2>&1"
+            )
+            self.granted_mtool_access = True
+
+    def run_commands(self, commands, prompt_answers=None, verbose=False, max_in_flight=None):
+        """
+        Run several independent commands on the MoDOT jumpbox at the same time, each over its own
+        channel of the existing ssh connection.
+
+        :param commands: a list of strings representing commands to run on the MoDOT jumpbox
+        :param prompt_answers: a list of strings representing answers to expected
+                               prompts for user input after running each command
+        :param verbose: True to print details about the command output and errors to the console,
+                        False to run the commands silently
+        :param max_in_flight: a number representing the max quantity of commands to run at once,
+                              or None to use get_max_parallel_commands()
+        :return: a list containing a tuple (output, errors) for each command, in the same order as
+                 the input list, where output and errors are as returned by run_command()
+        """
+        results = self.run_in_parallel(
+            lambda jumpbox, command: jumpbox.execute(command, prompt_answers),
+            commands,
+            max_in_flight,
+        )
+        if verbose:
+            for command, (output, errors) in zip(commands, results):
+                print_command_results(command, output, errors)
+        return results
+
+    def run_in_parallel(self, func, items, max_in_flight=None):
+        """
+        Call a function that does some work on the MoDOT jumpbox on every item in a list,
+        several at a time. JumpboxPool provides the same method to spread the work across
+        jumpboxes, so callers that use it work with either class.
+
+        :param func: a function that takes an instance of this class and a single item from
+                     the list as its arguments and is safe to call from several threads at once
+        :param items: a list of inputs to pass to the function
+        :param max_in_flight: a number representing the max quantity of calls to have in flight
+                              at once, or None to use get_max_parallel_commands()
+        :return: a list containing the return value of the function for each item,
+                 in the same order as the input list
+        """
+        self.reconnect_if_necessary()
+        return run_concurrently(
+            lambda item: func(self, item), items, max_in_flight or get_max_parallel_commands()
+        )
+
+    def max_in_flight(self):
+        """
+        Determine how many commands run_in_parallel() runs at once by default.
+
+        :return: a number representing the max quantity of commands to run at once
+        """
+        return get_max_parallel_commands()
+
+    def execute(self, command, prompt_answers=None):
+        """
+        Run a command on the MoDOT jumpbox over a new channel without checking the connection
+        first. Safe to call from several threads at once.
+
+        :param command: a string representing a command to run on the MoDOT jumpbox.
+        :param prompt_answers: a list of strings representing answers to expected
+                               prompts for user input after running the command
+        :return: Two lists of strings: the first containing the lines of the output of the command,
+                 and the second containing the command's errors. Either list may be empty.
+        """
         # Execute the command and pass in answers to any anticipated prompts it generates.
-        stdin, stdout, stderr = self.client.exec_command(f"{ACTIVATE_MODOT_VENV}; {command}")
+        stdin, stdout, stderr = self.client.exec_command(f"{self.setup_command}; {command}")
         if prompt_answers:
             for answer in prompt_answers:
                 stdin.write(f"{answer}\n")
@@ -103,10 +335,112 @@ class Jumpbox:
         # Record the outcome
         output = [line.strip() for line in stdout.readlines()]
         errors = [error.strip() for error in stderr.readlines()]
-        if verbose:
-            print_command_results(command, output, errors)
         return output, errors
 
+    def stream_command(
+        self, command, prompt_answers=None, timeout=None, errors=None
+    ):  # pylint: disable=too-many-locals
+        """
+        Run a command on the MoDOT jumpbox, yielding the lines of its output as they arrive
+        rather than waiting for it to finish and holding all of its output in memory.
+
+        If the command runs for longer than the timeout, it's abandoned (the channel is closed)
+        and a line describing the timeout is added to the errors.
+
+        :param command: a string representing a command to run on the MoDOT jumpbox.
+        :param prompt_answers: a list of strings representing answers to expected
+                               prompts for user input after running the command
+        :param timeout: a number representing the max quantity of seconds to let the command
+                        run for, or None to use get_command_timeout()
+        :param errors: a list to add the lines of the command's errors to as they arrive,
+                       or None to ignore them
+        :return: a generator of strings representing the lines of the output of the command
+        """
+        self.reconnect_if_necessary()
+        timeout = timeout or get_command_timeout()
+        deadline = time() + timeout if timeout else None
+        errors = [] if errors is None else errors
+
+        channel = self.client.get_transport().open_session()
+        channel.exec_command(f"{self.setup_command}; {command}")
+        for answer in prompt_answers or []:
+            channel.sendall(f"{answer}\n")
+
+        output_buffer = b""
+        errors_buffer = b""
+        try:
+            while True:
+                if deadline and time() > deadline:
+                    errors.append(f"timed out after {timeout} seconds")
+                    print(f" \nERROR: {command} timed out after {timeout} seconds")
+                    break
+                if not (channel.recv_ready() or channel.recv_stderr_ready()):
+                    if channel.closed or (channel.exit_status_ready() and channel.eof_received):
+                        break
+                    select.select([channel], [], [], STREAM_POLL_SECS)
+                    continue
+
+                # Yield each complete line of output as soon as we have it.
+                if channel.recv_ready():
+                    output_buffer += channel.recv(STREAM_READ_BYTES)
+                    *lines, output_buffer = output_buffer.split(b"\n")
+                    for line in lines:
+                        yield line.decode(errors="replace").strip()
+                if channel.recv_stderr_ready():
+                    errors_buffer += channel.recv_stderr(STREAM_READ_BYTES)
+                    *lines, errors_buffer = errors_buffer.split(b"\n")
+                    errors += [line.decode(errors="replace").strip() for line in lines]
+
+            # Pass along anything left over that didn't end in a newline.
+            if output_buffer.strip():
+                yield output_buffer.decode(errors="replace").strip()
+            if errors_buffer.strip():
+                errors.append(errors_buffer.decode(errors="replace").strip())
+        finally:
+            channel.close()
+
+    def get_sftp(self):
+        """
+        Get the SFTP session to the MoDOT jumpbox, opening it on first use (or after the
+        connection drops) and reusing it afterward.
+
+        :return: an instance of the SFTPClient class from paramiko
+        """
+        self.reconnect_if_necessary()
+        with self.sftp_lock:
+            if self.sftp is None or self.sftp.get_channel().closed:
+                self.sftp = self.client.open_sftp()
+                self.sftp.chdir(self.work_dir)
+            return self.sftp
+
+    def close_sftp(self):
+        """
+        Close the SFTP session to the MoDOT jumpbox, if one is open.
+        """
+        with self.sftp_lock:
+            if self.sftp:
+                self.sftp.close()
+                self.sftp = None
+
+    def write_file(self, file_name, contents):
+        """
+        Write a file on the MoDOT jumpbox directly over SFTP, which (unlike echoing the
+        contents in a shell command) isn't limited by the maximum length of a command.
+
+        :param file_name: a string representing the path of the file on the MoDOT
+                          jumpbox, relative to this run's work_dir if not absolute
+        :param contents: a string representing what to write to the file
+        :return: True if the file was written successfully, False otherwise
+        """
+        try:
+            with self.sftp_lock, self.get_sftp().open(file_name, "w") as remote_file:
+                remote_file.set_pipelined(True)
+                remote_file.write(contents)
+            return True
+        except Exception as ex:
+            print(f" \nERROR: failed to write {file_name} on the jumpbox:\n\t{ex}")
+            return False
+
     def download_file(self, file_name, local_file_name=None):
         """
         Download a file from the MoDOT jumpbox to the Jenkins
@@ -116,11 +450,10 @@ class Jumpbox:
         :param local_file_name: a string representing what to rename
                                 the file to on the Jenkins server
         """
-        self.reconnect_if_necessary()
         try:
-            ftp_client = self.client.open_sftp()
-            ftp_client.get(file_name, f"{os.environ['WORKSPACE']}/{local_file_name or file_name}")
-            ftp_client.close()
+            self.get_sftp().get(
+                file_name, f"{os.environ['WORKSPACE']}/{local_file_name or file_name}"
+            )
             print(
                 f" \ndownloaded {file_name} from the jumpbox"
                 f"{' as ' + local_file_name if local_file_name else ''}"
@@ -128,6 +461,36 @@ class Jumpbox:
         except Exception as ex:
             print(f" \nERROR: failed to download {file_name} from the jumpbox:\n\t{ex}")
 
+    def download_files(self, file_names):
+        """
+        Download several files from the MoDOT jumpbox to the Jenkins server to be exported as
+        artifacts of the running job, requesting every file's contents up front so that the
+        transfers overlap instead of waiting on one round trip after another.
+
+        :param file_names: a list of strings representing the names of the files on the jumpbox
+        :return: a list of strings representing the names of the files downloaded successfully
+        """
+        sftp = self.get_sftp()
+        remote_files = {}
+        for file_name in file_names:
+            try:
+                remote_files[file_name] = sftp.open(file_name, "rb")
+                remote_files[file_name].prefetch()
+            except Exception as ex:
+                print(f" \nERROR: failed to download {file_name} from the jumpbox:\n\t{ex}")
+
+        downloaded = []
+        for file_name, remote_file in remote_files.items():
+            try:
+                with remote_file, open(f"{os.environ['WORKSPACE']}/{file_name}", "wb") as local:
+                    local.write(remote_file.read())
+                downloaded.append(file_name)
+            except Exception as ex:
+                print(f" \nERROR: failed to download {file_name} from the jumpbox:\n\t{ex}")
+        if downloaded:
+            print(f" \ndownloaded {', '.join(downloaded)} from the jumpbox")
+        return downloaded
+
     def upload_file(self, file_path, file_name):
         """
         Upload a file from the Jenkins server to the MoDOT jumpbox.
@@ -135,36 +498,71 @@ class Jumpbox:
         :param file_path: the path to and name of the file on the Jenkins server
         :param file_name: the name of the file on the Jenkins server
         """
-        self.reconnect_if_necessary()
-        dst_file_path = f"/tmp/{file_name}"
-        try:
-            ftp_client = self.client.open_sftp()
-            ftp_client.put(f"{os.environ['WORKSPACE']}/{file_path}", dst_file_path)
-            ftp_client.close()
-            print(f" \nuploaded {file_name} to the jumpbox")
-            return True
-        except Exception as ex:
-            print(
-                f" \nERROR: failed to upload {file_path} to {dst_file_path} on the jumpbox:"
-                f"\n\t{ex}"
-            )
-            return False
+        return bool(self.upload_files({file_path: file_name}))
 
-    def reconnect_if_necessary(self):
+    def upload_files(self, files):
         """
-        Check whether we're still connected to the
-        jumpbox and attempt to reconnect if we're not.
+        Upload several files from the Jenkins server to this run's work_dir on the MoDOT jumpbox
+        over one SFTP session, with each file's writes pipelined rather than acknowledged one by
+        one. Use remote_upload_path() to refer to them in commands.
+
+        :param files: a dictionary mapping strings representing the paths to and names of
+                      the files on the Jenkins server to the names to give them on the jumpbox
+        :return: a list of strings representing the names of the files uploaded successfully
         """
-        for _ in range(5):
+        sftp = self.get_sftp()
+        uploaded = []
+        for file_path, file_name in files.items():
+            dst_file_path = self.remote_upload_path(file_name)
             try:
-                self.client.exec_command("ls", timeout=5)
+                sftp.put(f"{os.environ['WORKSPACE']}/{file_path}", dst_file_path)
+                print(f" \nuploaded {file_name} to the jumpbox")
+                uploaded.append(file_name)
+            except Exception as ex:
+                print(
+                    f" \nERROR: failed to upload {file_path} to {dst_file_path} on the jumpbox:"
+                    f"\n\t{ex}"
+                )
+        return uploaded
+
+    def remote_upload_path(self, file_name):
+        """
+        Get the full path on the MoDOT jumpbox of a file uploaded by upload_files().
+
+        :param file_name: a string representing the name the file was given on the jumpbox
+        :return: a string representing the absolute path to the file on the jumpbox
+        """
+        return f"{self.get_sftp().getcwd()}/{file_name}"
+
+    def reconnect_if_necessary(self):
+        """
+        Check whether we're still connected to the jumpbox and attempt to reconnect
+        if we're not, backing off a little longer after each failed attempt.
+        """
+        if self.is_connected():
+            return
+        with self.reconnect_lock:
+            if self.is_connected():
                 return
-            except Exception:
-                self.connect()
+            print(f" \nlost connection to {self.hostname}")
+            self.close_shell()
+            self.sftp = None
+            for attempt in range(MAX_RECONNECT_ATTEMPTS):
+                if attempt:
+                    sleep(min(2 ** attempt, MAX_RECONNECT_BACKOFF_SECS))
+                if self.connect(exit_on_failure=False, failover=False):
+                    self.reconnect_count += 1
+                    return
+            print(f" \nERROR: gave up reconnecting to {self.hostname}")
+            if not self.exit_on_failure:
+                raise ConnectionError(f"lost connection to {self.hostname}")
+            self.disconnect()
+            sys.exit(1)
 
     def clear_any_previous_results(self, prefix="", suffix=""):
         """
-        Remove files from previous runs of the job to avoid Jenkins job artifact confusion.
+        Remove files left by earlier steps of this run to avoid Jenkins job artifact confusion.
+        Only this run's work_dir is affected, so other jobs using the jumpbox aren't.
 
         :param prefix: a string representing the prefix of the files
                        on the Jumpbox that we want to remove
@@ -175,6 +573,415 @@ class Jumpbox:
             self.run_command(f"rm -f {prefix}*{suffix}")
 
 
+class JumpboxPool:
+    """
+    Purpose:
+        Spreads work across all of an environment's MoDOT jumpboxes (see get_jumpbox_hosts()),
+        giving each piece of work to whichever jumpbox is least loaded and failing over to the
+        others if one can't be reached before the work starts.
+
+        Provides the parts of the Jumpbox interface needed to run mtool on a list of modems
+        in batches (see mtool_utils.run_mtool_command_in_batches()), so it can be used in place
+        of a Jumpbox by jobs that run on large fleets of modems.
+
+        Every jumpbox works in a directory with the same name, so a file uploaded with
+        upload_file() can be passed to mtool by a single path (see remote_upload_path())
+        whichever jumpbox a batch ends up on.
+
+    Example usage:
+        from jumpbox import JumpboxPool
+        jumpbox_pool = JumpboxPool()
+        run_mtool_command_in_batches(jumpbox_pool, "ut_macs.txt", macs, 35, "-a run_commands ...")
+        jumpbox_pool.disconnect()
+    """
+
+    def __init__(self, environment=None):
+        """
+        Initialize the JumpboxPool class by connecting to every jumpbox in the environment.
+
+        :param environment: A string ("preprod" or "prod") representing which
+                            environment's jumpboxes we should connect to. If omitted,
+                            the string will be pulled from an environment variable.
+        """
+        environment = environment or get_expected_env_var("environment")
+        environment = "preprod" if environment == "dev" else environment
+        self.jumpboxes = []
+        run_id = make_run_id()
+        for hostname in get_jumpbox_hosts(environment):
+            jumpbox = Jumpbox(environment, hostname=hostname, exit_on_failure=False, run_id=run_id)
+            if jumpbox.is_connected():
+                self.jumpboxes.append(jumpbox)
+        if not self.jumpboxes:
+            print(f" \nERROR: can't connect to any {environment} jumpbox")
+            sys.exit(1)
+        self.password = self.jumpboxes[0].password
+        self.loads = {jumpbox.hostname: jumpbox.get_load() for jumpbox in self.jumpboxes}
+        self.in_flight = {jumpbox.hostname: 0 for jumpbox in self.jumpboxes}
+        self.lock = threading.Lock()
+
+    def disconnect(self):
+        """
+        End the ssh connections to all the MoDOT jumpboxes.
+        """
+        for jumpbox in self.jumpboxes:
+            jumpbox.disconnect()
+
+    def acquire(self, exclude=None):
+        """
+        Pick the jumpbox that's running the fewest of our commands (or, if there's a tie, had the
+        lowest load average when run_in_parallel() was last called) and count a new command as
+        running on it.
+
+        :param exclude: a list of instances of the Jumpbox class not to pick
+        :return: an instance of the Jumpbox class, or None if there are none left to pick
+        """
+        with self.lock:
+            candidates = [jumpbox for jumpbox in self.jumpboxes if jumpbox not in (exclude or [])]
+            if not candidates:
+                return None
+            jumpbox = min(
+                candidates,
+                key=lambda jumpbox: (
+                    self.in_flight[jumpbox.hostname],
+                    self.loads[jumpbox.hostname],
+                ),
+            )
+            self.in_flight[jumpbox.hostname] += 1
+            return jumpbox
+
+    def release(self, jumpbox):
+        """
+        Count a command as no longer running on a jumpbox.
+
+        :param jumpbox: an instance of the Jumpbox class returned by acquire()
+        """
+        with self.lock:
+            self.in_flight[jumpbox.hostname] -= 1
+
+    def run_on_least_loaded(self, func, item):
+        """
+        Call a function on the least loaded jumpbox, moving on to the next least loaded jumpbox
+        if it can't be reached. Once the function has been called it isn't retried elsewhere,
+        since it may already have done something to modems (e.g. rebooted them).
+
+        :param func: a function that takes an instance of the Jumpbox class and an item
+        :param item: the input to pass to the function
+        :return: the return value of the function
+        """
+        tried = []
+        while True:
+            jumpbox = self.acquire(exclude=tried)
+            try:
+                try:
+                    jumpbox.reconnect_if_necessary()
+                except ConnectionError as ex:
+                    tried.append(jumpbox)
+                    if len(tried) == len(self.jumpboxes):
+                        raise
+                    print(f" \nERROR: {ex}, trying another jumpbox")
+                    continue
+                return func(jumpbox, item)
+            finally:
+                self.release(jumpbox)
+
+    def run_in_parallel(self, func, items, max_in_flight=None):
+        """
+        Call a function that does some work on a MoDOT jumpbox on every item in a list,
+        several at a time on each jumpbox.
+
+        :param func: a function that takes an instance of the Jumpbox class and a single item
+                     from the list as its arguments and is safe to call from several threads
+        :param items: a list of inputs to pass to the function
+        :param max_in_flight: a number representing the max quantity of calls to have in flight
+                              at once on each jumpbox, or None to use get_max_parallel_commands()
+        :return: a list containing the return value of the function for each item,
+                 in the same order as the input list
+        """
+        for jumpbox in self.jumpboxes:
+            try:
+                jumpbox.reconnect_if_necessary()
+            except ConnectionError:
+                continue  # run_on_least_loaded() will skip it if it's still down
+            load = jumpbox.get_load()
+            with self.lock:
+                self.loads[jumpbox.hostname] = load
+        return run_concurrently(
+            lambda item: self.run_on_least_loaded(func, item),
+            items,
+            (max_in_flight or get_max_parallel_commands()) * len(self.jumpboxes),
+        )
+
+    def max_in_flight(self):
+        """
+        Determine how many commands run_in_parallel() runs at once by default across all jumpboxes.
+
+        :return: a number representing the max quantity of commands to run at once
+        """
+        return get_max_parallel_commands() * len(self.jumpboxes)
+
+    def run_command(self, command, prompt_answers=None, verbose=False):
+        """
+        Run a command on the least loaded MoDOT jumpbox.
+
+        Takes the same arguments and returns the same values as Jumpbox.run_command().
+        """
+        return self.run_on_least_loaded(
+            lambda jumpbox, _: jumpbox.run_command(command, prompt_answers, verbose), None
+        )
+
+    def stream_command(self, command, prompt_answers=None, timeout=None, errors=None):
+        """
+        Run a command on the least loaded MoDOT jumpbox, yielding the lines of its output
+        as they arrive.
+
+        Takes the same arguments and returns the same values as Jumpbox.stream_command().
+        """
+        jumpbox = self.acquire()
+        try:
+            yield from jumpbox.stream_command(command, prompt_answers, timeout, errors)
+        finally:
+            self.release(jumpbox)
+
+    def grant_mtool_access(self):
+        """
+        Give the user that mtool runs as access to our home directory on every MoDOT jumpbox.
+        """
+        for jumpbox in self.jumpboxes:
+            jumpbox.grant_mtool_access()
+
+    def upload_file(self, file_path, file_name):
+        """
+        Upload a file from the Jenkins server to every MoDOT jumpbox.
+
+        :param file_path: the path to and name of the file on the Jenkins server
+        :param file_name: the name of the file on the Jenkins server
+        :return: True if the file was uploaded to every jumpbox, False otherwise
+        """
+        return all([jumpbox.upload_file(file_path, file_name) for jumpbox in self.jumpboxes])
+
+    def remote_upload_path(self, file_name):
+        """
+        Get the full path of a file uploaded by upload_file(), which is the same on every
+        MoDOT jumpbox as long as we log in to the same home directory on each of them.
+
+        :param file_name: a string representing the name the file was given on the jumpboxes
+        :return: a string representing the absolute path to the file on every jumpbox
+        :raises RuntimeError: if the path differs between jumpboxes, since a command built
+                              with it would only find the file on some of them
+        """
+        paths = {
+            jumpbox.hostname: jumpbox.remote_upload_path(file_name) for jumpbox in self.jumpboxes
+        }
+        if len(set(paths.values())) > 1:
+            raise RuntimeError(f"{file_name} has a different path on each jumpbox: {paths}")
+        return next(iter(paths.values()))
+
+    def clear_any_previous_results(self, prefix="", suffix=""):
+        """
+        Remove files from previous runs of the job from every MoDOT jumpbox.
+
+        :param prefix: a string representing the prefix of the files
+                       on the Jumpbox that we want to remove
+        :param suffix: a string representing the suffix of the files
+                       on the Jumpbox that we want to remove
+        """
+        for jumpbox in self.jumpboxes:
+            jumpbox.clear_any_previous_results(prefix, suffix)
+
+
+class PersistentShell:
+    """
+    A single shell on the MoDOT jumpbox that stays open for running many commands in a row.
+
+    Each command is followed by markers on stdout and stderr so that we know where its output
+    ends and what its exit status was without having to open a new channel for every command.
+    Both are read as output arrives, so a command that fills one of them (e.g. with a flood of
+    errors) can't stall waiting for us to finish reading the other.
+    """
+
+    def __init__(self, client, setup_command):
+        """
+        Initialize an instance of this class by opening a shell on the MoDOT jumpbox.
+
+        :param client: an instance of the SSHClient class from paramiko connected to the jumpbox
+        :param setup_command: a string representing a command to run once when the shell opens
+        """
+        self.channel = client.get_transport().open_session()
+        self.channel.exec_command("bash --noprofile --norc")
+        self.stdin = self.channel.makefile_stdin("w")
+        self.marker = f"__ut_done_{uuid.uuid4().hex}__"
+        self.run(setup_command)
+
+    def is_open(self):
+        """
+        Check whether the shell is still usable.
+
+        :return: True if the shell hasn't exited, False otherwise
+        """
+        return not self.channel.closed and not self.channel.exit_status_ready()
+
+    def run(self, command, prompt_answers=None):
+        """
+        Run a command in the shell and wait for it to finish.
+
+        :param command: a string representing a command to run on the MoDOT jumpbox
+        :param prompt_answers: a list of strings representing answers to expected
+                               prompts for user input after running the command
+        :return: a list of strings containing the lines of the output of the command, a list of
+                 strings containing the command's errors, and a number representing the command's
+                 exit status (or None if the shell died while running it)
+        """
+        # Feed the command its answers through a here-document so that any answers it doesn't
+        # read are thrown away rather than being run by the shell as the next command.
+        if prompt_answers:
+            answers = "\n".join(str(answer) for answer in prompt_answers)
+            stdin = f"<<'{self.marker}'\n{answers}\n{self.marker}"
+        else:
+            stdin = "< /dev/null"
+        self.stdin.write(
+            f"{{ {command}\n}} {stdin}\n"
+            f"echo \"{self.marker} $?\"; echo {self.marker} >&2\n"
+        )
+        self.stdin.flush()
+
+        return self.read_until_markers()
+
+    def read_until_markers(self):
+        """
+        Read the lines a command printed to stdout and stderr, up until the markers that follow
+        them, taking whatever has arrived on either one in turn.
+
+        :return: a list of strings representing the lines of output, a list of strings
+                 representing the lines of errors, and a number representing the exit status that
+                 followed the stdout marker (or None if there wasn't one or the shell died)
+        """
+        channel = self.channel
+        output = []
+        errors = []
+        streams = [
+            {"ready": channel.recv_ready, "recv": channel.recv, "lines": output},
+            {"ready": channel.recv_stderr_ready, "recv": channel.recv_stderr, "lines": errors},
+        ]
+        for stream in streams:
+            stream.update(buffer=b"", done=False, status=None)
+
+        while not all(stream["done"] for stream in streams):
+            if not any(stream["ready"]() for stream in streams):
+                if channel.closed or (channel.exit_status_ready() and channel.eof_received):
+                    break
+                select.select([channel], [], [], STREAM_POLL_SECS)
+                continue
+            for stream in streams:
+                if not stream["ready"]():
+                    continue
+                stream["buffer"] += stream["recv"](STREAM_READ_BYTES)
+                *lines, stream["buffer"] = stream["buffer"].split(b"\n")
+                for line in lines:
+                    if stream["done"]:
+                        break
+                    text, found, status = line.decode(errors="replace").partition(self.marker)
+                    if text.strip():
+                        stream["lines"].append(text.strip())
+                    if found:
+                        stream["done"] = True
+                        stream["status"] = int(status) if status.strip().isdigit() else None
+
+        # Pass along anything left over that didn't end in a newline if the shell died.
+        for stream in streams:
+            text = stream["buffer"].decode(errors="replace").strip()
+            if text and not stream["done"]:
+                stream["lines"].append(text)
+        return output, errors, streams[0]["status"]
+
+    def close(self):
+        """
+        Close the shell.
+        """
+        self.channel.close()
+
+
+def make_run_id():
+    """
+    Make an ID that's unique to this run of the job, and to this connection within it, to name
+    the directory on the jumpbox that the run works in.
+
+    :return: a string made up of the Jenkins build tag (if there is one) and a random suffix
+    """
+    build_tag = re.sub(r"[^A-Za-z0-9_.-]", "_", os.environ.get("BUILD_TAG", "run"))
+    return f"{build_tag}_{uuid.uuid4().hex[:8]}"
+
+
+def get_jumpbox_hosts(environment):
+    """
+    Get the MoDOT jumpboxes that jobs can use in an environment.
+
+    :param environment: a string ("preprod" or "prod") representing the environment
+    :return: a list of strings representing the jumpboxes' hostnames. These are specified
+             by an optional comma separated parameter to the job. If unspecified, the
+             environment's main jumpbox is used.
+    """
+    if "jumpbox_hosts" in os.environ:
+        hostnames = [
+            hostname.strip()
+            for hostname in get_expected_env_var("jumpbox_hosts").split(",")
+            if hostname.strip()
+        ]
+        if hostnames:
+            return hostnames
+    return [f"jumpbox.ut-devops-{environment}.viasat.io"]
+
+
+def is_persistent_shell_enabled():
+    """
+    Determine whether to run jumpbox commands in a single long-lived shell rather
+    than opening a new channel and re-activating the MoDOT venv for every command.
+
+    :return: True if the persistent shell is enabled for this run of the job, False otherwise.
+             This is specified by an optional parameter to the job. If unspecified, it's disabled.
+    """
+    return "persistent_jumpbox_shell" in os.environ and check_expected_env_bool(
+        "persistent_jumpbox_shell"
+    )
+
+
+def get_max_parallel_commands():
+    """
+    Determine how many commands to run on the jumpbox at once, so that running independent
+    commands in parallel doesn't overload the jumpbox (or exceed its sshd's session limit).
+
+    :return: a number representing the max quantity of commands to run on the jumpbox at once
+             during this run of the job. This is specified by an optional parameter to the job.
+             If unspecified, a default is used.
+    """
+    if "max_jumpbox_channels" in os.environ:
+        try:
+            max_channels = int(get_expected_env_var("max_jumpbox_channels"))
+            if max_channels > 0:
+                return max_channels
+        except (ValueError, TypeError) as ex:
+            print(ex)
+    return MAX_PARALLEL_COMMANDS_DEFAULT
+
+
+def get_command_timeout():
+    """
+    Determine how long to let a streamed command run on the jumpbox before giving up on it,
+    so that one hung command doesn't hold up the steps that come after it.
+
+    :return: a number representing the max quantity of seconds to let a command run, or None
+             for no limit. This is specified by an optional parameter to the job (in minutes).
+             If unspecified, there's no limit.
+    """
+    if "command_timeout_minutes" in os.environ:
+        try:
+            timeout_minutes = float(get_expected_env_var("command_timeout_minutes"))
+            if timeout_minutes > 0:
+                return timeout_minutes * 60
+        except (ValueError, TypeError) as ex:
+            print(ex)
+    return None
+
+
 def print_command_results(command, output, errors):
     """
     Print the output and errors from a command.
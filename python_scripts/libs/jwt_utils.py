@@ -0,0 +1,183 @@
+"""
+Contains generic functionality for caching the JWT tokens we use as credentials for various APIs.
+
+A token is kept in memory for the life of the process and only refreshed when its "exp" claim
+says it's about to expire or when the API it's for rejects it, rather than validating it with
+a round trip to the server before every request.
+"""
+
+import os
+import json
+import base64
+import threading
+import time
+from libs import http_utils
+
+# how long before a token expires to start using a new one instead
+REFRESH_MARGIN = 5 * 60  # seconds
+
+# how long to trust a token whose expiry we can't read before requesting a new one
+UNKNOWN_EXPIRY_LIFETIME = 10 * 60  # seconds
+
+_managers = {}
+_managers_lock = threading.Lock()
+
+
+def decode_jwt_expiry(token):
+    """
+    Read the expiry time out of a JWT token without verifying its signature.
+
+    :param token: a string representing a JWT token (with or without the "Bearer " prefix)
+    :return: a number representing the epoch time in seconds at which the
+             token expires, or None if the token doesn't have a readable "exp" claim
+    """
+    try:
+        payload = token.split()[-1].split(".")[1]
+        payload += "=" * (-len(payload) % 4)
+        return int(json.loads(base64.urlsafe_b64decode(payload))["exp"])
+    except (AttributeError, IndexError, TypeError, KeyError, ValueError):
+        return None
+
+
+def get_jwt_manager(key, file_path, request_new_token):
+    """
+    Get the token manager for a given API and set of credentials, creating it on first use.
+
+    :param key: a tuple identifying the token (e.g. ("cmt", "prod") or ("sdp", "prod", "exederes"))
+    :param file_path: a string representing the path of the file in which to persist the token
+    :param request_new_token: a function that takes no arguments and returns a
+                              string representing a new JWT token, or None on failure
+    :return: an instance of the JwtManager class
+    """
+    with _managers_lock:
+        if key not in _managers:
+            _managers[key] = JwtManager(file_path, request_new_token)
+        return _managers[key]
+
+
+class JwtManager:
+    """
+    Caches a single JWT token in memory and on disk and refreshes it when necessary.
+    """
+
+    def __init__(self, file_path, request_new_token):
+        """
+        Initialize an instance of this class.
+
+        :param file_path: a string representing the path of the file in which to persist the token
+        :param request_new_token: a function that takes no arguments and returns a
+                                  string representing a new JWT token, or None on failure
+        """
+        self.file_path = os.path.expanduser(file_path)
+        self.request_new_token = request_new_token
+        self.token = None
+        self.refresh_at = 0
+        self.rejected_token = None
+        self.lock = threading.Lock()
+
+    def get_token(self):
+        """
+        Get a token that isn't about to expire, requesting a new one if necessary.
+
+        :return: a string representing a JWT token, or None if we couldn't get one
+        """
+        with self.lock:
+            if self.token and time.time() < self.refresh_at:
+                return self.token
+
+            # Tokens left on disk by a previous run are still good until they expire.
+            token = self.read_token_from_file()
+            if not token or token == self.rejected_token or not self.cache(token):
+                token = self.request_new_token()
+                if not token or not self.cache(token):
+                    return None
+                self.write_token_to_file(token)
+            return self.token
+
+    def invalidate(self, token):
+        """
+        Stop using a token (e.g. because the API rejected it).
+
+        :param token: a string representing the JWT token to stop using
+        """
+        with self.lock:
+            self.rejected_token = token
+            if self.token == token:
+                self.token = None
+                self.refresh_at = 0
+
+    def request(self, method, url, headers=None, **kwargs):
+        """
+        Make an HTTP request authorized by this token, retrying once
+        with a new token if the API rejects the one we have.
+
+        Takes the same keyword arguments as http_utils.request().
+
+        :param method: a string representing the HTTP method (e.g. "GET")
+        :param url: a string representing the URL to make the request to
+        :param headers: a dictionary of additional headers to send
+        :return: an instance of the Response class from the requests
+                 library representing the response to this HTTP request
+        :raises RuntimeError: if we couldn't get a token to authorize the request with
+        """
+        for attempt in range(2):
+            token = self.get_token()
+            if not token:
+                raise RuntimeError(f"Failed to get a JWT token for {method} request to {url}.")
+            all_headers = dict(headers or {}, Authorization=f"Bearer {token}")
+            response = http_utils.request(method, url, headers=all_headers, **kwargs)
+            if response.status_code != 401 or attempt > 0:
+                return response
+            print(f"{method} request to {url} returned 401, requesting a new token")
+            self.invalidate(token)
+        return response
+
+    def cache(self, token):
+        """
+        Start using a token if it isn't about to expire.
+
+        :param token: a string representing a JWT token
+        :return: True if the token was cached, False if it's expired or about to expire
+        """
+        expiry = decode_jwt_expiry(token)
+        refresh_at = (
+            expiry - REFRESH_MARGIN if expiry else time.time() + UNKNOWN_EXPIRY_LIFETIME
+        )
+        if time.time() >= refresh_at:
+            return False
+        self.token = token
+        self.refresh_at = refresh_at
+        return True
+
+    def read_token_from_file(self):
+        """
+        Read the token persisted by a previous run.
+
+        :return: a string representing a JWT token, or None if there isn't one
+        """
+        try:
+            with open(self.file_path, "r") as jwt_file:
+                return jwt_file.read().strip() or None
+        except IOError:
+            return None
+
+    def write_token_to_file(self, token):
+        """
+        Persist a token so that later runs don't have to request a new one.
+
+        :param token: a string representing a JWT token
+        """
+        jwt_dir_path = os.path.dirname(self.file_path)
+        try:
+            if not os.path.exists(jwt_dir_path):
+                os.makedirs(jwt_dir_path)
+                print(f"Required dir ({jwt_dir_path}) created for storing JWT file.")
+            os.chmod(jwt_dir_path, 0o700)
+            with open(self.file_path, "w") as jwt_file:
+                jwt_file.write(token)
+            os.chmod(self.file_path, 0o700)
+        except (IOError, OSError) as ex:
+            print(
+                f"Cannot access {self.file_path} due to {ex}."
+                f" You will have to authenticate each time you run the script."
+            )
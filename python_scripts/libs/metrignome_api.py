@@ -4,11 +4,8 @@ Contains generic functionality for making metrignome API calls.
 
 import os
 import json
-from datetime import timedelta, datetime
-import requests
-from libs import common_utils, vault_utils
+from libs import common_utils, http_utils, jwt_utils, vault_utils
 
-JWT_DIR_PATH = os.path.expanduser("~/etc")
 JWT_FILE_PATH = os.path.expanduser("~/etc/metrignomejwt")
 
 ENV_TO_API_URL = {
@@ -29,9 +26,22 @@ def get_metrignome_url(env=None):
     return ENV_TO_API_URL[env or common_utils.get_environment()]
 
 
+def get_metrignome_jwt_manager(env=None):
+    """
+    Get the manager of the JWT token we use as credentials for the metrignome API.
+
+    :param env: the string "dev", "preprod", or "prod"
+    :return: an instance of the JwtManager class from jwt_utils
+    """
+    env = env or common_utils.get_environment()
+    return jwt_utils.get_jwt_manager(
+        ("metrignome", env), f"{JWT_FILE_PATH}_{env}", lambda: get_new_metrignome_token(env)
+    )
+
+
 def get_new_metrignome_token(env=None):
     """
-    Request a new metrignome token for the specified vno.
+    Request a new metrignome token for the specified environment.
 
     :param env: the string "dev", "preprod", or "prod"
     :return: a string representing a JWT token to use as credentials for the metrignome API.
@@ -39,7 +49,7 @@ def get_new_metrignome_token(env=None):
     env = env or common_utils.get_environment()
 
     # Request the JWT token.
-    response = requests.get(
+    response = http_utils.get(
         f"https://jwt.us-or.viasat.io/v1/token?stripe=metrignome&name={env}-api",
         auth=(
             common_utils.SDP_API_SERVICE_ACCT_USR,
@@ -51,70 +61,17 @@ def get_new_metrignome_token(env=None):
     if not response or response.status_code != 200:
         print(f"Unable to get token! Status Code: {response.status_code}")
         return None
-
-    # Store the JWT token in a file so that we don't have to request it every time.
-    token = response.text
-    local_etc_path = os.path.expanduser(JWT_DIR_PATH)
-    if not os.path.exists(local_etc_path):
-        os.mkdir(local_etc_path)
-        print(f"Required dir ({local_etc_path}) created for storing JWT file.")
-    try:
-        with open(os.path.expanduser(JWT_FILE_PATH), "w") as jwt_file:
-            jwt_file.write(token)
-    except IOError as ex:
-        print(
-            f"Cannot access {JWT_FILE_PATH} directory due to {ex}."
-            f" You will have to authenticate each time you run the script."
-        )
-    return token
+    return response.text
 
 
 def get_metrignome_token(env=None):
     """
-    Checks if the current token is valid and gets a new one if it's missing or invalid.
-    :param env: the string "dev", "preprod", or "prod"
+    Get a JWT token for the metrignome API, reusing the cached one unless it's about to expire.
 
+    :param env: the string "dev", "preprod", or "prod"
     :return: a string representing a JWT token to use as credentials for the metrignome API
     """
-
-    env = env or common_utils.get_environment()
-    # Check whether we already have the JWT token saved in a file. If we don't, obtain a new one.
-    try:
-        with open(os.path.expanduser(JWT_FILE_PATH), "r") as jwt_file:
-            jwt = jwt_file.read()
-    except IOError:
-        jwt = get_new_metrignome_token(env)
-
-    # Check whether the JWT token we have is valid. If it's not, obtain a new one.
-    # Try a resouce with minimal overhead
-    try:
-        from_ts = int((datetime.today() - timedelta(days=2)).timestamp())
-        to_ts = int(datetime.today().timestamp())
-        params = {"from": f"{from_ts}", "to": f"{to_ts}"}
-        response = requests.get(
-            get_metrignome_url() + "/v1/metrics/cpuUsage/data",
-            headers={"Authorization": f"Bearer {jwt}"},
-            verify=False,
-            timeout=60,
-            params=params,
-        )
-        if response.status_code != 200:
-            print("http request to try jwt token failed (maybe token expired.)")
-            common_utils.print_http_response(response)
-            raise ValueError
-    except ValueError:
-        jwt = get_new_metrignome_token(env)
-
-    # Ensure that the JWT file directory and file have the correct permissions.
-    try:
-        if oct(os.stat(JWT_DIR_PATH).st_mode) != "0o40700":
-            os.chmod(JWT_DIR_PATH, 0o700)
-        if oct(os.stat(JWT_FILE_PATH).st_mode) != "0o100700":
-            os.chmod(os.path.expanduser(JWT_FILE_PATH), 0o700)
-    except Exception as ex:
-        print(f"JWT file permissions not set. Exception: {ex}")
-
-    return jwt
+    return get_metrignome_jwt_manager(env).get_token()
 
 
 def get_terminalOfflineEventReason(from_ts, to_ts, vno=None, env=None):
@@ -141,13 +98,14 @@ def get_terminalOfflineEventReason(from_ts, to_ts, vno=None, env=None):
     out_dict = {}
     url = f"{get_metrignome_url(env)}/v1/metrics/terminalOfflineEventReason/data"
     headers = {
-        "Authorization": f"Bearer {get_metrignome_token(env)}",
         "Accept-Encoding": "gzip,deflate",
         "Accept": "application/json",
         "Content-type": "application/json",
     }
     params = {"from": f"{from_ts}", "to": f"{to_ts}", "vno": f"{vno}", "groupBy": "ntdMacAddress"}
-    response = requests.get(url, headers=headers, verify=False, timeout=60, params=params)
+    response = get_metrignome_jwt_manager(env).request(
+        "GET", url, headers=headers, verify=False, timeout=60, params=params
+    )
     if response.status_code == 200:
         json_content = json.loads(response.content)
         """
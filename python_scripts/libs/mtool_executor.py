@@ -0,0 +1,210 @@
+"""
+Contains functionality for running an mtool command on a fleet of modems and finding out
+what happened on each one, so that jobs don't each need their own batch-and-check loop.
+"""
+
+from collections import Counter
+from libs.mtool_utils import (
+    format_mac_addr,
+    get_mtool_batch_sizer,
+    is_mtool_output_reduced,
+    parse_mtool_output,
+    run_mtool_command_in_batches,
+)
+
+DEFAULT_BATCH_SIZE = 35
+DEFAULT_RETRIES = 0
+
+# outcomes used by the classifiers below
+SUCCEEDED = "succeeded"
+FAILED = "failed"
+
+
+class MtoolFleetExecutor:  # pylint: disable=too-few-public-methods
+    """
+    Runs an mtool command on a list of modems and classifies the result for each one.
+
+    Batching the modems, running the batches in parallel on the jumpbox (or across a
+    JumpboxPool), and adapting the batch size are handled by
+    mtool_utils.run_mtool_command_in_batches(). On top of that, modems that mtool reached but
+    whose result couldn't be classified can be retried (for read-only commands), and progress
+    is printed after each attempt.
+
+    Example:
+        executor = MtoolFleetExecutor(
+            jumpbox,
+            "check_ufwd",
+            "-a run_commands -C 'utstat -Y | grep ufwd'",
+            expected_output_classifier([("enabled", "broken"), ("disabled", "healthy")]),
+            retries=1,
+            unresolved_outcome="offline",
+        )
+        outcomes = executor.run(macs)  # e.g. {"00A0BC112233": "healthy", ...}
+    """
+
+    def __init__(
+        self,
+        jumpbox,
+        name,
+        mtool_args,
+        classify=None,
+        batch_size=None,
+        retries=DEFAULT_RETRIES,
+        unresolved_outcome=FAILED,
+        verbose=False,
+        prompt_answers=None,
+        structured=None,
+    ):  # pylint: disable=too-many-arguments
+        """
+        Initialize an instance of this class.
+
+        :param jumpbox: an instance of the Jumpbox or JumpboxPool class
+        :param name: a string identifying the kind of mtool command (e.g. "reboot"), used to
+                     name the MAC list files, pick the batch sizer, and label progress
+        :param mtool_args: a string containing the arguments to be passed to the mtool command,
+                           excluding -i and -m because they will be added automatically
+        :param classify: a function that takes a list of the records mtool printed for a modem
+                         (as described in mtool_utils.iter_mtool_records()) and returns that
+                         modem's outcome, or None if it can't tell. Defaults to
+                         succeeded_classifier.
+        :param batch_size: a number representing the max quantity of modems to pass to mtool
+                           at once, or an instance of the MtoolBatchSizer class. Defaults to
+                           the job's adaptive batch sizer for this kind of command.
+        :param retries: a number representing how many more times to try modems that mtool
+                        reached but whose outcome couldn't be classified. Defaults to 0, since
+                        most commands change something on the modem and shouldn't be repeated;
+                        only pass more for read-only checks.
+        :param unresolved_outcome: the outcome to give modems that are still unclassified
+                                   once we run out of retries
+        :param verbose: True if we want to print the results of running the mtool command,
+                        False otherwise
+        :param prompt_answers: a list of strings representing answers to expected
+                               prompts for user input after running the command
+        :param structured: True to condense mtool's output on the jumpbox before it's sent
+                           back, False not to, or None to leave it up to the job's
+                           reduce_mtool_output parameter
+        """
+        self.jumpbox = jumpbox
+        self.name = name
+        self.mtool_args = mtool_args
+        self.classify = classify or succeeded_classifier
+        self.batch_size = batch_size or get_mtool_batch_sizer(name, DEFAULT_BATCH_SIZE)
+        self.retries = retries
+        self.unresolved_outcome = unresolved_outcome
+        self.verbose = verbose
+        self.prompt_answers = prompt_answers
+        self.structured = is_mtool_output_reduced() if structured is None else structured
+
+    def run(self, macs):
+        """
+        Run the mtool command on the modems and classify the result for each one.
+
+        :param macs: a list of strings representing the MAC addresses to run the command on
+        :return: a dictionary mapping each of the given MAC addresses to its outcome
+        """
+        outcomes = {}
+        remaining = list(macs)
+        for attempt in range(self.retries + 1):
+            if not remaining:
+                break
+            output, _ = run_mtool_command_in_batches(
+                self.jumpbox,
+                f"ut_macs_{self.name}",
+                remaining,
+                self.batch_size,
+                self.mtool_args,
+                verbose=self.verbose,
+                prompt_answers=self.prompt_answers,
+                structured=self.structured,
+            )
+            output = parse_mtool_output(output)
+
+            # Classify each modem, and keep the ones mtool reached but we couldn't classify.
+            retry = []
+            for mac in remaining:
+                records = output.get(format_mac_addr(mac), [])
+                outcome = self.classify(records)
+                if outcome is None:
+                    outcome = self.unresolved_outcome
+                    if is_reachable(records):
+                        retry.append(mac)
+                outcomes[mac] = outcome
+            self.print_progress(attempt, len(remaining), retry)
+            remaining = retry
+
+        counts = Counter(outcomes.values())
+        print(
+            f" \n[{self.name}] outcomes: "
+            + ", ".join(f"{outcome}: {count}" for outcome, count in counts.items())
+        )
+        return outcomes
+
+    def print_progress(self, attempt, attempted, unclassified):
+        """
+        Print how an attempt at running the command went.
+
+        :param attempt: a number representing which attempt this was, starting at 0
+        :param attempted: a number representing how many modems this attempt was on
+        :param unclassified: a list of strings representing the MAC addresses that mtool
+                             reached but whose outcome couldn't be classified
+        """
+        message = (
+            f" \n[{self.name}] attempt {attempt + 1} of {self.retries + 1}: classified"
+            f" {attempted - len(unclassified)} of {attempted} modem(s)"
+        )
+        if unclassified and attempt < self.retries:
+            message += f", retrying {len(unclassified)} that mtool reached"
+        print(message)
+
+
+def is_reachable(records):
+    """
+    Determine whether mtool managed to talk to a modem, judging by whether it printed the
+    modem's software version.
+
+    :param records: a list of the records mtool printed for a modem
+    :return: True if mtool reached the modem, False otherwise
+    """
+    return any(record["sw version"] for record in records)
+
+
+def succeeded_classifier(records):
+    """
+    Classify a modem by whether mtool says the command ran successfully on it, for commands
+    that don't print anything we need to check.
+
+    :param records: a list of the records mtool printed for a modem
+    :return: SUCCEEDED if the command succeeded on the modem, None otherwise
+    """
+    return SUCCEEDED if any(record["succeeded"] for record in records) else None
+
+
+def expected_output_classifier(expected_outcomes, otherwise=None):
+    """
+    Make a classifier for commands whose output tells us something about the modem, that
+    looks for each expected phrase in turn in the first line of the command's stdout.
+
+    :param expected_outcomes: a list of tuples (phrase, outcome), checked in order
+    :param otherwise: the outcome to give modems that mtool reached but whose output contained
+                      none of the phrases, or None to treat them as unclassified
+    :return: a function that can be passed to MtoolFleetExecutor as its classifier
+    """
+
+    def classify(records):
+        for phrase, outcome in expected_outcomes:
+            if any(record["lines"] and phrase in record["lines"][0] for record in records):
+                return outcome
+        return otherwise if is_reachable(records) else None
+
+    return classify
+
+
+def macs_with_outcome(outcomes, outcome):
+    """
+    Get the MAC addresses that had a particular outcome.
+
+    :param outcomes: a dictionary returned by MtoolFleetExecutor.run()
+    :param outcome: the outcome to look for
+    :return: a list of strings representing MAC addresses, in the order they were run
+    """
+    return [mac for mac, mac_outcome in outcomes.items() if mac_outcome == outcome]
@@ -0,0 +1,90 @@
+"""
+Condenses the output of mtool into one line of compact JSON per block of output that mtool
+prints for a modem, keeping only the parts that mtool_utils looks at, so that far less text
+has to come back from the MoDOT jumpbox over ssh.
+
+This file is copied to the jumpbox and run there (see mtool_utils.install_output_reducer()),
+so it can only use the standard library and mustn't import anything from libs.
+
+Usage: <mtool command> | python mtool_output_reducer.py [max lines of stdout to keep per modem]
+"""
+
+import json
+import re
+import sys
+
+# matches a MAC address in the uppercase colon separated format mtool prints
+MAC_ADDR_REGEX = re.compile(r"(?:[0-9A-Fa-f]{2}:){5}[0-9A-Fa-f]{2}")
+
+
+def reduce_mtool_output(lines, max_lines=None):
+    """
+    Walk through the output of running a command via mtool once, as it's printed, grouping it
+    into one block for each modem the same way mtool_utils.iter_mtool_records() does.
+
+    :param lines: an iterable of strings representing the lines of output of
+                  running a command on a list of modems via mtool
+    :param max_lines: a number representing the max quantity of lines of the command's stdout
+                      to keep for each modem, or None to keep all of them
+    :return: a generator of dictionaries that look like:
+             {
+                 "macs": [<MAC addresses in uppercase colon separated format>],
+                 "sw version": "<text after swVersion:>",
+                 "status": "<the line with the command's status>" or None if there wasn't one,
+                 "lines": [<lines of the command's stdout>],
+             }
+    """
+    block = None
+    previous = None
+    for line in lines:
+        line = line.rstrip("\n")
+
+        # A line containing a MAC address followed by a swVersion: line starts a new block.
+        if previous is not None and "swVersion:" in line and MAC_ADDR_REGEX.search(previous):
+            if block is not None:
+                yield block
+            block = {
+                "macs": [mac.upper() for mac in MAC_ADDR_REGEX.findall(previous)],
+                "sw version": line.split("swVersion:", 1)[1].strip(),
+                "status": None,
+                "lines": [],
+            }
+            previous = None
+            continue
+
+        if block is not None and previous is not None:
+            add_line_to_block(block, previous, max_lines)
+        previous = line
+
+    if block is not None:
+        if previous is not None:
+            add_line_to_block(block, previous, max_lines)
+        yield block
+
+
+def add_line_to_block(block, line, max_lines):
+    """
+    Add a line of mtool output to the block for the modem it belongs to.
+
+    :param block: a dictionary as described in reduce_mtool_output()
+    :param line: a string representing the line to add
+    :param max_lines: a number representing the max quantity of lines of the command's stdout
+                      to keep for each modem, or None to keep all of them
+    """
+    if block["status"] is None:
+        block["status"] = line
+    elif max_lines is None or len(block["lines"]) < max_lines:
+        block["lines"].append(line)
+
+
+def main():
+    """
+    Reduce the mtool output piped into this script, printing each block as soon as it ends.
+    """
+    max_lines = int(sys.argv[1]) if len(sys.argv) > 1 else None
+    for block in reduce_mtool_output(sys.stdin, max_lines):
+        print(json.dumps(block, separators=(",", ":")), flush=True)
+
+
+if __name__ == "__main__":
+    main()
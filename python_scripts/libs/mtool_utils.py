@@ -3,13 +3,46 @@ Contains functionality for using Jenkins to run mtool commands via the MoDOT jum
 """
 
 import os
+import re
+import json
 from datetime import datetime
+from time import time
+from libs import mtool_output_reducer
+from libs.jumpbox import print_command_results
 
 MTOOL_FILE_PATH_ON_JB = "/var/tmp/modot_tools/modem_tool/modem_tool.py"
+MTOOL_PYTHON_PATH_ON_JB = "/var/tmp/modot_venv/bin/python"
 UTDIAG_FILE_PATH = "/usr/sbin/ut_scriptfile.sh"
 
+# matches a MAC address in the uppercase colon separated format mtool prints
+MAC_ADDR_REGEX = re.compile(r"(?:[0-9A-Fa-f]{2}:){5}[0-9A-Fa-f]{2}")
 
-def run_mtool_command(jumpbox, mtool_args, verbose=True, prompt_answers=None):
+# bounds on how many modems MtoolBatchSizer will give mtool at once, and how it adjusts
+MIN_BATCH_SIZE = 5
+MAX_BATCH_SIZE = 200
+BATCH_SIZE_INCREASE = 5
+BATCH_SIZE_DECREASE_FACTOR = 0.5
+
+# batches quicker than this can grow, and batches slower than this count as having timed out
+HEALTHY_BATCH_SECS = 2 * 60
+SLOW_BATCH_SECS = 10 * 60
+
+# the fraction of modems in a batch that mtool has to run the command on successfully for the
+# batch to count as healthy
+MIN_HEALTHY_SUCCESS_RATE = 0.8
+
+# where to put the script that condenses mtool output on the jumpbox, and how much of each
+# modem's stdout it keeps (our checks only ever look at the first line)
+REDUCER_FILE_NAME = "mtool_output_reducer.py"
+MAX_REDUCED_LINES = 20
+
+_batch_sizers = {}
+_work_dirs_with_reducer = set()
+
+
+def run_mtool_command(
+    jumpbox, mtool_args, verbose=True, prompt_answers=None, structured=False
+):  # pylint: disable=too-many-arguments
     """
     Run an mtool command on the MoDOT jumpbox.
 
@@ -20,27 +53,322 @@ def run_mtool_command(jumpbox, mtool_args, verbose=True, prompt_answers=None):
                     False otherwise
     :param prompt_answers: a list of strings representing answers to expected
                            prompts for user input after running the command
-    :return:
+    :param structured: True to condense mtool's output on the jumpbox before it's sent back
+                       and return it already parsed, False to return every line of it
+    :return: The output of the command, either as a list of strings representing its lines or,
+             if structured, as a dictionary like the one returned by parse_mtool_output(), and
+             a list of strings representing the command's errors
+    """
+    prompt_answers = prompt_answers or [jumpbox.password, jumpbox.password, jumpbox.password]
+    jumpbox.grant_mtool_access()
+    command = f"{mtool_base_cmd(set_acl=False)} -i {mtool_args}"
+    if structured:
+        install_output_reducer(jumpbox)
+        command += reducer_pipe()
+    output, errors = jumpbox.run_command(command, verbose=verbose, prompt_answers=prompt_answers)
+    return (parse_reduced_mtool_output(output) if structured else output), errors
+
+
+def stream_mtool_command(
+    jumpbox, mtool_args, prompt_answers=None, timeout=None, errors=None
+):  # pylint: disable=too-many-arguments
+    """
+    Run an mtool command on the MoDOT jumpbox, yielding the result for each modem as soon as
+    mtool has finished printing it rather than once mtool has finished with every modem.
+
+    :param jumpbox: an instance of the Jumpbox or JumpboxPool class
+    :param mtool_args: a string containing the arguments to be passed to the mtool command,
+                       excluding -i because -i will be added automatically
+    :param prompt_answers: a list of strings representing answers to expected
+                           prompts for user input after running the command
+    :param timeout: a number representing the max quantity of seconds to let mtool run for,
+                    or None to use the job's default (see jumpbox.get_command_timeout())
+    :param errors: a list to add the lines of the command's errors to, or None to ignore them
+    :return: a generator of tuples (mac, record) as described in iter_mtool_records()
+    """
+    prompt_answers = prompt_answers or [jumpbox.password, jumpbox.password, jumpbox.password]
+    jumpbox.grant_mtool_access()
+    yield from stream_mtool_records(
+        jumpbox.stream_command(
+            f"{mtool_base_cmd(set_acl=False)} -i {mtool_args}", prompt_answers, timeout, errors
+        )
+    )
+
+
+def stream_mtool_records(lines):
+    """
+    Walk through the output of running a command via mtool as it arrives, yielding one
+    record for each block of output that mtool printed for a modem.
+
+    :param lines: an iterable of strings representing the lines of output of
+                  running a command on a list of modems via mtool
+    :return: a generator of tuples (mac, record) as described in iter_mtool_records()
+    """
+    for block in mtool_output_reducer.reduce_mtool_output(lines):
+        record = make_mtool_record(block["sw version"], block["status"] or "", block["lines"])
+        for mac in block["macs"]:
+            yield mac, record
+
+
+def run_mtool_command_in_batches(
+    jumpbox,
+    mac_list_file_name,
+    macs,
+    batch_size,
+    mtool_args,
+    verbose=True,
+    prompt_answers=None,
+    structured=False,
+):  # pylint: disable=too-many-arguments,too-many-locals
+    """
+    Run the same mtool command on a list of modems in batches, running the batches on the MoDOT
+    jumpbox in parallel (up to the jumpbox's concurrency cap) rather than one after another.
+    If given a JumpboxPool, the batches are spread across all of its jumpboxes.
+
+    Each batch gets its own MAC list file, written to the jumpbox that runs the batch, so that
+    batches running at the same time don't overwrite each other's list of modems.
+
+    If given an MtoolBatchSizer rather than a fixed batch size, the batches are run in waves of
+    as many as the jumpbox can run at once, and the sizer adjusts the batch size after each wave.
+
+    :param jumpbox: an instance of the Jumpbox or JumpboxPool class
+    :param mac_list_file_name: a string representing the name to base the MAC list files on
+    :param macs: a list of strings representing the MAC addresses to run the command on
+    :param batch_size: a number representing the max quantity of modems to pass to mtool
+                       at once, or an instance of the MtoolBatchSizer class
+    :param mtool_args: a string containing the arguments to be passed to the mtool command,
+                       excluding -i and -m because they will be added automatically
+    :param verbose: True if we want to print the results of running the mtool command,
+                    False otherwise
+    :param prompt_answers: a list of strings representing answers to expected
+                           prompts for user input after running the command
+    :param structured: True to condense mtool's output on the jumpbox before it's sent back
+                       and return it already parsed, False to return every line of it
+    :return: The output of every batch, either as a list of strings representing its lines or,
+             if structured, as a dictionary like the one returned by parse_mtool_output(), and
+             a list of strings representing every batch's errors
     """
+    output = []
+    errors = []
+    if not macs:
+        return ({} if structured else output), errors
+    sizer = batch_size if isinstance(batch_size, MtoolBatchSizer) else None
+    name, extension = os.path.splitext(mac_list_file_name)
     prompt_answers = prompt_answers or [jumpbox.password, jumpbox.password, jumpbox.password]
-    return jumpbox.run_command(
-        f"{mtool_base_cmd()} -i {mtool_args}", verbose=verbose, prompt_answers=prompt_answers
+
+    def mtool_command(file_name):
+        command = f"{mtool_base_cmd(set_acl=False)} -i -m {file_name} {mtool_args}"
+        return command + reducer_pipe() if structured else command
+
+    # A batch that can't be run is reported like a batch mtool couldn't reach any modems in
+    # (with no output and an elapsed time of None) rather than raised, since raising would
+    # throw away the results of the other batches, which may already have changed modems.
+    def run_batch(target, file_name_and_batch):
+        file_name, batch = file_name_and_batch
+        if not create_mac_list_file(target, file_name, batch):
+            return [], [f"ERROR: couldn't create {file_name} on {target.hostname}"], None
+        start_time = time()
+        try:
+            batch_output, batch_errors = target.execute(mtool_command(file_name), prompt_answers)
+        except Exception as ex:
+            return [], [f"ERROR: mtool failed on {file_name} on {target.hostname}: {ex}"], None
+        return batch_output, batch_errors, time() - start_time
+
+    jumpbox.grant_mtool_access()
+    if structured:
+        install_output_reducer(jumpbox)
+    start = 0
+    batch_count = 0
+    while start < len(macs):
+        # Split the next wave of modems into batches, or all of them if the batch size is fixed.
+        size = sizer.size if sizer else batch_size
+        wave_end = min(len(macs), start + size * jumpbox.max_in_flight()) if sizer else len(macs)
+        wave = [
+            (f"{name}_{batch_count + count}{extension}", macs[index : index + size])  # noqa: E203
+            for count, index in enumerate(range(start, wave_end, size))
+        ]
+        start = wave_end
+        batch_count += len(wave)
+
+        results = jumpbox.run_in_parallel(run_batch, wave)
+        for (file_name, _), (batch_output, batch_errors, _) in zip(wave, results):
+            if verbose:
+                print_command_results(mtool_command(file_name), batch_output, batch_errors)
+            output += batch_output
+            errors += batch_errors
+        batch_results = [
+            (len(batch), elapsed, count_succeeded_macs(batch, batch_output, structured))
+            for (_, batch), (batch_output, _, elapsed) in zip(wave, results)
+            if elapsed is not None
+        ]
+        if sizer and batch_results:
+            sizer.record(batch_results)
+    return (parse_reduced_mtool_output(output) if structured else output), errors
+
+
+class MtoolBatchSizer:
+    """
+    Chooses how many modems to give mtool at once, because sometimes it struggles when we give it
+    too many at a time. Grows the batch size a little after each wave of batches that finishes
+    quickly with the command succeeding on most of the modems, and cuts it in half after a wave in
+    which a batch was slow enough to count as timing out or the command failed on too many modems.
+    """
+
+    def __init__(self, name, initial_size, adaptive=True):
+        """
+        Initialize an instance of this class.
+
+        :param name: a string representing what the batches are for, used when logging sizes
+        :param initial_size: a number representing the batch size to start with
+        :param adaptive: True to adjust the batch size as we go, False to keep it fixed
+        """
+        self.name = name
+        self.size = initial_size
+        self.adaptive = adaptive
+        self.history = []
+
+    def record(self, batch_results):
+        """
+        Adjust the batch size based on how a wave of batches went.
+
+        :param batch_results: a list of tuples (batch size, seconds the batch took, quantity of
+                              modems in the batch that mtool ran the command on successfully)
+        """
+        slow = any(elapsed > SLOW_BATCH_SECS for _, elapsed, _ in batch_results)
+        success_rate = sum(succeeded for _, _, succeeded in batch_results) / max(
+            1, sum(size for size, _, _ in batch_results)
+        )
+        fast_and_full = all(
+            elapsed <= HEALTHY_BATCH_SECS and size >= self.size
+            for size, elapsed, _ in batch_results
+        )
+
+        old_size = self.size
+        if self.adaptive and (slow or success_rate < MIN_HEALTHY_SUCCESS_RATE):
+            self.size = max(MIN_BATCH_SIZE, int(self.size * BATCH_SIZE_DECREASE_FACTOR))
+        elif self.adaptive and fast_and_full:
+            self.size = min(MAX_BATCH_SIZE, self.size + BATCH_SIZE_INCREASE)
+        self.history.append(old_size)
+        print(
+            f" \n[{self.name}] {len(batch_results)} mtool batch(es) of up to {old_size} modems"
+            f" took up to {max(elapsed for _, elapsed, _ in batch_results):.0f} seconds and"
+            f" succeeded on {success_rate:.0%} of modems -> next batch size {self.size}"
+        )
+
+
+def get_mtool_batch_sizer(name, initial_size):
+    """
+    Get the batch sizer for a particular kind of mtool command, creating it on first use so
+    that what it learns about mtool carries over from one call to the next during a job.
+
+    :param name: a string identifying the kind of mtool command (e.g. "reboot")
+    :param initial_size: a number representing the batch size to start with
+    :return: an instance of the MtoolBatchSizer class
+    """
+    if name not in _batch_sizers:
+        _batch_sizers[name] = MtoolBatchSizer(name, initial_size, is_batch_size_adaptive())
+    return _batch_sizers[name]
+
+
+def is_batch_size_adaptive():
+    """
+    Determine whether to adjust the quantity of modems we give mtool at once as we go.
+
+    :return: True if the batch size should adapt during this run of the job, False otherwise.
+             This is specified by an optional parameter to the job. If unspecified, it adapts.
+    """
+    return os.environ.get("adaptive_mtool_batch_size", "true") != "false"
+
+
+def count_succeeded_macs(macs, output, structured=False):
+    """
+    Count how many modems mtool says the command ran successfully on. Modems it reported a
+    failure for, or never got to (e.g. because it hung or crashed), won't be counted.
+
+    :param macs: a list of strings representing the MAC addresses mtool was given
+    :param output: a list of strings representing the lines of output of running mtool
+    :param structured: True if the output was condensed by libs/mtool_output_reducer.py,
+                       False otherwise
+    :return: a number representing how many of the MAC addresses the command succeeded on
+    """
+    records = parse_reduced_mtool_output(output) if structured else parse_mtool_output(output)
+    return sum(
+        1
+        for mac in macs
+        if any(record["succeeded"] for record in records.get(format_mac_addr(mac), []))
     )
 
 
-def mtool_base_cmd():
+def install_output_reducer(jumpbox):
+    """
+    Copy the script that condenses mtool's output (libs/mtool_output_reducer.py) to the MoDOT
+    jumpbox's work_dir, or to that of every jumpbox in a JumpboxPool, unless it's already there.
+
+    :param jumpbox: an instance of the Jumpbox or JumpboxPool class
+    """
+    with open(mtool_output_reducer.__file__, encoding="utf-8") as reducer_file:
+        source = reducer_file.read()
+    for target in getattr(jumpbox, "jumpboxes", [jumpbox]):
+        work_dir = (target.hostname, target.work_dir)
+        if work_dir not in _work_dirs_with_reducer and target.write_file(REDUCER_FILE_NAME, source):
+            _work_dirs_with_reducer.add(work_dir)
+
+
+def reducer_pipe():
+    """
+    Get what to append to an mtool command to condense its output on the jumpbox.
+
+    :return: a string representing a pipe into the script copied by install_output_reducer()
+    """
+    return f" | {MTOOL_PYTHON_PATH_ON_JB} {REDUCER_FILE_NAME} {MAX_REDUCED_LINES}"
+
+
+def parse_reduced_mtool_output(output):
+    """
+    Index the condensed output of running a command via mtool by MAC address.
+
+    :param output: a list of strings representing the lines of JSON printed by
+                   libs/mtool_output_reducer.py on the jumpbox
+    :return: a dictionary like the one returned by parse_mtool_output()
+    """
+    records = {}
+    for line in output:
+        try:
+            block = json.loads(line)
+        except ValueError:
+            continue  # not one of the reducer's lines, e.g. the echo of a prompt answer
+        record = make_mtool_record(block["sw version"], block["status"] or "", block["lines"])
+        for mac in block["macs"]:
+            records.setdefault(mac, []).append(record)
+    return records
+
+
+def is_mtool_output_reduced():
+    """
+    Determine whether to condense mtool's output on the jumpbox before it's sent back.
+
+    :return: True if mtool's output should be condensed during this run of the job, False
+             otherwise. This is specified by an optional parameter to the job. If unspecified,
+             it isn't condensed.
+    """
+    return os.environ.get("reduce_mtool_output", "false") == "true"
+
+
+def mtool_base_cmd(set_acl=True):
     """
     Get the base command to run mtool.
 
     If the mtool-file-path environment variable is present, this will
     override the default location in order to test custom mtool changes.
 
+    :param set_acl: True to give mtool access to our home directory as part of the command,
+                    False if Jumpbox.grant_mtool_access() has already been called instead
     :return: a string representing the command that Jenkins will need
              to run on the jumpbox in order to run mtool
     """
     return (
-        "setfacl -R -m u:sshproxy:rwx ~/ > /dev/null 2>&1 ;"
-        " sudo -E PATH=$PATH -u sshproxy /var/tmp/modot_venv/bin/python"
+        ("setfacl -R -m u:sshproxy:rwx ~/ > /dev/null 2>&1 ; " if set_acl else "")
+        + f"sudo -E PATH=$PATH -u sshproxy {MTOOL_PYTHON_PATH_ON_JB}"
         f" {os.environ['mtool_file_path'] or MTOOL_FILE_PATH_ON_JB}"
     )
 
@@ -53,9 +381,9 @@ def create_mac_list_file(jumpbox, file_name, macs):
     :param jumpbox: an instance of the class used to connect to the MoDOT jumpbox
     :param file_name: a string representing the name of the file to be created
     :param macs: a list of strings representing the MAC addresses to put in the file
+    :return: True if the file was created successfully, False otherwise
     """
-    mac_list = "\n".join(macs)
-    jumpbox.run_command(f"rm {file_name}; touch {file_name}; echo '{mac_list}' >> {file_name}")
+    return jumpbox.write_file(file_name, "".join(f"{mac}\n" for mac in macs))
 
 
 def mtool_file_suffix():
@@ -67,24 +395,109 @@ def mtool_file_suffix():
     return f"_{datetime.now().strftime('%Y-%m-%d')}.txt"
 
 
+def iter_mtool_records(output):
+    """
+    Walk through the output of running a command via mtool once, yielding one record for
+    each block of output that mtool printed for a modem.
+
+    Each block starts with a line containing the modem's MAC address, followed by a line
+    containing its "swVersion:", a line with the command's status, and then the stdout of the
+    command (if any) up until the start of the next block.
+
+    :param output: a list of strings representing the lines of output of
+                   running a command on a list of modems via mtool
+    :return: a generator of tuples (mac, record) where mac is a string representing a MAC address
+             in uppercase colon separated format and record is a dictionary that looks like:
+             {
+                 "sw version": "<text after swVersion:>",
+                 "succeeded": True if the status line says the command ran successfully,
+                 "lines": [<lines of the command's stdout>],
+                 "beam id": a number parsed from a "beamId:" first stdout line, or None,
+             }
+    """
+    starts = [
+        i
+        for i in range(len(output) - 1)
+        if "swVersion:" in output[i + 1] and MAC_ADDR_REGEX.search(output[i])
+    ]
+    for index, start in enumerate(starts):
+        end = starts[index + 1] if index + 1 < len(starts) else len(output)
+        record = make_mtool_record(
+            output[start + 1].split("swVersion:", 1)[1].strip(),
+            output[start + 2] if start + 2 < len(output) else "",
+            output[start + 3 : end],  # noqa: E203
+        )
+        for mac in MAC_ADDR_REGEX.findall(output[start]):
+            yield mac.upper(), record
+
+
+def make_mtool_record(sw_version, status, lines):
+    """
+    Make the record of the output mtool printed for a modem.
+
+    :param sw_version: a string representing the text after swVersion:
+    :param status: a string representing the line with the command's status
+    :param lines: a list of strings representing the lines of the command's stdout
+    :return: a dictionary as described in iter_mtool_records()
+    """
+    beam_id = None
+    if lines and "beamId:" in lines[0]:
+        try:
+            beam_id = int(lines[0].split()[1])
+        except (IndexError, ValueError):
+            pass
+    return {
+        "sw version": sw_version,
+        "succeeded": "ran successfully" in status,
+        "lines": lines,
+        "beam id": beam_id,
+    }
+
+
+def parse_mtool_output(output):
+    """
+    Index the output of running a command via mtool by MAC address in a single pass, so that
+    checking the results for each modem in the batch doesn't require rescanning the output.
+
+    :param output: a list of strings representing the lines of output of
+                   running a command on a list of modems via mtool, or output
+                   that has already been parsed by this function
+    :return: a dictionary mapping MAC addresses in uppercase colon separated format to
+             lists of records as described in iter_mtool_records()
+    """
+    if isinstance(output, dict):
+        return output
+    records = {}
+    for mac, record in iter_mtool_records(output):
+        records.setdefault(mac, []).append(record)
+    return records
+
+
+def get_mtool_records(output, mac):
+    """
+    Get the records of the output mtool printed for a particular modem.
+
+    :param output: a list of strings representing the output of running a command on a list of
+                   modems via mtool, or that output already parsed by parse_mtool_output()
+    :param mac: a string representing the MAC address of one of those modems
+    :return: a list of dictionaries as described in iter_mtool_records()
+    """
+    return parse_mtool_output(output).get(format_mac_addr(mac), [])
+
+
 def check_if_cmd_no_output_succeeded(output, mac):
     """
     By looking through the output of running a command via mtool that has no expected output
     at the command level, determine whether this command succeeded for a particular modem.
 
-    :param output: a string representing the output of running
-                   a command on a list of modems via mtool
+    Pass the output through parse_mtool_output() first when checking many modems.
+
+    :param output: a list of strings representing the output of running a command on a list of
+                   modems via mtool, or that output already parsed by parse_mtool_output()
     :param mac: a string representing the MAC address of one of those modems
     :return: True if the command succeeded for that modem, False otherwise
     """
-    for i in range(len(output) - 2):
-        if (
-            format_mac_addr(mac) in output[i]
-            and "swVersion:" in output[i + 1]
-            and "ran successfully" in output[i + 2]
-        ):
-            return True
-    return False
+    return any(record["succeeded"] for record in get_mtool_records(output, mac))
 
 
 def check_if_cmd_had_expected_output(output, mac, expected_output):
@@ -92,21 +505,19 @@ def check_if_cmd_had_expected_output(output, mac, expected_output):
     By looking through the output of running a command via mtool that expects stdout output at the
     command level, determine whether this command had the expected output for a particular modem.
 
-    :param output: a string representing the output of running
-                   a command on a list of modems via mtool
+    Pass the output through parse_mtool_output() first when checking many modems.
+
+    :param output: a list of strings representing the output of running a command on a list of
+                   modems via mtool, or that output already parsed by parse_mtool_output()
     :param mac: a string representing the MAC address of one of those modems
     :param expected_output: a string representing a phrase we expect to find
                             in the stdout of the command we used mtool to run
     :return: True if the command had the expected output for that modem, False otherwise
     """
-    for i in range(len(output) - 3):
-        if (
-            format_mac_addr(mac) in output[i]
-            and "swVersion:" in output[i + 1]
-            and expected_output in output[i + 3]
-        ):
-            return True
-    return False
+    return any(
+        record["lines"] and expected_output in record["lines"][0]
+        for record in get_mtool_records(output, mac)
+    )
 
 
 def format_mac_addr(mac):
@@ -2,57 +2,90 @@
 Contains functionality for querying a MySQL database.
 """
 
+import re
+import atexit
+import threading
+from collections import OrderedDict
 import mysql.connector as mysql
 from tabulate import tabulate
 
+# how many server-side prepared statements to keep open on each pooled connection
+MAX_PREPARED_STATEMENTS = 32
+
+# how many rows iterate_query() fetches from the server at a time
+FETCH_SIZE = 1000
+
+# matches a named (pyformat) query parameter, e.g. %(mac)s
+NAMED_PARAM_REGEX = re.compile(r"%\((\w+)\)s")
+
+# connections that aren't in use, keyed by (hostname, database, username), so that connecting
+# to a database we've already connected to during the job doesn't need a new login
+_idle_connections = {}
+_pool_lock = threading.Lock()
+
 
 class MySqlDb:
     """
     The MySQL database class
+
+    Connections are taken from a pool shared by the whole job and returned to it on disconnect,
+    so creating a new instance for every query is cheap after the first one.
+
+    Example usage:
+        with MySqlDb(usr, pwd, hostname, database) as mysql_db:
+            mysql_db.execute_query("SELECT ...", result_expected=True)
     """
 
     def __init__(self, usr, pwd, hostname, database):
         """
-        Initialize the MySQL class by pulling the credentials
-        from Vault and connecting to the MySQL database.
+        Initialize the MySQL class by connecting to the MySQL database.
+
+        :param usr: a string representing the username to log in with
+        :param pwd: a string representing the password to log in with, or a function that
+                    returns it (so that it's only looked up if we need a new connection)
+        :param hostname: a string representing the database server's hostname
+        :param database: a string representing the name of the database
         """
         self.usr = usr
         self.pwd = pwd
         self.hostname = hostname
         self.database = database
+        self.pooled = None
         self.conn = None
         self.cursor = None
+        self.cursor_is_prepared = False
         self.connect()
 
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *_):
+        self.disconnect()
+
     def connect(self):
         """
-        Connect to the database.
+        Connect to the database, reusing an idle connection from the pool if there is one.
         """
         try:
-            self.conn = mysql.connect(
-                host=self.hostname,
-                user=self.usr,
-                passwd=self.pwd,
-                database=self.database,
-                connect_timeout=300,
-                autocommit=True,
-            )
+            self.pooled = acquire_connection(self.usr, self.pwd, self.hostname, self.database)
+            self.conn = self.pooled.conn
             self.cursor = self.conn.cursor()
-            print(f" \nconnected to {self.hostname}")
+            self.cursor_is_prepared = False
         except Exception as ex:
             print(f" \nERROR: can't connect to {self.hostname} with username {self.usr}\n\t{ex}")
             self.disconnect()
 
     def disconnect(self):
         """
-        Disconnect from the database if connected.
+        Disconnect from the database if connected, returning the connection to the pool.
         """
-        if self.cursor:
+        if self.cursor and not self.cursor_is_prepared:
             self.cursor.close()
-            self.cursor = None
-        if self.conn:
-            self.conn.close()
-            self.conn = None
+        self.cursor = None
+        if self.pooled:
+            release_connection(self.pooled)
+            self.pooled = None
+        self.conn = None
 
     def is_connected(self):
         """
@@ -62,7 +95,9 @@ class MySqlDb:
         """
         return self.conn and self.cursor
 
-    def execute_query(self, query, result_expected, params=None, use_dictionary=True, verbose=True):
+    def execute_query(
+        self, query, result_expected, params=None, use_dictionary=True, verbose=True, prepared=False
+    ):  # pylint: disable=too-many-arguments
         """
         Execute a query on the database.
 
@@ -75,6 +110,10 @@ class MySqlDb:
                                mapping column names to values, False to return the
                                results as a list of tuples containing values
         :param verbose: True to print the query and its result, False otherwise
+        :param prepared: True to run the query as a server-side prepared statement that's kept
+                         around for the next time the same query is run on this connection, so
+                         that the server only has to parse it once. Worth it for queries that
+                         get run over and over with different parameters.
         :return: a list of strings representing the rows in the output of the query or the
                  empty list if there was no output or if the query couldn't be executed
         """
@@ -87,17 +126,26 @@ class MySqlDb:
 
         try:
             # Ensure that the results will be stored the intended format.
-            self.cursor = self.conn.cursor(dictionary=use_dictionary)
+            if self.cursor and not self.cursor_is_prepared:
+                self.cursor.close()
+            if prepared:
+                query, params = to_positional_params(query, params)
+                self.cursor = self.pooled.prepared_cursor(query)
+            else:
+                self.cursor = self.conn.cursor(dictionary=use_dictionary)
+            self.cursor_is_prepared = prepared
 
             # Execute the query.
             if verbose:
                 print(f" \nrunning query:\n{query}")
-            self.cursor.execute(query, params=params)
+            self.cursor.execute(query, params)
             if verbose:
                 print(f" \nran query:\n{self.cursor.statement}")
 
             # Return the results.
             result = self.cursor.fetchall() if result_expected else []
+            if prepared and use_dictionary:
+                result = [dict(zip(self.cursor.column_names, row)) for row in result]
             if result and verbose:
                 self.print_as_table(result)
             return result
@@ -107,6 +155,61 @@ class MySqlDb:
             print(f" \nfailed to execute\n{self.cursor.statement}\n{ex}")
             return []
 
+    def iterate_query(self, query, params=None, use_dictionary=True, verbose=True):
+        """
+        Execute a query on the database, yielding the rows of its result as they're read from the
+        server rather than waiting for all of them, so that only a few of them are ever held in
+        memory at once.
+
+        NOTE: the connection can't run any other query until the rows have all been read or
+        the generator has been closed, so don't call execute_query() in the middle of a loop
+        over the rows.
+
+        :param query: a string representing the SQL query to be executed
+        :param params: a dictionary containing the query's parameters, if it has any
+        :param use_dictionary: True to yield each row as a dictionary mapping column
+                               names to values, False to yield it as a tuple of values
+        :param verbose: True to print the query and how many rows it returned, False otherwise
+        :return: a generator of dictionaries or tuples representing the rows in the output of the
+                 query, which yields nothing if the query couldn't be executed
+        """
+
+        # Connect to the database if we weren't already
+        if not self.is_connected():
+            self.connect()
+            if not self.is_connected():
+                return
+
+        cursor = self.conn.cursor(buffered=False, dictionary=use_dictionary)
+        row_count = 0
+        try:
+            if verbose:
+                print(f" \nrunning query:\n{query}")
+            cursor.execute(query, params)
+            if verbose:
+                print(f" \nran query:\n{cursor.statement}")
+
+            # Read the rows from the server a chunk at a time.
+            rows = cursor.fetchmany(FETCH_SIZE)
+            while rows:
+                row_count += len(rows)
+                yield from rows
+                rows = cursor.fetchmany(FETCH_SIZE)
+            if verbose:
+                print(f" \nquery returned {row_count} row(s)")
+
+        # Log any errors.
+        except mysql.errors.ProgrammingError as ex:
+            print(f" \nfailed to execute\n{cursor.statement}\n{ex}")
+
+        # Throw away any rows we didn't get to so that the connection can be used again.
+        finally:
+            try:
+                self.conn.consume_results()
+                cursor.close()
+            except Exception as ex:
+                print(f" \nERROR: couldn't close the cursor for\n{query}\n{ex}")
+
     def print_as_table(self, result, tablefmt="psql"):
         """
         Print the results of a database query in a table format.
@@ -142,3 +245,133 @@ class MySqlDb:
         if self.cursor:
             return self.cursor.rowcount
         return -1
+
+
+class PooledConnection:
+    """
+    A connection to a MySQL database that can be shared (one user at a time) by every instance
+    of MySqlDb that connects to the same database during the job, along with the prepared
+    statements that have been created on it.
+    """
+
+    def __init__(self, key, conn):
+        """
+        Initialize an instance of this class.
+
+        :param key: a tuple (hostname, database, username) identifying the database
+        :param conn: an instance of the MySQLConnection class from mysql.connector
+        """
+        self.key = key
+        self.conn = conn
+        self.statements = OrderedDict()
+
+    def prepared_cursor(self, query):
+        """
+        Get the prepared statement cursor for a query, creating it the first time the
+        query is run on this connection and closing the least recently used one if there
+        are too many.
+
+        :param query: a string representing the SQL query, with %s for each parameter
+        :return: an instance of the MySQLCursorPrepared class from mysql.connector
+        """
+        if query in self.statements:
+            self.statements.move_to_end(query)
+        else:
+            self.statements[query] = self.conn.cursor(prepared=True)
+            if len(self.statements) > MAX_PREPARED_STATEMENTS:
+                _, cursor = self.statements.popitem(last=False)
+                cursor.close()
+        return self.statements[query]
+
+    def close(self):
+        """
+        Close the connection along with its prepared statements.
+        """
+        for cursor in self.statements.values():
+            try:
+                cursor.close()
+            except Exception:
+                pass
+        self.statements.clear()
+        try:
+            self.conn.close()
+        except Exception:
+            pass
+
+
+def acquire_connection(usr, pwd, hostname, database):
+    """
+    Get a connection to a MySQL database, reusing an idle one from the pool if there's one
+    that's still alive and opening a new one otherwise.
+
+    :param usr: a string representing the username to log in with
+    :param pwd: a string representing the password to log in with, or a function that returns it
+    :param hostname: a string representing the database server's hostname
+    :param database: a string representing the name of the database
+    :return: an instance of the PooledConnection class
+    """
+    key = (hostname, database, usr)
+    while True:
+        with _pool_lock:
+            idle = _idle_connections.get(key)
+            pooled = idle.pop() if idle else None
+        if pooled is None:
+            break
+        if pooled.conn.is_connected():
+            return pooled
+        pooled.close()
+
+    conn = mysql.connect(
+        host=hostname,
+        user=usr,
+        passwd=pwd() if callable(pwd) else pwd,
+        database=database,
+        connect_timeout=300,
+        autocommit=True,
+    )
+    print(f" \nconnected to {hostname}")
+    return PooledConnection(key, conn)
+
+
+def release_connection(pooled):
+    """
+    Return a connection to the pool so that the next instance of MySqlDb can reuse it.
+
+    :param pooled: an instance of the PooledConnection class returned by acquire_connection()
+    """
+    try:
+        pooled.conn.consume_results()
+    except Exception:
+        pooled.close()
+        return
+    with _pool_lock:
+        _idle_connections.setdefault(pooled.key, []).append(pooled)
+
+
+@atexit.register
+def close_pooled_connections():
+    """
+    Close every idle connection in the pool.
+    """
+    with _pool_lock:
+        idle = [pooled for pooled_list in _idle_connections.values() for pooled in pooled_list]
+        _idle_connections.clear()
+    for pooled in idle:
+        pooled.close()
+
+
+def to_positional_params(query, params):
+    """
+    Convert a query written for a regular cursor into the form that a prepared statement
+    cursor needs, since prepared statements don't support named parameters or %% escapes.
+
+    :param query: a string representing the SQL query, with %s or %(name)s for each parameter
+    :param params: a dictionary, tuple, or list containing the query's parameters, or None
+    :return: a string representing the query with %s for each parameter, and a tuple containing
+             the parameters in the order they appear in the query
+    """
+    if isinstance(params, dict):
+        names = NAMED_PARAM_REGEX.findall(query)
+        query = NAMED_PARAM_REGEX.sub("%s", query)
+        params = tuple(params[name] for name in names)
+    return query.replace("%%", "%"), tuple(params or ())
@@ -7,13 +7,11 @@ import time
 import datetime
 from io import StringIO
 import xml.etree.ElementTree as etree
-import requests
 import pandas
-from libs import common_utils, vault_utils
+from libs import common_utils, http_utils, jwt_utils, vault_utils
 
 NS = {"default": "http://sdp.viasat.com/sdp/schema/SDP"}
 
-JWT_DIR_PATH = os.path.expanduser("~/etc")
 JWT_FILE_PATH = os.path.expanduser("~/etc/sdpjwt")
 ENV_TO_SDP_API_URL = {
     "dev": "https://dev.sdpapi.viasat.io",
@@ -33,46 +31,29 @@ def get_sdp_api_url(env=None):
     return ENV_TO_SDP_API_URL[env or common_utils.get_environment()]
 
 
-def get_sdp_token(vno, env=None):
+def get_sdp_jwt_manager(vno, env=None):
     """
-    Checks if the current token is valid and gets a new one if it's missing or invalid.
-    :param env: the string "dev", "preprod", or "prod"
+    Get the manager of the JWT token we use as credentials for the SDP API for a VNO.
+
     :param vno: a string representing the VNO for which we need a token
+    :param env: the string "dev", "preprod", or "prod"
+    :return: an instance of the JwtManager class from jwt_utils
+    """
+    env = env or common_utils.get_environment()
+    return jwt_utils.get_jwt_manager(
+        ("sdp", env, vno), f"{JWT_FILE_PATH}_{env}_{vno}", lambda: get_new_sdp_token(vno, env)
+    )
 
-    :return: a string representing a JWT token to use as credentials for the SDP API
+
+def get_sdp_token(vno, env=None):
     """
+    Get a JWT token for the SDP API, reusing the cached one unless it's about to expire.
 
-    env = env or common_utils.get_environment()
-    # Check whether we already have the JWT token saved in a file. If we don't, obtain a new one.
-    try:
-        with open(os.path.expanduser(JWT_FILE_PATH), "r") as jwt_file:
-            jwt = jwt_file.read()
-    except IOError:
-        jwt = get_new_sdp_token(vno, env)
-
-    # Check whether the JWT token we have is valid. If it's not, obtain a new one.
-    try:
-        response = requests.get(
-            get_sdp_api_url() + "/whoami",
-            headers={"Authorization": jwt},
-            verify=False,
-            timeout=60,
-        )
-        if response.status_code != 200:
-            raise ValueError
-    except ValueError:
-        jwt = get_new_sdp_token(vno, env)
-
-    # Ensure that the JWT file directory and file have the correct permissions.
-    try:
-        if oct(os.stat(JWT_DIR_PATH).st_mode) != "0o40700":
-            os.chmod(JWT_DIR_PATH, 0o700)
-        if oct(os.stat(JWT_FILE_PATH).st_mode) != "0o100700":
-            os.chmod(os.path.expanduser(JWT_FILE_PATH), 0o700)
-    except Exception as ex:
-        print(f"JWT file permissions not set. Exception: {ex}")
-
-    return jwt
+    :param vno: a string representing the VNO for which we need a token
+    :param env: the string "dev", "preprod", or "prod"
+    :return: a string representing a JWT token to use as credentials for the SDP API
+    """
+    return get_sdp_jwt_manager(vno, env).get_token()
 
 
 def get_new_sdp_token(vno, env=None):
@@ -93,7 +74,7 @@ def get_new_sdp_token(vno, env=None):
         return None
 
     # Request the JWT token.
-    response = requests.get(
+    response = http_utils.get(
         f"https://jwt.us-or.viasat.io/v1/token?stripe=sdpapi-{env}&name={vno}",
         auth=(
             common_utils.SDP_API_SERVICE_ACCT_USR,
@@ -106,21 +87,7 @@ def get_new_sdp_token(vno, env=None):
         print(f"Unable to get token! Status Code: {response.status_code}")
         return None
 
-    # Store the JWT token in a file so that we don't have to request it every time.
-    token = response.text
-    local_etc_path = os.path.expanduser(JWT_DIR_PATH)
-    if not os.path.exists(local_etc_path):
-        os.mkdir(local_etc_path)
-        print(f"Required dir ({local_etc_path}) created for storing JWT file.")
-    try:
-        with open(os.path.expanduser(JWT_FILE_PATH), "w") as jwt_file:
-            jwt_file.write(token)
-    except IOError as ex:
-        print(
-            f"Cannot access {JWT_FILE_PATH} directory due to {ex}."
-            f" You will have to authenticate each time you run the script."
-        )
-    return token
+    return response.text
 
 
 def get_PPILv2_report_content_types(vno=None, env=None):
@@ -134,9 +101,9 @@ def get_PPILv2_report_content_types(vno=None, env=None):
     """
     env = env or "prod"
     vno = vno or "exederes"
-    response = requests.get(
+    response = get_sdp_jwt_manager(vno, env).request(
+        "GET",
         f"{get_sdp_api_url(env)}/ReportTypes/PPILv2",
-        headers={"Authorization": f"Bearer {get_sdp_token(vno, env)}"},
         verify=False,
         timeout=60,
     )
@@ -174,9 +141,9 @@ def get_PPILv2_available_reports_info(vno=None, env=None):
     """
     env = env or "prod"
     vno = vno or "exederes"
-    response = requests.get(
+    response = get_sdp_jwt_manager(vno, env).request(
+        "GET",
         f"{get_sdp_api_url(env)}/Reports?filter=+reportType=%22PPILv2%22",
-        headers={"Authorization": f"Bearer {get_sdp_token(vno, env)}"},
         verify=False,
         timeout=60,
     )
@@ -219,13 +186,14 @@ def get_PPILv2_report_by_id(report_id, vno=None, env=None):
         return None
     url = f"{get_sdp_api_url(env)}/Reports/{report_id}/data"
     headers = {
-        "Authorization": f"Bearer {get_sdp_token(vno, env)}",
         "Accept-Encoding": "gzip,deflate",
         "Accept": "text/csv",
         "Content-type": "text/csv",
     }
 
-    response = requests.get(url, headers=headers, verify=False, timeout=60)
+    response = get_sdp_jwt_manager(vno, env).request(
+        "GET", url, headers=headers, verify=False, timeout=60
+    )
     if response.status_code == 200:
         data = StringIO(response.text)
         try:
@@ -0,0 +1,231 @@
+"""
+Compares the old (NOT IN + ORDER BY RAND()) and new (NOT EXISTS + random cid keyset, as run by
+AcsDb.sample_modems()) forms of the straggler queries in libs/acs_db.py on a local MySQL database
+seeded with made-up modems.
+
+WARNING: this drops and recreates the CPEManager_CPEs and AXServiceTable tables in the acs_db
+database (the queries name it explicitly), so it refuses to run against anything but localhost.
+
+Usage: python benchmark_acs_queries.py [quantity of modems to seed, default 200000]
+
+The connection is configured with the environment variables benchmark_db_hostname (default
+localhost), benchmark_db_usr (default root), and benchmark_db_pwd (default empty).
+"""
+
+import os
+import sys
+import time
+import random
+import statistics
+import mysql.connector as mysql
+from tabulate import tabulate
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "..", "..")))
+from libs.acs_db import AcsDb, MODEM_STRAGGLER_EXCLUSIONS, build_straggler_query, random_cid_start
+from libs.mysql_db import MySqlDb
+
+DEFAULT_MODEM_COUNT = 200000
+INSERT_CHUNK_SIZE = 5000
+RUNS_PER_QUERY = 5
+LIMIT = 100
+
+HARDWARE = ["UT_7P3_V1", "10504-UT2_XC_XD_XE_US1_ASIC2V2", "SPOCK_HW", "DATA_HW"]
+MODOC_VERSIONS = ["modoc-2.3.1", "modoc-2.4.0", "modoc-2.4.2"]
+
+SCHEMA = [
+    "CREATE DATABASE IF NOT EXISTS acs_db",
+    "USE acs_db",
+    "DROP TABLE IF EXISTS CPEManager_CPEs",
+    "DROP TABLE IF EXISTS AXServiceTable",
+    "CREATE TABLE CPEManager_CPEs ("
+    " cid VARCHAR(32) NOT NULL PRIMARY KEY, state INT NOT NULL,"
+    " softwareVersion VARCHAR(64), hardwareVersion VARCHAR(64),"
+    " INDEX (hardwareVersion))",
+    "CREATE TABLE AXServiceTable ("
+    " id INT NOT NULL AUTO_INCREMENT PRIMARY KEY, cid VARCHAR(32) NOT NULL,"
+    " servicetype VARCHAR(32), value2 VARCHAR(64), value3 VARCHAR(64), value6 VARCHAR(64),"
+    " value24 VARCHAR(64), valueProps TEXT,"
+    " INDEX (cid, servicetype))",
+]
+
+
+def seed(conn, modem_count):
+    """
+    Fill the tables with made-up modems, most of which have modoc installed.
+
+    :param conn: a MySQL connection
+    :param modem_count: a number representing how many modems to make up
+    """
+    cursor = conn.cursor()
+    for statement in SCHEMA:
+        cursor.execute(statement)
+    cids = [f"00A0BC{n:06X}" for n in random.sample(range(16 ** 6), modem_count)]
+    for i in range(0, modem_count, INSERT_CHUNK_SIZE):
+        modems, services = [], []
+        for cid in cids[i : i + INSERT_CHUNK_SIZE]:
+            modems.append(
+                (cid, 4 if random.random() < 0.2 else 1, "UT2_4.2.0.1", random.choice(HARDWARE))
+            )
+            services.append((cid, "Modem", "bra.brres.viasat.com", None, None))
+            if random.random() < 0.9:
+                services.append((cid, "App", None, "modoc", random.choice(MODOC_VERSIONS)))
+        cursor.executemany("INSERT INTO CPEManager_CPEs VALUES (%s, %s, %s, %s)", modems)
+        cursor.executemany(
+            "INSERT INTO AXServiceTable (cid, servicetype, value2, value3, value6)"
+            " VALUES (%s, %s, %s, %s, %s)",
+            services,
+        )
+    conn.commit()
+    cursor.execute("ANALYZE TABLE CPEManager_CPEs, AXServiceTable")
+    cursor.fetchall()
+    cursor.close()
+
+
+def old_straggler_query(hardware_count, service_condition, has_service=False):
+    """
+    Build a query the way AcsDb.get_app_stragglers() used to, for comparison.
+
+    :param hardware_count: a number representing how many hardware versions are in the params
+    :param service_condition: an SQL fragment with the conditions on AXServiceTable
+    :param has_service: True to pull modems that have a matching row in AXServiceTable,
+                        False to pull modems that don't
+    :return: a string representing the query
+    """
+    format_hw_str = ", ".join(["%s"] * hardware_count)
+    membership = "IN" if has_service else "NOT IN"
+    return (
+        f"SELECT cid FROM acs_db.CPEManager_CPEs WHERE {MODEM_STRAGGLER_EXCLUSIONS % ()}"
+        f" AND hardwareVersion IN ({format_hw_str}) AND cid {membership}"
+        f" (SELECT cid FROM AXServiceTable WHERE cid LIKE '00A0BC%' AND {service_condition})"
+        " ORDER BY RAND () LIMIT 0, %s"
+    )
+
+
+def explain_query(conn, query, params):
+    """
+    Print a query's plan.
+
+    :param conn: a MySQL connection
+    :param query: a string representing the query
+    :param params: a tuple containing the query's params
+    """
+    cursor = conn.cursor(dictionary=True)
+    cursor.execute(f"EXPLAIN {query}", params)
+    print(tabulate(cursor.fetchall(), headers="keys", tablefmt="psql"))
+    cursor.close()
+
+
+def time_runs(run):
+    """
+    Call a function that runs one or more queries and reads all their rows a few times.
+
+    :param run: a function that takes no arguments
+    :return: a number representing the median quantity of seconds the function took
+    """
+    durations = []
+    for _ in range(RUNS_PER_QUERY):
+        start = time.perf_counter()
+        run()
+        durations.append(time.perf_counter() - start)
+    return statistics.median(durations)
+
+
+def time_query(conn, query, params):
+    """
+    Run a query a few times, printing its plan.
+
+    :param conn: a MySQL connection
+    :param query: a string representing the query
+    :param params: a tuple containing the query's params
+    :return: a number representing the median quantity of seconds the query took
+    """
+    explain_query(conn, query, params)
+    cursor = conn.cursor()
+
+    def run():
+        cursor.execute(query, params)
+        cursor.fetchall()
+
+    duration = time_runs(run)
+    cursor.close()
+    return duration
+
+
+def time_sampling(conn, acs_db, hardware, condition, condition_params, has_service):
+    """
+    Pull a sample of modems with AcsDb.sample_modems() a few times, printing the plans of the
+    queries it runs. Each sample starts at a new random cid, so some of them need the second,
+    wrapped-around query as well as the first, and both are included in the time.
+
+    :param conn: a MySQL connection
+    :param acs_db: an instance of the AcsDb class connected to the local database
+    :param hardware: a tuple of acceptable hardware versions
+    :param condition: an SQL fragment with the conditions on AXServiceTable
+    :param condition_params: a tuple containing the condition's parameters
+    :param has_service: True to pull modems that have a matching row in AXServiceTable,
+                        False to pull modems that don't
+    :return: a number representing the median quantity of seconds a sample took
+    """
+    for wrap_around in [False, True]:
+        explain_query(
+            conn,
+            build_straggler_query(
+                len(hardware), condition, has_service=has_service, wrap_around=wrap_around
+            ),
+            hardware + condition_params + (random_cid_start(), LIMIT),
+        )
+    return time_runs(
+        lambda: list(
+            acs_db.sample_modems(
+                hardware, condition, condition_params, LIMIT, has_service=has_service
+            )
+        )
+    )
+
+
+def main():
+    """
+    Seed the local database, then time each form of the straggler queries.
+    """
+    hostname = os.environ.get("benchmark_db_hostname", "localhost")
+    if hostname not in ["localhost", "127.0.0.1"]:
+        print(f"ERROR: refusing to drop tables on {hostname}; this only runs on localhost")
+        sys.exit(1)
+    modem_count = int(sys.argv[1]) if len(sys.argv) > 1 else DEFAULT_MODEM_COUNT
+    usr = os.environ.get("benchmark_db_usr", "root")
+    pwd = os.environ.get("benchmark_db_pwd", "")
+    conn = mysql.connect(host=hostname, user=usr, passwd=pwd)
+    print(f"seeding {modem_count} modems")
+    seed(conn, modem_count)
+
+    # Skip AcsDb's own __init__, which looks up the real database's credentials in Vault.
+    acs_db = AcsDb.__new__(AcsDb)
+    acs_db.database = MySqlDb(usr, pwd, hostname, "acs_db")
+
+    hardware = tuple(HARDWARE[:2])
+    cases = [
+        ("missing app", "servicetype = 'App' AND value3 = %s", ("modoc",), False),
+        ("old app version", "servicetype = 'App' AND value6 IN (%s)", ("modoc-2.3.1",), False),
+        ("has service", "servicetype = 'Modem' AND value24 IS NULL", (), True),
+    ]
+    results = []
+    for name, condition, condition_params, has_service in cases:
+        timings = {"case": name}
+        print(f"\n{name}, old form:")
+        timings["[NOT] IN + RAND() (s)"] = time_query(
+            conn,
+            old_straggler_query(len(hardware), condition, has_service=has_service),
+            hardware + condition_params + (LIMIT,),
+        )
+        print(f"\n{name}, new form:")
+        timings["[NOT] EXISTS + keyset (s)"] = time_sampling(
+            conn, acs_db, hardware, condition, condition_params, has_service
+        )
+        results.append(timings)
+    acs_db.database.disconnect()
+    conn.close()
+    print("\n" + tabulate(results, headers="keys", tablefmt="psql", floatfmt=".4f"))
+
+
+if __name__ == "__main__":
+    main()
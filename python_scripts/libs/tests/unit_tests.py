@@ -5,17 +5,42 @@ Contains unit tests for newly add lib functions.
 
 import sys
 import os
+import re
+import json
+import base64
+import threading
 from datetime import date, timedelta, datetime
 
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), "...")))
 import unittest
+from unittest import mock
 
 from libs import vault_utils
 from libs import sdp_api
 from libs import metrignome_api
+from libs import jwt_utils
+from libs import cmt_utils
+from libs import jumpbox
+from libs import mtool_utils
+from libs import mtool_executor
+from libs import mtool_output_reducer
+from libs import mysql_db
+from libs import acs_db
+from libs import beam_drift_db
+from libs import beam_drift_utils
+from libs import beam_drift_pipeline
 
 from jobs.terminal_attention_prioritizer.tap_const import VNO_OPTIONS
 
+# update_stragglers imports its versions list as a top-level module
+sys.path.insert(
+    0,
+    os.path.abspath(
+        os.path.join(os.path.dirname(__file__), "..", "..", "jobs", "straggler_automation")
+    ),
+)
+from jobs.straggler_automation import update_stragglers
+
 VNO = "exederes"
 # VNO = "telbr"
 ENV = "prod"
@@ -51,6 +76,67 @@ class TestVaultUtils(unittest.TestCase):
         # with self.assertRaises(RuntimeError):
         # vault_utils.get_prod_sdp_api_service_account_password("invalidToken")
 
+    def test_secret_cache(self):
+        """
+        test_secret_cache
+        """
+
+        class FakeResponse:
+            """
+            Stands in for a response from Vault.
+            """
+
+            def __init__(self, status_code, body):
+                self.status_code = status_code
+                self.body = body
+
+            def json(self):
+                return self.body
+
+        logins = []
+        reads = []
+
+        def fake_post(url, **kwargs):
+            logins.append(url)
+            token = f"token{len(logins)}"
+            return FakeResponse(200, {"auth": {"client_token": token, "lease_duration": 3600}})
+
+        def fake_get(url, headers, **kwargs):
+            reads.append(url)
+            if headers["X-Vault-Token"] == "token1" and len(logins) == 1 and len(reads) > 2:
+                return FakeResponse(403, {})  # the first token gets revoked
+            return FakeResponse(200, {"data": {"password": url[-1]}, "lease_duration": 0})
+
+        original_post, original_get = vault_utils.http_utils.post, vault_utils.http_utils.get
+        original_env = dict(os.environ)
+        vault_utils.http_utils.post, vault_utils.http_utils.get = fake_post, fake_get
+        os.environ.update({"vault_usr_prod": "usr", "vault_pwd_prod": "pwd"})
+        vault_utils._tokens.clear()
+        vault_utils._secrets.clear()
+        try:
+            passwords = vault_utils.fetch_concurrently(
+                [
+                    lambda name=name: vault_utils.get_service_account_password(name, "prod")
+                    for name in "ab"
+                ]
+            )
+            self.assertEqual(passwords, ["a", "b"])
+            self.assertEqual(vault_utils.get_service_account_password("a", "prod"), "a")
+            self.assertEqual((len(logins), len(reads)), (1, 2))
+            self.assertEqual(vault_utils.get_service_account_password("c", "prod"), "c")
+            self.assertEqual((len(logins), len(reads)), (2, 4))
+
+            # A secret read with someone else's token is cached separately from ours.
+            for _ in range(2):
+                self.assertEqual(vault_utils.get_secret("prod", "x/a", "password", "a", "t"), "a")
+            self.assertEqual((len(logins), len(reads)), (2, 5))
+        finally:
+            vault_utils.http_utils.post, vault_utils.http_utils.get = original_post, original_get
+            os.environ.clear()
+            os.environ.update(original_env)
+            vault_utils._tokens.clear()
+            vault_utils._secrets.clear()
+
 
 class TestSdpApi(unittest.TestCase):
     """
@@ -168,3 +254,902 @@ class TestMetrignomeApi(unittest.TestCase):
         offline_uts = len(reason_dict)
         print(f"\n {VNO} number of offline UTs: {offline_uts}")
         self.assertTrue(offline_uts)
+
+
+class TestJwtUtils(unittest.TestCase):
+    """
+    Test the functions in libs/jwt_utils.py
+    """
+
+    def test_decode_jwt_expiry(self):
+        """
+        test_decode_jwt_expiry
+        """
+        payload = base64.urlsafe_b64encode(json.dumps({"exp": 1700000000}).encode())
+        token = f"header.{payload.decode().rstrip('=')}.signature"
+        self.assertEqual(jwt_utils.decode_jwt_expiry(token), 1700000000)
+        self.assertEqual(jwt_utils.decode_jwt_expiry(f"Bearer {token}"), 1700000000)
+        self.assertIsNone(jwt_utils.decode_jwt_expiry("not a jwt"))
+        self.assertIsNone(jwt_utils.decode_jwt_expiry(None))
+
+    def test_request_without_token(self):
+        """
+        test_request_without_token
+        """
+        requests_sent = []
+        original_request = jwt_utils.http_utils.request
+        jwt_utils.http_utils.request = lambda *args, **kwargs: requests_sent.append(args)
+        manager = jwt_utils.JwtManager("/nonexistent/jwt_token", lambda: None)
+        try:
+            with self.assertRaises(RuntimeError):
+                manager.request("GET", "https://example.com")
+        finally:
+            jwt_utils.http_utils.request = original_request
+        self.assertEqual(requests_sent, [])
+
+
+class TestCmtUtils(unittest.TestCase):
+    """
+    Test the functions in libs/cmt_utils.py
+    """
+
+    def test_ping_modems(self):
+        """
+        test_ping_modems
+        """
+
+        class FakeResponse:
+            """
+            Stands in for a response from CM-T.
+            """
+
+            status_code = 200
+
+        def fake_cmt_request(method, url, **kwargs):
+            if "/bad/" in url:
+                raise cmt_utils.requests.exceptions.ConnectionError("connection reset")
+            if "/tokenless/" in url:
+                raise RuntimeError("Failed to get a JWT token")
+            return FakeResponse()
+
+        original_request, original_url = cmt_utils.cmt_request, cmt_utils.get_cmt_api_url
+        cmt_utils.cmt_request, cmt_utils.get_cmt_api_url = fake_cmt_request, lambda: "cmt"
+        try:
+            self.assertEqual(
+                cmt_utils.ping_modems(["good", "bad", "tokenless"], 3), [True, False, False]
+            )
+        finally:
+            cmt_utils.cmt_request, cmt_utils.get_cmt_api_url = original_request, original_url
+
+
+class TestJumpbox(unittest.TestCase):
+    """
+    Test the functions in libs/jumpbox.py
+    """
+
+    def test_make_run_id(self):
+        """
+        test_make_run_id
+        """
+        os.environ["BUILD_TAG"] = "jenkins-folder/job name-42"
+        run_id = jumpbox.make_run_id()
+        self.assertTrue(run_id.startswith("jenkins-folder_job_name-42_"))
+        self.assertNotEqual(run_id, jumpbox.make_run_id())
+
+    def test_run_on_least_loaded(self):
+        """
+        test_run_on_least_loaded
+        """
+
+        class FakeJumpbox:
+            """
+            Stands in for a MoDOT jumpbox that may be unreachable.
+            """
+
+            def __init__(self, hostname, reachable):
+                self.hostname = hostname
+                self.reachable = reachable
+
+            def reconnect_if_necessary(self):
+                if not self.reachable:
+                    raise ConnectionError(f"lost connection to {self.hostname}")
+
+        pool = jumpbox.JumpboxPool.__new__(jumpbox.JumpboxPool)
+        pool.jumpboxes = [FakeJumpbox("down", False), FakeJumpbox("up", True)]
+        pool.loads = {"down": 0.0, "up": 1.0}
+        pool.in_flight = {"down": 0, "up": 0}
+        pool.lock = threading.Lock()
+        calls = []
+
+        def fake_func(jumpbox_, item):
+            calls.append(jumpbox_.hostname)
+            if item == "fail":
+                raise RuntimeError("mtool failed")
+            return item
+
+        # An unreachable jumpbox is skipped before the function is called...
+        self.assertEqual(pool.run_on_least_loaded(fake_func, "ok"), "ok")
+        self.assertEqual(calls, ["up"])
+
+        # ...but a function that fails once it's running isn't run again elsewhere.
+        pool.jumpboxes[0].reachable = True
+        with self.assertRaises(RuntimeError):
+            pool.run_on_least_loaded(fake_func, "fail")
+        self.assertEqual(calls, ["up", "down"])
+        self.assertEqual(pool.in_flight, {"down": 0, "up": 0})
+
+        pool.jumpboxes[0].reachable = pool.jumpboxes[1].reachable = False
+        with self.assertRaises(ConnectionError):
+            pool.run_on_least_loaded(fake_func, "ok")
+        self.assertEqual(len(calls), 2)
+
+    def test_pool_remote_upload_path(self):
+        """
+        test_pool_remote_upload_path
+        """
+
+        class FakeJumpbox:
+            """
+            Stands in for a MoDOT jumpbox working in a directory under a home directory.
+            """
+
+            def __init__(self, hostname, home_dir):
+                self.hostname = hostname
+                self.home_dir = home_dir
+
+            def remote_upload_path(self, file_name):
+                return f"{self.home_dir}/{jumpbox.RUNS_DIR}/run_1/{file_name}"
+
+        pool = jumpbox.JumpboxPool.__new__(jumpbox.JumpboxPool)
+        pool.jumpboxes = [FakeJumpbox("a", "/home/modot"), FakeJumpbox("b", "/home/modot")]
+        self.assertEqual(
+            pool.remote_upload_path("odu.conf.new"),
+            f"/home/modot/{jumpbox.RUNS_DIR}/run_1/odu.conf.new",
+        )
+
+        # A path that only exists on some of the jumpboxes can't be handed to mtool.
+        pool.jumpboxes[1].home_dir = "/users/modot"
+        with self.assertRaises(RuntimeError):
+            pool.remote_upload_path("odu.conf.new")
+
+    def test_persistent_shell_reads_both_streams(self):
+        """
+        test_persistent_shell_reads_both_streams
+        """
+        marker = "__ut_done_test__"
+
+        class FakeChannel:
+            """
+            Stands in for a shell whose command prints more errors than fit in the channel at
+            once, so that it only gets to print its output after the errors have been read.
+            """
+
+            closed = False
+            eof_received = False
+
+            def __init__(self):
+                errors = "".join(f"error {line}\n" for line in range(1000))
+                self.stderr = (errors + f"{marker}\n").encode()
+                self.stdout = f"done\n{marker} 3\n".encode()
+
+            def recv_ready(self):
+                return not self.stderr and bool(self.stdout)
+
+            def recv(self, size):
+                data, self.stdout = self.stdout[:size], self.stdout[size:]
+                return data
+
+            def recv_stderr_ready(self):
+                return bool(self.stderr)
+
+            def recv_stderr(self, size):
+                size = min(size, 100)
+                data, self.stderr = self.stderr[:size], self.stderr[size:]
+                return data
+
+            def exit_status_ready(self):
+                return False
+
+        shell = jumpbox.PersistentShell.__new__(jumpbox.PersistentShell)
+        shell.channel = FakeChannel()
+        shell.marker = marker
+        output, errors, exit_status = shell.read_until_markers()
+        self.assertEqual(output, ["done"])
+        self.assertEqual(len(errors), 1000)
+        self.assertEqual(errors[-1], "error 999")
+        self.assertEqual(exit_status, 3)
+
+
+class TestMySqlDb(unittest.TestCase):
+    """
+    Test the functions in libs/mysql_db.py
+    """
+
+    def test_to_positional_params(self):
+        """
+        test_to_positional_params
+        """
+        self.assertEqual(
+            mysql_db.to_positional_params(
+                "SELECT * FROM t WHERE a = %(a)s AND b = %(b)s AND c LIKE '00A0BC%%' OR a = %(a)s",
+                {"b": 2, "a": 1},
+            ),
+            ("SELECT * FROM t WHERE a = %s AND b = %s AND c LIKE '00A0BC%' OR a = %s", (1, 2, 1)),
+        )
+        self.assertEqual(mysql_db.to_positional_params("SELECT 1", None), ("SELECT 1", ()))
+
+    def test_connection_pool(self):
+        """
+        test_connection_pool
+        """
+
+        class FakeConnection:
+            """
+            Stands in for a MySQL connection.
+            """
+
+            def is_connected(self):
+                return True
+
+            def consume_results(self):
+                pass
+
+            def close(self):
+                pass
+
+        opened = []
+        original_connect = mysql_db.mysql.connect
+        mysql_db.mysql.connect = lambda **kwargs: opened.append(kwargs) or FakeConnection()
+        try:
+            first = mysql_db.acquire_connection("usr", lambda: "pwd", "host", "db")
+            mysql_db.release_connection(first)
+            second = mysql_db.acquire_connection("usr", lambda: "pwd", "host", "db")
+            third = mysql_db.acquire_connection("usr", "pwd", "host", "db")
+        finally:
+            mysql_db.mysql.connect = original_connect
+            mysql_db.close_pooled_connections()
+        self.assertIs(first, second)
+        self.assertIsNot(second, third)
+        self.assertEqual(len(opened), 2)
+        self.assertEqual(opened[0]["passwd"], "pwd")
+
+    def test_iterate_query(self):
+        """
+        test_iterate_query
+        """
+
+        class FakeCursor:
+            """
+            Stands in for an unbuffered MySQL cursor.
+            """
+
+            statement = "SELECT cid FROM t"
+
+            def __init__(self, rows):
+                self.rows = rows
+                self.fetch_sizes = []
+                self.closed = False
+
+            def execute(self, query, params):
+                pass
+
+            def fetchmany(self, size):
+                self.fetch_sizes.append(size)
+                rows, self.rows = self.rows[:size], self.rows[size:]
+                return rows
+
+            def close(self):
+                self.closed = True
+
+        class FakeConnection:
+            """
+            Stands in for a MySQL connection.
+            """
+
+            def __init__(self, rows):
+                self.cursors = []
+                self.rows = rows
+                self.results_consumed = 0
+
+            def cursor(self, buffered=True, dictionary=False):
+                self.cursors.append(FakeCursor(list(self.rows)))
+                return self.cursors[-1]
+
+            def consume_results(self):
+                self.results_consumed += 1
+
+        fake_db = mysql_db.MySqlDb.__new__(mysql_db.MySqlDb)
+        fake_db.conn = FakeConnection([(i,) for i in range(mysql_db.FETCH_SIZE * 2 + 1)])
+        fake_db.cursor = fake_db.conn.cursor()
+        rows = list(fake_db.iterate_query("SELECT cid FROM t", verbose=False))
+        self.assertEqual(rows, fake_db.conn.rows)
+        self.assertEqual(len(fake_db.conn.cursors[-1].fetch_sizes), 4)
+        self.assertTrue(fake_db.conn.cursors[-1].closed)
+
+        # Stopping partway through should throw away the rest of the rows.
+        rows = fake_db.iterate_query("SELECT cid FROM t", verbose=False)
+        self.assertEqual(next(rows), (0,))
+        rows.close()
+        self.assertEqual(fake_db.conn.results_consumed, 2)
+        self.assertTrue(fake_db.conn.cursors[-1].closed)
+
+
+class TestAcsDb(unittest.TestCase):
+    """
+    Test the functions in libs/acs_db.py
+    """
+
+    def test_build_straggler_query(self):
+        """
+        test_build_straggler_query
+        """
+        query = acs_db.build_straggler_query(
+            2, "servicetype = 'App' AND value3 = %s", extra_filter="softwareVersion LIKE %s"
+        )
+        self.assertEqual(query.count("%s"), 2 + 1 + 1 + 2)
+        self.assertNotIn("%%", query)
+        self.assertNotIn("RAND", query)
+        self.assertIn("NOT EXISTS (SELECT 1 FROM AXServiceTable s WHERE s.cid = c.cid AND", query)
+        self.assertIn("c.cid >= %s ORDER BY c.cid LIMIT %s", query)
+        query = acs_db.build_straggler_query(
+            1, "value24 IS NULL", has_service=True, wrap_around=True
+        )
+        self.assertNotIn("NOT EXISTS", query)
+        self.assertIn("c.cid < %s ORDER BY c.cid LIMIT %s", query)
+        self.assertRegex(acs_db.random_cid_start(), "^00A0BC[0-9A-F]{6}$")
+
+    def test_sample_modems(self):
+        """
+        test_sample_modems
+        """
+
+        class FakeMySqlDb:
+            """
+            Stands in for the ACS database, returning the modems before or after the starting cid.
+            """
+
+            def __init__(self, cids):
+                self.cids = cids
+                self.queries = []
+
+            def iterate_query(self, query, params, use_dictionary, verbose):
+                self.queries.append((query, params))
+                start, limit = params[-2:]
+                if "c.cid <" in query:
+                    cids = [cid for cid in self.cids if cid < start]
+                else:
+                    cids = [cid for cid in self.cids if cid >= start]
+                return iter([{"cid": cid} for cid in cids[:limit]])
+
+        fake_acs_db = acs_db.AcsDb.__new__(acs_db.AcsDb)
+        fake_acs_db.database = FakeMySqlDb(["00A0BC000001", "00A0BC000002", "00A0BCFFFFFF"])
+        modems = list(fake_acs_db.sample_modems(["hw"], "value3 = %s", ("modoc",), 3))
+        self.assertEqual(len({modem["cid"] for modem in modems}), 3)
+        self.assertEqual(fake_acs_db.database.queries[0][1][:2], ("hw", "modoc"))
+
+        # Don't go around again if the first query found enough modems.
+        fake_acs_db.database.queries = []
+        self.assertEqual(len(list(fake_acs_db.sample_modems(["hw"], "", (), 0))), 0)
+        self.assertEqual(len(fake_acs_db.database.queries), 1)
+
+
+class TestBeamDriftDb(unittest.TestCase):
+    """
+    Test the functions in libs/beam_drift_db.py
+    """
+
+    def test_add_brazil_records_in_bulk(self):
+        """
+        test_add_brazil_records_in_bulk
+        """
+
+        class FakeMySqlDb:
+            """
+            Stands in for the beam drift database, keeping track of the queries run on it.
+            """
+
+            def __init__(self, alter_works=True):
+                self.queries = []
+                self.columns = ["mac", "sw_version"]
+                self.alter_works = alter_works
+
+            def execute_query(self, query, result_expected, verbose, params=None):
+                self.queries.append((query, params))
+                if "information_schema" in query:
+                    return [{"COLUMN_NAME": column} for column in self.columns]
+                if query.startswith("ALTER TABLE") and self.alter_works:
+                    self.columns.append("last_checked")
+                return []
+
+        beam_drift_db._brazil_tables_with_tracking.clear()
+        fake_db = beam_drift_db.BeamDriftDb.__new__(beam_drift_db.BeamDriftDb)
+        fake_db.database = FakeMySqlDb()
+        table = "brazil_odu_conf_offline"
+        macs = [f"00A0BC{i:06X}" for i in range(beam_drift_db.CHUNK_SIZE_DEFAULT + 1)]
+        software_versions = {mac: "UT2_3.8.0.2.0" for mac in macs}
+
+        # Until the tracking columns are added, the job writes just the macs and never alters
+        # the table itself.
+        fake_db.add_brazil_records_in_bulk(macs, table, software_versions)
+        queries = [query for query, _ in fake_db.database.queries]
+        self.assertEqual(len(queries), 3)
+        self.assertIn("information_schema", queries[0])
+        self.assertTrue(queries[2].startswith(f"INSERT IGNORE INTO {table} (mac) VALUES (%s);"))
+        self.assertEqual(fake_db.database.queries[2][1], (macs[-1],))
+        fake_db.get_brazil_check_records(table, 7)
+        self.assertIn("1 AS stale", fake_db.database.queries[-1][0])
+
+        # Once they're added, the time of each check is recorded unless the check didn't happen.
+        self.assertTrue(fake_db.add_brazil_tracking_columns(table))
+        self.assertEqual(
+            fake_db.database.queries[-2][0],
+            f"ALTER TABLE {table} ADD COLUMN last_checked DATETIME NULL;",
+        )
+        fake_db.database.queries.clear()
+        fake_db.add_brazil_records_in_bulk(macs[:1], table, software_versions)
+        fake_db.add_brazil_records_in_bulk(macs[:1], table, software_versions, checked=False)
+        queries = [query for query, _ in fake_db.database.queries]
+        self.assertEqual(len(queries), 2)
+        self.assertIn("VALUES (%s, %s, NOW()) ON DUPLICATE KEY UPDATE", queries[0])
+        self.assertIn("VALUES (%s, %s, NULL) ON DUPLICATE KEY UPDATE", queries[1])
+        self.assertEqual(fake_db.database.queries[0][1], (macs[0], "UT2_3.8.0.2.0"))
+
+        # Anything but the brazil tables should be refused rather than formatted into the query.
+        fake_db.add_brazil_records_in_bulk(macs, "goals; DROP TABLE goals", software_versions)
+        self.assertEqual(len(fake_db.database.queries), 2)
+
+        # If the columns couldn't be added, the table shouldn't be treated as having them.
+        beam_drift_db._brazil_tables_with_tracking.clear()
+        fake_db.database = FakeMySqlDb(alter_works=False)
+        self.assertFalse(fake_db.add_brazil_tracking_columns(table))
+        self.assertNotIn(table, beam_drift_db._brazil_tables_with_tracking)
+        beam_drift_db._brazil_tables_with_tracking.clear()
+
+
+class TestBeamDriftUtils(unittest.TestCase):
+    """
+    Test the functions in libs/beam_drift_utils.py
+    """
+
+    def test_check_which_modems_are_online(self):
+        """
+        test_check_which_modems_are_online
+        """
+        listings = {(1, 10): {"00A0BC000001"}, (1, 20): set(), (2, 30): None}
+        pinged = []
+
+        def fake_ping_modems(macs, max_in_flight):
+            pinged.append(sorted(macs))
+            return [mac in ["00:A0:BC:00:00:02", "00:A0:BC:00:00:03"] for mac in macs]
+
+        # 1 is listed on its goal beam, 2 came online on a beam that's neither its original nor
+        # its goal beam, 3 is on a beam whose listing failed, and 4 really is offline.
+        modems = [
+            {"mac": f"00:A0:BC:00:00:0{n}", "orig sat": sat, "orig beam": beam}
+            for n, sat, beam in [(1, 1, 20), (2, 1, 20), (3, 2, 30), (4, 1, 20)]
+        ]
+        for modem in modems:
+            modem.update({"goal sat": 1, "goal beam": 10})
+        original_listing = beam_drift_utils.cmt_utils.get_online_macs_on_beam
+        original_ping = beam_drift_utils.cmt_utils.ping_modems
+        beam_drift_utils.cmt_utils.get_online_macs_on_beam = lambda sat, beam: listings[(sat, beam)]
+        beam_drift_utils.cmt_utils.ping_modems = fake_ping_modems
+        try:
+            online = beam_drift_utils.get_online_macs(modems, set(), 4, True)
+            self.assertEqual(online, {"00:A0:BC:00:00:01", "00:A0:BC:00:00:03"})
+            self.assertEqual(pinged, [["00:A0:BC:00:00:03"]])
+
+            # On a modem's last chance, it's pinged if the listings don't show it as online.
+            last_chance = {"00:A0:BC:00:00:02", "00:A0:BC:00:00:04"}
+            online = beam_drift_utils.get_online_macs(
+                modems, set(), 4, True, last_chance_macs=last_chance
+            )
+            self.assertEqual(
+                online, {"00:A0:BC:00:00:01", "00:A0:BC:00:00:02", "00:A0:BC:00:00:03"}
+            )
+            self.assertEqual(
+                pinged[1], ["00:A0:BC:00:00:02", "00:A0:BC:00:00:03", "00:A0:BC:00:00:04"]
+            )
+        finally:
+            beam_drift_utils.cmt_utils.get_online_macs_on_beam = original_listing
+            beam_drift_utils.cmt_utils.ping_modems = original_ping
+
+
+class TestBeamDriftPipeline(unittest.TestCase):
+    """
+    Test the functions in libs/beam_drift_pipeline.py
+    """
+
+    def test_pipeline(self):
+        """
+        test_pipeline
+        """
+
+        class FakeJumpbox:
+            """
+            Stands in for the MoDOT jumpbox.
+            """
+
+            def __init__(self):
+                self.cleared = []
+
+            def clear_any_previous_results(self, prefix, suffix):
+                self.cleared.append((prefix, suffix))
+
+        class FakeBeamDriftDb:
+            """
+            Stands in for the beam drift database, which the faked steps below never touch.
+            """
+
+        steps = []
+
+        def record(step, result):
+            def fake_step(*args, **kwargs):
+                steps.append((step, sorted(modem["mac"] for modem in args[-1])))
+                return result(args[-1])
+
+            return fake_step
+
+        def check_beams(jumpbox, db, modems, flag_pol_swap_issue_on_failure):
+            # "A" is already fixed by the CWMP restart, "B" needs a new LKG file.
+            steps.append((15 if flag_pol_swap_issue_on_failure else 7, [m["mac"] for m in modems]))
+            if flag_pol_swap_issue_on_failure:
+                return modems, [], [], []
+            return (
+                [m for m in modems if m["mac"] == "A"],
+                [m for m in modems if m["mac"] == "B"],
+                [],
+                [],
+            )
+
+        fakes = {
+            "get_online_macs": lambda modems, *args, **kwargs: {modem["mac"] for modem in modems},
+            "restart_cwmp_on_macs": lambda jumpbox, macs: (macs, []),
+            "check_beams_match_on_modem": check_beams,
+            "check_if_goal_beam_in_lkg": record(8, lambda modems: (modems, [], [], [])),
+            "get_good_lkg_files": record(9, lambda modems: (modems, [])),
+            "back_up_lkg_files": record(10, lambda modems: (modems, [])),
+            "push_good_lkg_files": record(11, lambda modems: (modems, [])),
+            "reboot_modems": record(12, lambda modems: None),
+            "re_pin_beams": record(14, lambda modems: (modems, [])),
+            "ONLINE_CHECK_INTERVAL_SECS": 0,
+            "WAIT_FOR_NEWLY_ONLINE_MODEM_TO_STABILIZE_SECS": 0,
+            "WAIT_AFTER_CWMP_RESTART_SECS": 0,
+            "WAIT_AFTER_REBOOT_SECS": 0,
+        }
+        originals = {name: getattr(beam_drift_pipeline.beam_drift_utils, name) for name in fakes}
+        original_env = dict(os.environ)
+        for name, fake in fakes.items():
+            setattr(beam_drift_pipeline.beam_drift_utils, name, fake)
+        os.environ.update({"skip_lkg_steps": "false", "force_lkg_updates": "false"})
+        try:
+            modems = [{"mac": mac, "goal sat": 1, "goal beam": 2, "goal pol": "L"} for mac in "AB"]
+            jumpbox_ = FakeJumpbox()
+            results = beam_drift_pipeline.BeamDriftPipeline(jumpbox_, FakeBeamDriftDb()).run(modems)
+        finally:
+            for name, original in originals.items():
+                setattr(beam_drift_pipeline.beam_drift_utils, name, original)
+            os.environ.clear()
+            os.environ.update(original_env)
+
+        # Both modems share Step #7, then only "B" goes on through Step #15.
+        self.assertEqual(jumpbox_.cleared, [("sat_", ".conf")])
+        self.assertEqual(
+            steps,
+            [(7, ["A", "B"])] + [(step, ["B"]) for step in [8, 9, 10, 11, 12, 14, 15]],
+        )
+        self.assertEqual(set(results), set(beam_drift_pipeline.RESULT_NAMES))
+        self.assertEqual([m["mac"] for m in results["on_goal_beam_after_cwmp_restart"]], ["A"])
+        for name in ["pushed_lkg_files", "online_after_reboot", "re_pinned", "on_goal_beam"]:
+            self.assertEqual([m["mac"] for m in results[name]], ["B"])
+
+    def test_results_read_by_job(self):
+        """
+        test_results_read_by_job
+        """
+        job_path = os.path.join(
+            os.path.dirname(__file__), "..", "..", "jobs", "correct_beam_drifted_modems.py"
+        )
+        with open(job_path, encoding="utf-8") as job_file:
+            names = set(re.findall(r'results\[\s*"(\w+)"\s*\]', job_file.read()))
+        self.assertIn("failed_to_re_pin", names)
+        self.assertLessEqual(names, set(beam_drift_pipeline.RESULT_NAMES))
+
+    def test_get_modems_left_to_re_pin(self):
+        """
+        test_get_modems_left_to_re_pin
+        """
+        modems = [{"mac": mac} for mac in "ABCD"]
+        results = {"re_pinned": [modems[0]], "failed_to_re_pin": [modems[2]]}
+        self.assertEqual(
+            beam_drift_pipeline.get_modems_left_to_re_pin(modems, results),
+            [modems[1], modems[3]],
+        )
+        self.assertEqual(
+            beam_drift_pipeline.get_modems_left_to_re_pin(
+                modems, {"re_pinned": [], "failed_to_re_pin": []}
+            ),
+            modems,
+        )
+
+
+class TestMtoolUtils(unittest.TestCase):
+    """
+    Test the functions in libs/mtool_utils.py
+    """
+
+    OUTPUT = [
+        "00:A0:BC:11:22:33",
+        "swVersion: UT2_4.2.0.1",
+        "command ran successfully",
+        "beamId: 123",
+        "00:A0:BC:11:22:44",
+        "swVersion: UT2_4.2.0.1",
+        "command failed",
+    ]
+
+    def test_parse_mtool_output(self):
+        """
+        test_parse_mtool_output
+        """
+        records = mtool_utils.parse_mtool_output(self.OUTPUT)
+        self.assertEqual(set(records), {"00:A0:BC:11:22:33", "00:A0:BC:11:22:44"})
+        self.assertEqual(records["00:A0:BC:11:22:33"][0]["beam id"], 123)
+        self.assertEqual(records["00:A0:BC:11:22:44"][0]["lines"], [])
+
+    def test_check_mtool_output(self):
+        """
+        test_check_mtool_output
+        """
+        records = mtool_utils.parse_mtool_output(self.OUTPUT)
+        self.assertTrue(mtool_utils.check_if_cmd_no_output_succeeded(records, "00a0bc112233"))
+        self.assertFalse(mtool_utils.check_if_cmd_no_output_succeeded(records, "00A0BC112244"))
+        self.assertTrue(
+            mtool_utils.check_if_cmd_had_expected_output(self.OUTPUT, "00A0BC112233", "beamId")
+        )
+        self.assertFalse(mtool_utils.check_if_cmd_had_expected_output(records, "00A0BC112244", "0"))
+
+    def test_stream_mtool_records(self):
+        """
+        test_stream_mtool_records
+        """
+        self.assertEqual(
+            list(mtool_utils.stream_mtool_records(iter(self.OUTPUT))),
+            list(mtool_utils.iter_mtool_records(self.OUTPUT)),
+        )
+
+    def test_reduce_mtool_output(self):
+        """
+        test_reduce_mtool_output
+        """
+        reduced = [
+            json.dumps(block)
+            for block in mtool_output_reducer.reduce_mtool_output(
+                ["Password: "] + [f"{line}\n" for line in self.OUTPUT]
+            )
+        ]
+        self.assertEqual(len(reduced), 2)
+        self.assertEqual(
+            mtool_utils.parse_reduced_mtool_output(["Password: "] + reduced),
+            mtool_utils.parse_mtool_output(self.OUTPUT),
+        )
+
+    def test_run_mtool_command_in_batches(self):
+        """
+        test_run_mtool_command_in_batches
+        """
+
+        class FakeJumpbox:
+            """
+            Records the commands it's asked to run instead of running them.
+            """
+
+            password = "password"
+
+            def __init__(self):
+                self.commands = []
+
+            hostname = "jumpbox"
+
+            def write_file(self, file_name, contents):
+                self.commands.append(f"write {file_name}: {contents}")
+                return "unwritable" not in file_name
+
+            def execute(self, command, _):
+                return [command.split(" -i -m ")[1].split()[0]], []
+
+            def run_in_parallel(self, func, items):
+                return [func(self, item) for item in items]
+
+            def max_in_flight(self):
+                return 1
+
+            def grant_mtool_access(self):
+                self.commands.append("setfacl")
+
+        fake_jumpbox = FakeJumpbox()
+        with mock.patch.dict(os.environ, {"mtool_file_path": ""}):
+            output, errors = mtool_utils.run_mtool_command_in_batches(
+                fake_jumpbox, "ut_macs_test.txt", ["a", "b", "c"], 2, "-a run_commands -C reboot"
+            )
+        self.assertEqual(output, ["ut_macs_test_0.txt", "ut_macs_test_1.txt"])
+        self.assertEqual(errors, [])
+        self.assertEqual(
+            fake_jumpbox.commands,
+            ["setfacl", "write ut_macs_test_0.txt: a\nb\n", "write ut_macs_test_1.txt: c\n"],
+        )
+
+        # A batch that can't be run is reported as an error instead of losing the other batches.
+        with mock.patch.dict(os.environ, {"mtool_file_path": ""}):
+            output, errors = mtool_utils.run_mtool_command_in_batches(
+                fake_jumpbox, "unwritable.txt", ["a", "b", "c"], 2, "-a run_commands -C reboot"
+            )
+        self.assertEqual(output, [])
+        self.assertEqual(len(errors), 2)
+        self.assertTrue(errors[0].startswith("ERROR: couldn't create unwritable_0.txt"))
+
+    def test_mtool_batch_sizer(self):
+        """
+        test_mtool_batch_sizer
+        """
+        sizer = mtool_utils.MtoolBatchSizer("test", 35)
+        sizer.record([(35, 10, 35), (35, 20, 30)])
+        self.assertEqual(sizer.size, 35 + mtool_utils.BATCH_SIZE_INCREASE)
+        sizer.record([(40, 10, 40), (5, 10, 5)])
+        self.assertEqual(sizer.size, 40)
+        sizer.record([(40, mtool_utils.SLOW_BATCH_SECS + 1, 40)])
+        self.assertEqual(sizer.size, 20)
+        sizer.record([(20, 10, 2)])
+        self.assertEqual(sizer.size, 10)
+        self.assertEqual(sizer.history, [35, 40, 40, 20])
+
+    def test_count_succeeded_macs(self):
+        """
+        test_count_succeeded_macs
+        """
+        # A modem mtool reported a failure for counts against the batch like one it never reached.
+        macs = ["00A0BC112233", "00A0BC112244", "00A0BC112255"]
+        self.assertEqual(mtool_utils.count_succeeded_macs(macs, self.OUTPUT), 1)
+        reduced = [
+            json.dumps(block)
+            for block in mtool_output_reducer.reduce_mtool_output(
+                [f"{line}\n" for line in self.OUTPUT]
+            )
+        ]
+        self.assertEqual(mtool_utils.count_succeeded_macs(macs, reduced, structured=True), 1)
+
+
+class TestMtoolExecutor(unittest.TestCase):
+    """
+    Test the functions in libs/mtool_executor.py
+    """
+
+    def test_mtool_fleet_executor(self):
+        """
+        test_mtool_fleet_executor
+        """
+
+        class FakeJumpbox:
+            """
+            Pretends to run mtool, answering "0" for one modem, nothing for another modem the
+            first time it's asked, and "1" for it the second time, and never reaching a third.
+            """
+
+            password = "password"
+            hostname = "jumpbox"
+
+            def __init__(self):
+                self.files = {}
+                self.attempts = []
+
+            def write_file(self, file_name, contents):
+                self.files[file_name] = contents.split()
+                return True
+
+            def execute(self, command, _):
+                macs = self.files[command.split(" -i -m ")[1].split()[0]]
+                self.attempts.append(macs)
+                answers = {
+                    "00A0BC112233": ["0"],
+                    "00A0BC112244": [] if len(self.attempts) == 1 else ["1"],
+                }
+                output = []
+                for mac in macs:
+                    if mac in answers:
+                        output += [mtool_utils.format_mac_addr(mac), "swVersion: UT2", "ok"]
+                        output += answers[mac]
+                return output, []
+
+            def run_in_parallel(self, func, items):
+                return [func(self, item) for item in items]
+
+            def max_in_flight(self):
+                return 1
+
+            def grant_mtool_access(self):
+                pass
+
+        fake_jumpbox = FakeJumpbox()
+        with mock.patch.dict(os.environ, {"mtool_file_path": ""}):
+            outcomes = mtool_executor.MtoolFleetExecutor(
+                fake_jumpbox,
+                "test",
+                "-a run_commands -C 'echo'",
+                mtool_executor.expected_output_classifier([("0", "healthy"), ("1", "broken")]),
+                batch_size=10,
+                retries=1,
+                unresolved_outcome="offline",
+            ).run(["00A0BC112233", "00A0BC112244", "00A0BC112255"])
+        self.assertEqual(
+            outcomes,
+            {"00A0BC112233": "healthy", "00A0BC112244": "broken", "00A0BC112255": "offline"},
+        )
+        self.assertEqual(fake_jumpbox.attempts[1], ["00A0BC112244"])
+        self.assertEqual(mtool_executor.macs_with_outcome(outcomes, "healthy"), ["00A0BC112233"])
+
+
+class TestUpdateStragglers(unittest.TestCase):
+    """
+    Test the functions in jobs/straggler_automation/update_stragglers.py
+    """
+
+    @staticmethod
+    def app_rows(cid, hardware_version, apps):
+        """
+        Make the rows AcsDb.iterate_app_services() would return for a modem.
+
+        :param cid: a string representing the modem's cid
+        :param hardware_version: a string representing the modem's hardware version
+        :param apps: a list of dictionaries containing some of the value3, value5, value6 and
+                     value10 columns of each of the modem's App rows, empty if it has none
+        :return: a list of dictionaries representing rows
+        """
+        columns = {"value3": None, "value5": None, "value6": None, "value10": None}
+        return [
+            {"cid": cid, "hardwareVersion": hardware_version, **columns, **app}
+            for app in apps or [{}]
+        ]
+
+    def test_find_app_stragglers(self):
+        """
+        test_find_app_stragglers
+        """
+        ut2, ut = update_stragglers.import_list.UT2_HW[0], update_stragglers.import_list.UT_HW[0]
+        good_apps = [
+            {"value3": "modoc", "value6": "modoc-2.5"},
+            {"value3": "modoc", "value10": "Rules with Version=2.4 and RulesVersion=3.20"},
+            {"value3": "vstats", "value6": "vstats-2.1.4"},
+            {"value3": "esp", "value6": "esp-0.2.69"},
+            {"value3": "statpush", "value5": "3.5"},
+        ]
+        rules = update_stragglers.app_straggler_rules()
+        profiles = {profile for profile, _ in rules}
+        modoc, vstat = "modot_install_modoc", "modot_install_vstat_<hw type>"
+        esp, statpush = "modot_install_esp", "modot_statpush_config_<hw type>"
+
+        # no App rows to check at all
+        self.assertEqual(
+            update_stragglers.find_app_stragglers([], rules),
+            {profile: set() for profile in profiles},
+        )
+
+        rows = (
+            # acceptable versions of everything
+            self.app_rows("A", ut2, good_apps)
+            # an unacceptable modoc version
+            + self.app_rows("B", ut2, [{"value3": "modoc", "value6": "modoc-2.3"}] + good_apps[1:])
+            # unacceptable modoc rules, in a different case than the versions list
+            + self.app_rows(
+                "C", ut2, good_apps + [{"value10": "with version=2.4 and rulesversion=error"}]
+            )
+            # UT hardware doesn't need modoc or vstats, just esp and statpush
+            + self.app_rows("D", ut, good_apps[3:])
+            # a modem without any App rows needs every app
+            + self.app_rows("E", ut2, [])
+            # a statpush version only acceptable on other hardware
+            + self.app_rows("F", ut, good_apps[3:4] + [{"value3": "statpush", "value5": "3.4"}])
+        )
+        self.assertEqual(
+            update_stragglers.find_app_stragglers(rows, rules),
+            {modoc: {"B", "C", "E"}, vstat: {"E"}, esp: {"E"}, statpush: {"E", "F"}},
+        )
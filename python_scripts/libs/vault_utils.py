@@ -2,18 +2,83 @@
 Contains generic functionality for interfacing with the Vault API from Jenkins.
 """
 import os
-import requests
+import time
+import threading
 import urllib3
-from libs import common_utils
+from libs import common_utils, http_utils
 
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
 VAULT_URL = "https://vault.security.viasat.io:8200"
 
+# how long before a token or secret's lease runs out to stop using it and get a new one
+LEASE_REFRESH_MARGIN = 60  # seconds
+
+# tokens keyed by (env, username) and secrets' data keyed by (env, path, vault_token), where
+# vault_token is None for secrets read with our own service account's token, stored as tuples
+# containing the value and the time.monotonic() time its lease runs out (None if it never does)
+_tokens = {}
+_secrets = {}
+_cache_lock = threading.Lock()
+_key_locks = {}
+
+
+def lease_expiry(lease_duration):
+    """
+    Work out when a lease that Vault just gave us will run out.
+
+    :param lease_duration: a number representing how many seconds the lease is for, where 0 (or
+                           None) means that it doesn't run out (e.g. KV secrets with no TTL set)
+    :return: a number representing the time.monotonic() time at which to stop using
+             whatever the lease was for, or None if it doesn't run out
+    """
+    if not lease_duration:
+        return None
+    return time.monotonic() + max(0, int(lease_duration) - LEASE_REFRESH_MARGIN)
+
+
+def get_cached(cache, key):
+    """
+    Look up a token or secret that's still within its lease.
+
+    :param cache: the dictionary to look in (_tokens or _secrets)
+    :param key: a tuple identifying the token or secret
+    :return: the cached value, or None if there isn't one whose lease is still good
+    """
+    with _cache_lock:
+        value, expiry = cache.get(key, (None, None))
+    if value is not None and (expiry is None or time.monotonic() < expiry):
+        return value
+    return None
+
+
+def key_lock(key):
+    """
+    Get the lock that keeps more than one thread from requesting the same token or secret at once.
+
+    :param key: a tuple identifying the token or secret
+    :return: an instance of threading.Lock
+    """
+    with _cache_lock:
+        return _key_locks.setdefault(key, threading.Lock())
+
+
+def forget_vault_token(env, username):
+    """
+    Drop a cached token (e.g. because Vault has stopped accepting it) so that the next call
+    to get_vault_token() logs in again.
+
+    :param env: "preprod" or "prod"
+    :param username: Service account username
+    """
+    with _cache_lock:
+        _tokens.pop(("preprod" if env == "dev" else env, username), None)
+
 
 def get_vault_token(env=None, username=None, password=None):
     """
-    Log in to vault.security.viasat.io to get a token.
+    Log in to vault.security.viasat.io to get a token, or reuse the
+    token from an earlier login with the same account if it hasn't expired.
 
     :param env: "dev", "preprod", or "prod"
     :param username: Service account username
@@ -23,24 +88,112 @@ def get_vault_token(env=None, username=None, password=None):
     env = env or os.environ["environment"]
     env = "preprod" if (env == "dev") else env
     username = username or common_utils.get_expected_env_var(f"vault_usr_{env}")
-    password = password or common_utils.get_expected_env_var(f"vault_pwd_{env}")
+    key = (env, username)
+    with key_lock(("token",) + key):
+        token = get_cached(_tokens, key)
+        if token:
+            return token
+        password = password or common_utils.get_expected_env_var(f"vault_pwd_{env}")
+
+        # Log into Vault.
+        response = http_utils.post(
+            f"{VAULT_URL}/v1/auth/ut-devops-{env}/login/{username}",
+            headers={"Content-Type": "application/json"},
+            json={"password": password},
+            verify=False,
+        )
+
+        # Parse the Vault token from the response, cache it, and return it.
+        try:
+            if response.status_code == 200:
+                auth = response.json()["auth"]
+                with _cache_lock:
+                    _tokens[key] = (auth["client_token"], lease_expiry(auth.get("lease_duration")))
+                return auth["client_token"]
+            raise RuntimeError
+        except (TypeError, KeyError, ValueError, RuntimeError):
+            common_utils.print_http_response(response)
+            raise RuntimeError("Failed to get Vault token.")
+
+
+def get_secret(env, path, field, description, vault_token=None):
+    """
+    Read a field of a secret from Vault, or reuse the secret from an earlier
+    read of the same path with the same token if its lease hasn't run out.
+
+    :param env: "preprod" or "prod", the environment whose Vault service
+                account to log in with if we weren't given a token
+    :param path: a string representing the secret's path after /v1/
+                 (e.g. "secret/viasat/sdp/prod/ut/serviceaccounts/<username>")
+    :param field: a string representing the name of the field to return from the secret's data
+    :param description: a string describing the secret for the error message if it can't be read
+    :param vault_token: (optional) our token for accessing vault
+    :return: a string representing the value of that field of the secret
+    """
+    key = (env, path, vault_token)
+    with key_lock(("secret",) + key):
+        data = get_cached(_secrets, key)
+        if data is None:
+            response = read_secret(env, path, vault_token)
+
+            # Parse the secret from the response and cache it.
+            try:
+                if response.status_code == 200:
+                    data = response.json()["data"]
+                    expiry = lease_expiry(response.json().get("lease_duration"))
+                    with _cache_lock:
+                        _secrets[key] = (data, expiry)
+                else:
+                    raise RuntimeError
+            except (TypeError, KeyError, ValueError, RuntimeError):
+                common_utils.print_http_response(response)
+                raise RuntimeError(f"Failed to get {description}.")
+
+    try:
+        return data[field]
+    except (TypeError, KeyError):
+        raise RuntimeError(f"Failed to get {description}.")
+
 
-    # Log into Vault.
-    response = requests.post(
-        f"{VAULT_URL}/v1/auth/ut-devops-{env}/login/{username}",
-        headers={"Content-Type": "application/json"},
-        json={"password": password},
+def read_secret(env, path, vault_token=None):
+    """
+    Request a secret from Vault, logging in again and retrying once if Vault
+    rejects a token of ours that it has revoked before its lease ran out.
+
+    :param env: "preprod" or "prod"
+    :param path: a string representing the secret's path after /v1/
+    :param vault_token: (optional) our token for accessing vault
+    :return: an instance of the Response class from the requests library
+    """
+    token = vault_token or get_vault_token(env)
+    response = http_utils.get(
+        f"{VAULT_URL}/v1/{path}",
+        headers={"Content-Type": "application/json", "X-Vault-Token": token},
         verify=False,
+        timeout=60,
     )
+    if response.status_code == 403 and not vault_token:
+        forget_vault_token(env, common_utils.get_expected_env_var(f"vault_usr_{env}"))
+        response = http_utils.get(
+            f"{VAULT_URL}/v1/{path}",
+            headers={"Content-Type": "application/json", "X-Vault-Token": get_vault_token(env)},
+            verify=False,
+            timeout=60,
+        )
+    return response
+
+
+def fetch_concurrently(getters):
+    """
+    Get several secrets from Vault at once instead of one after another.
 
-    # Parse the Vault token from the response and return it.
-    try:
-        if response.status_code == 200:
-            return response.json()["auth"]["client_token"]
-        raise RuntimeError
-    except (TypeError, KeyError, ValueError, RuntimeError):
-        common_utils.print_http_response(response)
-        raise RuntimeError("Failed to get Vault token.")
+    Getters that need the same token share a single login (see get_vault_token()).
+
+    :param getters: a list of functions that take no arguments and each return a secret,
+                    e.g. [lambda: get_ut_swkey(token, env), get_acs_db_service_account_password]
+    :return: a list containing the secret returned by each getter, in the same order
+    """
+    return common_utils.run_concurrently(lambda getter: getter(), getters, len(getters))
 
 
 def get_cmt_api_service_account_password(env=None, vault_token=None):
@@ -53,25 +206,14 @@ def get_cmt_api_service_account_password(env=None, vault_token=None):
     """
     env = env or os.environ["environment"]
     env = "preprod" if (env == "dev") else env
-    vault_token = vault_token or get_vault_token(env)
-    service_account_path = f"{VAULT_URL}/v1/secret/viasat/sdp/{env}/ut/serviceaccounts/"
-    cmt_api_service_account = f"ut-devops-{env}_cmt_api_user"
-    response = requests.get(
-        service_account_path + cmt_api_service_account,
-        headers={"Content-Type": "application/json", "X-Vault-Token": vault_token},
-        verify=False,
-        timeout=60,
+    return get_secret(
+        env,
+        f"secret/viasat/sdp/{env}/ut/serviceaccounts/ut-devops-{env}_cmt_api_user",
+        "secret_key",
+        "CM-T API password",
+        vault_token,
     )
 
-    # Parse the password from the response and return it.
-    try:
-        if response.status_code == 200:
-            return response.json()["data"]["secret_key"]
-        raise RuntimeError
-    except (TypeError, KeyError, ValueError, RuntimeError):
-        common_utils.print_http_response(response)
-        raise RuntimeError("Failed to get CM-T API password.")
-
 
 def get_service_account_password(username, env=None, vault_token=None):
     """
@@ -84,24 +226,14 @@ def get_service_account_password(username, env=None, vault_token=None):
     """
     env = env or os.environ["environment"]
     env = "preprod" if (env == "dev") else env
-    vault_token = vault_token or get_vault_token(env)
-    service_account_path = f"{VAULT_URL}/v1/secret/viasat/sdp/{env}/ut/serviceaccounts/{username}"
-    response = requests.get(
-        service_account_path,
-        headers={"Content-Type": "application/json", "X-Vault-Token": vault_token},
-        verify=False,
-        timeout=60,
+    return get_secret(
+        env,
+        f"secret/viasat/sdp/{env}/ut/serviceaccounts/{username}",
+        "password",
+        "Jenkins SVC service account password",
+        vault_token,
     )
 
-    # Parse the password from the response and return it.
-    try:
-        if response.status_code == 200:
-            return response.json()["data"]["password"]
-        raise RuntimeError
-    except (TypeError, KeyError, ValueError, RuntimeError):
-        common_utils.print_http_response(response)
-        raise RuntimeError("Failed to get Jenkins SVC service account password.")
-
 
 def get_streamon_private_key(vault_token, env=None):
     """
@@ -113,26 +245,15 @@ def get_streamon_private_key(vault_token, env=None):
     """
     env = env or os.environ["environment"]
     env = "preprod" if (env == "dev") else env
-    service_account_path = (
-        f"{VAULT_URL}/v1/secret/viasat/sdp/{env}/ut/viasat/streamon"
-        "/security/keys/private/shared_passphrase_xfer/10202021"
-    )
-    response = requests.get(
-        service_account_path,
-        headers={"Content-Type": "application/json", "X-Vault-Token": vault_token},
-        verify=False,
-        timeout=60,
+    return get_secret(
+        env,
+        f"secret/viasat/sdp/{env}/ut/viasat/streamon"
+        "/security/keys/private/shared_passphrase_xfer/10202021",
+        "file",
+        "StreamOn RSA private key",
+        vault_token,
     )
 
-    # Parse the file content from the response and return it.
-    try:
-        if response.status_code == 200:
-            return response.json()["data"]["file"]
-        raise RuntimeError
-    except (TypeError, KeyError, ValueError, RuntimeError):
-        common_utils.print_http_response(response)
-        raise RuntimeError("Failed to get StreamOn RSA private key.")
-
 
 def get_ut_swkey(vault_token, env=None):
     """
@@ -144,25 +265,14 @@ def get_ut_swkey(vault_token, env=None):
     """
     env = env or os.environ["environment"]
     env = "preprod" if (env == "dev") else env
-    service_account_path = (
-        f"{VAULT_URL}/v1/secret/viasat/sdp/{env}/ut/viasat/streamon/security/keys/symmetric/swkey"
-    )
-    response = requests.get(
-        service_account_path,
-        headers={"Content-Type": "application/json", "X-Vault-Token": vault_token},
-        verify=False,
-        timeout=60,
+    return get_secret(
+        env,
+        f"secret/viasat/sdp/{env}/ut/viasat/streamon/security/keys/symmetric/swkey",
+        "file",
+        "SWKEY content",
+        vault_token,
     )
 
-    # Parse the file content from the response and return it.
-    try:
-        if response.status_code == 200:
-            return response.json()["data"]["file"]
-        raise RuntimeError
-    except (TypeError, KeyError, ValueError, RuntimeError):
-        common_utils.print_http_response(response)
-        raise RuntimeError("Failed to get SWKEY content.")
-
 
 def get_acs_db_service_account_password(vault_token=None):
     """
@@ -171,24 +281,14 @@ def get_acs_db_service_account_password(vault_token=None):
     :param vault_token: our token for accessing vault
     :return: a string representing the ACS database service account password
     """
-    vault_token = vault_token or get_vault_token("prod")
-    response = requests.get(
-        f"{VAULT_URL}/v1/secret/viasat/sdp/prod/ut/serviceaccounts/"
-        f"{common_utils.ACS_DB_SERVICE_ACCT_USR}",
-        headers={"Content-Type": "application/json", "X-Vault-Token": vault_token},
-        verify=False,
-        timeout=60,
+    return get_secret(
+        "prod",
+        f"secret/viasat/sdp/prod/ut/serviceaccounts/{common_utils.ACS_DB_SERVICE_ACCT_USR}",
+        "password",
+        "ACS database password",
+        vault_token,
     )
 
-    # Parse the password from the response and return it.
-    try:
-        if response.status_code == 200:
-            return response.json()["data"]["password"]
-        raise RuntimeError
-    except (TypeError, KeyError, ValueError, RuntimeError):
-        common_utils.print_http_response(response)
-        raise RuntimeError("Failed to get ACS database password.")
-
 
 def get_beam_drift_db_service_account_password(vault_token=None):
     """
@@ -197,24 +297,15 @@ def get_beam_drift_db_service_account_password(vault_token=None):
     :param vault_token: our token for accessing vault
     :return: a string representing the beam drift database service account password
     """
-    vault_token = vault_token or get_vault_token("prod")
-    response = requests.get(
-        f"{VAULT_URL}/v1/secret/viasat/sdp/prod/ut/serviceaccounts/"
+    return get_secret(
+        "prod",
+        "secret/viasat/sdp/prod/ut/serviceaccounts/"
         f"{common_utils.BEAM_DRIFT_DB_SERVICE_ACCT_USER}",
-        headers={"Content-Type": "application/json", "X-Vault-Token": vault_token},
-        verify=False,
-        timeout=60,
+        "password",
+        "beam drift database password",
+        vault_token,
     )
 
-    # Parse the password from the response and return it.
-    try:
-        if response.status_code == 200:
-            return response.json()["data"]["password"]
-        raise RuntimeError
-    except (TypeError, KeyError, ValueError, RuntimeError):
-        common_utils.print_http_response(response)
-        raise RuntimeError("Failed to get beam drift database password.")
-
 
 def get_ut_devops_cicd_password(env=None, vault_token=None):
     """
@@ -226,23 +317,14 @@ def get_ut_devops_cicd_password(env=None, vault_token=None):
     """
     env = env or common_utils.get_expected_env_var("environment")
     env = "preprod" if (env == "dev") else env
-    vault_token = vault_token or get_vault_token(env)
-    response = requests.get(
-        f"{VAULT_URL}/v1/secret/viasat/sdp/{env}/ut/serviceaccounts/" f"ut-devops-{env}_cicd",
-        headers={"Content-Type": "application/json", "X-Vault-Token": vault_token},
-        verify=False,
-        timeout=60,
+    return get_secret(
+        env,
+        f"secret/viasat/sdp/{env}/ut/serviceaccounts/ut-devops-{env}_cicd",
+        "password",
+        "stream service account password",
+        vault_token,
     )
 
-    # Parse the password from the response and return it.
-    try:
-        if response.status_code == 200:
-            return response.json()["data"]["password"]
-        raise RuntimeError
-    except (TypeError, KeyError, ValueError, RuntimeError):
-        common_utils.print_http_response(response)
-        raise RuntimeError("Failed to get stream service account password.")
-
 
 def get_prod_sdp_api_service_account_password(vault_token=None):
     """
@@ -251,24 +333,13 @@ def get_prod_sdp_api_service_account_password(vault_token=None):
     :param vault_token: our token for accessing vault
     :return: a string representing the sdp-api service account password
     """
-    vault_token = vault_token or get_vault_token("prod")
-    response = requests.get(
-        f"{VAULT_URL}/v1/secret/viasat/sdp/prod/ut/serviceaccounts/"
-        f"{common_utils.SDP_API_SERVICE_ACCT_USR_VAULT}",
-        headers={"Content-Type": "application/json", "X-Vault-Token": vault_token},
-        verify=False,
-        timeout=60,
+    passwd = get_secret(
+        "prod",
+        f"secret/viasat/sdp/prod/ut/serviceaccounts/{common_utils.SDP_API_SERVICE_ACCT_USR_VAULT}",
+        "password",
+        "sdp api  password",
+        vault_token,
     )
-
-    # Parse the password from the response and return it.
-    try:
-        if response.status_code == 200:
-            if "sdp_api_pwd_prod" in os.environ:  # overwrite the passwd with local env if needed
-                passwd = common_utils.get_expected_env_var("sdp_api_pwd_prod")
-            else:
-                passwd = response.json()["data"]["password"]
-            return passwd
-        raise RuntimeError
-    except (TypeError, KeyError, ValueError, RuntimeError):
-        common_utils.print_http_response(response)
-        raise RuntimeError("Failed to get sdp api  password.")
+    if "sdp_api_pwd_prod" in os.environ:  # overwrite the passwd with local env if needed
+        passwd = common_utils.get_expected_env_var("sdp_api_pwd_prod")
+    return passwd